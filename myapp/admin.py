@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Book, Student, IssuedBook
+from .models import Book, Student, IssuedBook, Task
 
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
@@ -11,10 +11,12 @@ class BookAdmin(admin.ModelAdmin):
 
 @admin.register(Student)
 class StudentAdmin(admin.ModelAdmin):
-    list_display = ('name', 'id_number', 'department', 'phone_number', 'created_at')
-    search_fields = ('name', 'id_number', 'phone_number')
+    list_display = ('name', 'id_number', 'department', 'phone_number', 'user', 'created_at')
+    search_fields = ('name', 'id_number', 'phone_number', 'user__username')
     list_filter = ('department', 'created_at')
     ordering = ('id_number',)
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
 
 
 @admin.register(IssuedBook)
@@ -24,3 +26,12 @@ class IssuedBookAdmin(admin.ModelAdmin):
     list_filter = ('is_returned', 'issue_date', 'return_date')
     readonly_fields = ('issue_date', 'created_at', 'updated_at')
     ordering = ('-issue_date',)
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'run_at', 'attempts', 'max_attempts', 'locked_by', 'finished_at')
+    search_fields = ('name', 'unique_key')
+    list_filter = ('status', 'name')
+    readonly_fields = ('locked_by', 'locked_at', 'finished_at', 'last_error', 'created_at')
+    ordering = ('-run_at',)
@@ -0,0 +1,162 @@
+"""Long-cached, pre-compressed static assets.
+
+``collectstatic`` with ``CompressedManifestStaticFilesStorage`` copies
+every stylesheet to a name carrying a hash of its content (``base.css``
+becomes ``base.1a2b3c4d5e6f.css``) and writes ``.gz`` and, with the
+``brotli`` package installed, ``.br`` copies next to it.  ``{% static %}``
+renders the hashed names, so a changed file gets a new URL and browsers
+may keep the old one for as long as they like.
+
+``StaticAssetsMiddleware`` serves ``STATIC_ROOT`` from the application
+for deployments without a web server in front of it: the best encoding
+the client accepts, a year's ``immutable`` caching for hashed names and
+revalidation for the rest.  A front-end server can serve the same
+directory instead (nginx's ``gzip_static`` and ``brotli_static`` pick up
+the compressed copies); then turn ``LIBRARY_STATIC_SERVE`` off.
+"""
+import gzip
+import mimetypes
+import os
+import re
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.core.files.storage import storages
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+_refused = re.compile(r';\s*q=0(\.0*)?\s*$')
+
+
+def _compressors():
+    """``(encoding, suffix, function)`` for every available compression, best first."""
+    if brotli is not None:
+        yield 'br', '.br', lambda data: brotli.compress(data, quality=11)
+    yield 'gzip', '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Content-hashed static files with compressed copies of the text ones.
+
+    Until ``collectstatic`` has written a manifest, URLs are the plain
+    names, as under ``DEBUG``, so that a fresh checkout renders its pages
+    (and runs its tests) without collecting first.
+    """
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if not dry_run:
+            for name in sorted({*paths, *self.hashed_files.values()}):
+                self.compress(name)
+
+    def compress(self, name):
+        """Write the compressed copies of ``name`` that come out smaller than it."""
+        content_type, _ = mimetypes.guess_type(name)
+        if not content_type or not content_type.startswith(COMPRESSIBLE_TYPES):
+            return
+        path = self.path(name)
+        data = Path(path).read_bytes()
+        worthwhile = len(data) >= settings.LIBRARY_STATIC_COMPRESS_MIN_SIZE
+        for _, suffix, compress in _compressors():
+            compressed = compress(data) if worthwhile else data
+            if len(compressed) < len(data):
+                Path(path + suffix).write_bytes(compressed)
+            elif os.path.exists(path + suffix):
+                # Left over from an earlier version of the file
+                os.remove(path + suffix)
+
+
+def _accepted_encodings(request):
+    accepted = set()
+    for coding in request.headers.get('Accept-Encoding', '').split(','):
+        if coding.strip() and not _refused.search(coding):
+            accepted.add(coding.split(';')[0].strip().lower())
+    return accepted
+
+
+class StaticAssetsMiddleware:
+    """Serve collected static files with compression and far-future caching."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.LIBRARY_STATIC_SERVE or not settings.STATIC_ROOT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.prefix = urlsplit(settings.STATIC_URL).path
+        self.root = str(settings.STATIC_ROOT)
+        # Names that change whenever their content does
+        self.immutable = set(getattr(storages['staticfiles'], 'hashed_files', {}).values())
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        path = self.static_path(request)
+        if path:
+            return self.serve(request, *path)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        path = self.static_path(request)
+        if path:
+            return await sync_to_async(self.serve)(request, *path)
+        return await self.get_response(request)
+
+    def static_path(self, request):
+        """``(name, path)`` of the collected file ``request`` asks for, or None."""
+        if request.method in ('GET', 'HEAD') and request.path_info.startswith(self.prefix):
+            name = request.path_info[len(self.prefix):]
+            try:
+                path = safe_join(self.root, name)
+            except SuspiciousFileOperation:
+                return None
+            if os.path.isfile(path):
+                return name, path
+        return None
+
+    def serve(self, request, name, path):
+        modified = os.stat(path).st_mtime
+        if not was_modified_since(request.headers.get('If-Modified-Since'), modified):
+            response = HttpResponseNotModified()
+        else:
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            accepted = _accepted_encodings(request)
+            for encoding, suffix, _ in _compressors():
+                if (encoding in accepted or '*' in accepted) and os.path.isfile(path + suffix):
+                    response = FileResponse(open(path + suffix, 'rb'), content_type=content_type)
+                    response.headers['Content-Encoding'] = encoding
+                    break
+            else:
+                response = FileResponse(open(path, 'rb'), content_type=content_type)
+            # FileResponse names the file it opened, which may be the compressed copy
+            response.headers.pop('Content-Disposition', None)
+            response.headers['Last-Modified'] = http_date(modified)
+        patch_vary_headers(response, ['Accept-Encoding'])
+        if name in self.immutable:
+            patch_cache_control(response, public=True, max_age=settings.LIBRARY_STATIC_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, public=True, no_cache=True)
+        return response
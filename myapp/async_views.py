@@ -0,0 +1,255 @@
+"""Native async versions of the read-heavy pages, for ASGI deployments.
+
+``myapp.urls`` routes the pages below here instead of to ``myapp.views``
+when ``LIBRARY_ASYNC_VIEWS`` is on.  Under ASGI a sync view occupies a
+thread for the whole request; these wait on the database without one,
+and run a page's independent queries (the listing and its counters, a
+student and their loans) at the same time through ``concurrently()``.
+They render the same templates with the same context as the sync views.
+
+Under WSGI every async view needs an event loop of its own, so leave
+``LIBRARY_ASYNC_VIEWS`` off there.
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.db import connections
+from django.http import Http404
+from django.shortcuts import redirect, render
+from django.urls import path
+from django.utils import timezone
+
+from . import views
+from .conditional import conditional_page
+from .fragments import fragment_context
+from .middleware import resolve_user
+from .routers import replica_reads
+from .models import Book, Student, IssuedBook
+from .stats import book_stats, student_stats, cached_library_stats, cached_overdue_report
+from .streaming import wants_stream
+from .views import (
+    BOOK_ORDERING, BOOK_SORTS, STUDENT_SORTS,
+    _book_json, _page_json, _search_or_paginate, _staff_only, _student_dashboard_sources,
+    _student_json, _wants_json,
+)
+
+
+def _in_transaction():
+    return any(connection.in_atomic_block for connection in connections.all(initialized_only=True))
+
+
+def _on_own_connection(function):
+    @wraps(function)
+    def run():
+        try:
+            return function()
+        finally:
+            # Executor threads outlive the request; hand their connections back
+            connections.close_all()
+    return run
+
+
+async def concurrently(*functions):
+    """The results of the sync ``functions``, run at the same time.
+
+    Each runs in a thread, on a database connection, of its own.  Inside a
+    transaction (``ATOMIC_REQUESTS``, or a test case) other connections
+    would not see its uncommitted writes, so the functions then run one
+    after another on the request's own connection.
+    """
+    if (len(functions) > 1 and settings.LIBRARY_ASYNC_CONCURRENT_QUERIES
+            and not await sync_to_async(_in_transaction)()):
+        return await asyncio.gather(*(
+            sync_to_async(_on_own_connection(function), thread_sensitive=False)()
+            for function in functions
+        ))
+    return [await sync_to_async(function)() for function in functions]
+
+
+def _permission_denied(request):
+    messages.error(request, "You do not have permission to access this page!")
+    return redirect('myapp:home')
+
+
+# ============= DASHBOARD VIEWS =============
+@login_required(login_url='myapp:login')
+@replica_reads
+async def librarian_dashboard(request):
+    """Librarian/Admin dashboard with statistics"""
+    user = await resolve_user(request)
+    if not user.is_staff:
+        return _permission_denied(request)
+
+    stats, overdue, recent_issues = await concurrently(
+        cached_library_stats,
+        cached_overdue_report,
+        lambda: list(IssuedBook.objects.select_related('student', 'book').order_by('-issue_date')[:5]),
+    )
+    context = {
+        'total_books': stats['total_books'],
+        'total_students': stats['total_students'],
+        'available_books': stats['available_books'],
+        'active_issues': stats['active_issues'],
+        'overdue_issues': stats['overdue_issues'],
+        'overdue_loans': overdue['loans'],
+        'overdue_students': overdue['top_students'],
+        'overdue_as_of': overdue['computed_at'],
+        'recent_issues': recent_issues,
+    }
+    return await sync_to_async(render)(request, 'myapp/librarian_dashboard.html', context)
+
+
+@login_required(login_url='myapp:login')
+@replica_reads
+@conditional_page(_student_dashboard_sources, daily=True)
+async def student_dashboard(request):
+    """Student dashboard showing borrowed books and library books"""
+    user = await resolve_user(request)
+    filter_status = request.GET.get('status', 'all')
+
+    def profile_and_loans():
+        borrowing_history = list(
+            IssuedBook.objects.filter(student__user=user).select_related('student', 'book')
+        )
+        if borrowing_history:
+            return borrowing_history[0].student, borrowing_history
+        if request.student:
+            return request.student, list(request.student.issued_books.select_related('book'))
+        return None, []
+
+    (student, borrowing_history), books_page = await concurrently(
+        profile_and_loans,
+        lambda: _search_or_paginate(request, Book, Book.objects.with_status(filter_status), BOOK_ORDERING),
+    )
+    if student is None:
+        messages.info(request, "No student profile found for your account. Please contact the librarian.")
+    if _wants_json(request):
+        return _page_json(books_page, _book_json)
+
+    current_borrowed = [issue for issue in borrowing_history if not issue.is_returned]
+    context = {
+        'student': student,
+        'current_borrowed': current_borrowed,
+        'borrowing_history': borrowing_history,
+        'all_books': books_page,
+        'page': books_page,
+        'filter_status': filter_status,
+        'query': request.GET.get('q', '').strip(),
+        'current_borrowed_count': student.active_loan_count if student else 0,
+        'total_borrowed_count': len(borrowing_history),
+        'overdue_count': sum(issue.is_overdue for issue in current_borrowed),
+        'today': timezone.localdate(),
+    }
+    context.update(await sync_to_async(fragment_context)(
+        books='books', catalogue='catalogue', loans=f'loans:{student.pk if student else None}'
+    ))
+    return await sync_to_async(render)(request, 'myapp/student_dashboard.html', context)
+
+
+# ============= BOOK VIEWS =============
+@login_required(login_url='myapp:login')
+@replica_reads
+@conditional_page(_staff_only(Book.objects.all()))
+async def book_list(request):
+    user = await resolve_user(request)
+    if not user.is_staff:
+        return _permission_denied(request)
+    if wants_stream(request) and not _wants_json(request):
+        # A streamed page is produced by a sync generator either way
+        return await sync_to_async(views.book_list)(request)
+
+    sort = request.GET.get('sort')
+    if sort not in BOOK_SORTS:
+        sort = 'newest'
+    books, stats, fragments = await concurrently(
+        lambda: _search_or_paginate(request, Book, Book.objects.all(), BOOK_SORTS[sort]),
+        book_stats,
+        lambda: fragment_context(books='books'),
+    )
+    if _wants_json(request):
+        return _page_json(books, _book_json)
+
+    context = {
+        'books': books,
+        'page': books,
+        'total_books': stats['total_books'],
+        'available_books': stats['available_books'],
+        'query': request.GET.get('q', '').strip(),
+        'sort': sort,
+        **fragments,
+    }
+    return await sync_to_async(render)(request, 'myapp/book_list.html', context)
+
+
+# ============= STUDENT VIEWS =============
+@login_required(login_url='myapp:login')
+@replica_reads
+@conditional_page(_staff_only(Student.objects.all()))
+async def student_list(request):
+    user = await resolve_user(request)
+    if not user.is_staff:
+        return _permission_denied(request)
+
+    sort = request.GET.get('sort')
+    if sort not in STUDENT_SORTS:
+        sort = 'id_number'
+    filter_status = request.GET.get('status', 'all')
+    students, stats = await concurrently(
+        lambda: _search_or_paginate(
+            request, Student, Student.objects.with_status(filter_status), STUDENT_SORTS[sort]
+        ),
+        student_stats,
+    )
+    if _wants_json(request):
+        return _page_json(students, _student_json)
+
+    context = {
+        'students': students,
+        'page': students,
+        'total_students': stats['total_students'],
+        'query': request.GET.get('q', '').strip(),
+        'sort': sort,
+        'filter_status': filter_status,
+    }
+    return await sync_to_async(render)(request, 'myapp/student_list.html', context)
+
+
+@login_required(login_url='myapp:login')
+@replica_reads
+async def student_detail(request, pk):
+    user = await resolve_user(request)
+    if not user.is_staff:
+        return _permission_denied(request)
+
+    student, issued_books = await concurrently(
+        lambda: Student.objects.filter(pk=pk).first(),
+        lambda: list(IssuedBook.objects.filter(student_id=pk).select_related('book')),
+    )
+    if student is None:
+        raise Http404("No Student matches the given query.")
+
+    context = {
+        'student': student,
+        'issued_books': issued_books,
+        'active_issues': [issue for issue in issued_books if not issue.is_returned],
+        'total_borrowed': student.active_loan_count,
+    }
+    return await sync_to_async(render)(request, 'myapp/student_detail.html', context)
+
+
+ASYNC_VIEWS = {
+    view.__name__: view
+    for view in (librarian_dashboard, student_dashboard, book_list, student_list, student_detail)
+}
+
+
+def with_async_views(urlpatterns):
+    """``urlpatterns`` of myapp.urls with the pages above in place of the sync ones."""
+    return [
+        path(str(pattern.pattern), ASYNC_VIEWS.get(pattern.name, pattern.callback), name=pattern.name)
+        for pattern in urlpatterns
+    ]
@@ -0,0 +1,8 @@
+"""Django's MySQL backend with connections from ``myapp.dbpool``."""
+from django.db.backends.mysql import base
+
+from myapp.dbpool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
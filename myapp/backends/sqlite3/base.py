@@ -0,0 +1,8 @@
+"""Django's SQLite backend with connections from ``myapp.dbpool``."""
+from django.db.backends.sqlite3 import base
+
+from myapp.dbpool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
@@ -0,0 +1,115 @@
+"""Conditional GET (ETag and Last-Modified) for the list and dashboard pages.
+
+A page's validators are the ``MAX(updated_at)`` and ``COUNT(*)`` of every
+table it shows, read in one UNION ALL query of scalar subqueries that the
+indexes answer without reading the rows.  The ETag also covers the user,
+the full query string and, for pages that flag overdue loans, today's
+date, so different users and filters never share one.  Deleting a row
+changes the count, and so the ETag, but not Last-Modified; browsers send
+If-None-Match whenever they hold an ETag, which takes precedence.
+
+Responses are marked ``private, no-cache``: browsers keep them and
+revalidate on every visit, and shared caches do not store them.  No
+validators are computed while messages are waiting to be shown, since a
+304 would swallow them.
+"""
+import datetime
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib import messages
+from django.db import connections
+from django.db.models import Count, Max, Value
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .middleware import resolve_user
+
+
+def _aggregate_sql(queryset, **aggregate):
+    """SQL and parameters of a one-row, one-column aggregate over ``queryset``."""
+    (name,) = aggregate
+    query = queryset.order_by().annotate(part=Value(0)).values('part').annotate(**aggregate).values(name)
+    return query.query.sql_with_params()
+
+
+def _as_datetime(value):
+    # A raw cursor skips the field converters: SQLite returns text, MySQL naive UTC
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, datetime.timezone.utc)
+    return value
+
+
+def change_summary(querysets):
+    """``[(latest updated_at, row count), ...]`` for each queryset, in one query.
+
+    Each figure is a scalar subquery of its own, so that the database can
+    answer MAX from the end of the ``updated_at`` index and COUNT from its
+    smallest index; asked together in one aggregate they cost a scan.
+    """
+    branches, params = [], []
+    for queryset in querysets:
+        latest_sql, latest_params = _aggregate_sql(queryset, latest=Max('updated_at'))
+        rows_sql, rows_params = _aggregate_sql(queryset, rows=Count('*'))
+        branches.append(f'SELECT ({latest_sql}), ({rows_sql})')
+        params.extend([*latest_params, *rows_params])
+    with connections[querysets[0].db].cursor() as cursor:
+        cursor.execute(' UNION ALL '.join(branches), params)
+        return [(_as_datetime(latest), rows) for latest, rows in cursor.fetchall()]
+
+
+def conditional_page(sources, daily=False):
+    """Answer GETs of the decorated view with 304 while its data is unchanged.
+
+    ``sources(request)`` returns the querysets whose rows the page shows,
+    or None when the request will not render the page (a permission
+    redirect, for instance).  With ``daily`` the ETag changes at midnight.
+    """
+    def validators(request):
+        if not hasattr(request, '_page_validators'):
+            request._page_validators = None
+            querysets = sources(request)
+            if querysets and not len(messages.get_messages(request)):
+                summary = change_summary(querysets)
+                key = [request.user.pk, request.get_full_path(), summary]
+                if daily:
+                    key.append(timezone.localdate())
+                digest = hashlib.md5(repr(key).encode(), usedforsecurity=False).hexdigest()
+                last_modified = max((latest for latest, _ in summary if latest), default=None)
+                request._page_validators = (f'W/"{digest}"', last_modified)
+        return request._page_validators
+
+    def etag(request, *args, **kwargs):
+        return (validators(request) or (None, None))[0]
+
+    def last_modified(request, *args, **kwargs):
+        return (validators(request) or (None, None))[1]
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                await resolve_user(request)
+                # condition() calls the validator functions synchronously; they are memoised
+                page_validators = await sync_to_async(validators)(request)
+                response = await conditional_view(request, *args, **kwargs)
+                if page_validators:
+                    patch_cache_control(response, private=True, no_cache=True)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if validators(request):
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
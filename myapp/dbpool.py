@@ -0,0 +1,257 @@
+"""Connection pooling for the MySQL and SQLite backends.
+
+Django pools connections natively only for PostgreSQL.  The backends in
+``myapp.backends`` add the same to MySQL and SQLite: set the engine to
+``myapp.backends.mysql`` (or ``myapp.backends.sqlite3``) and configure
+the pool under ``OPTIONS['pool']``, as for Django's PostgreSQL pool::
+
+    'OPTIONS': {'pool': {'max_size': 10, 'timeout': 10}},
+
+Every worker process keeps one pool per database.  When Django closes a
+connection, at the end of each request with ``CONN_MAX_AGE = 0``, it goes
+back to the pool rather than to the server, and the next request of any
+thread in the process takes it from there without a new TCP connect and
+authentication.  At most ``max_size`` connections are open at once; a
+checkout beyond that waits up to ``timeout`` seconds for one to be
+returned.  Idle connections are checked with ``SELECT 1`` before they are
+handed out (``check``), and replaced after ``max_lifetime`` seconds or
+``max_idle`` seconds unused.  Waits, exhaustion and replacements are
+counted in ``myapp.metrics``.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from .metrics import REGISTRY
+
+POOL_DEFAULTS = {
+    'max_size': 10,
+    'timeout': 10.0,
+    'max_lifetime': 3600.0,
+    'max_idle': 600.0,
+    'check': True,
+}
+# Stock engine -> pooled engine
+POOLED_ENGINES = {
+    'django.db.backends.mysql': 'myapp.backends.mysql',
+    'django.db.backends.sqlite3': 'myapp.backends.sqlite3',
+}
+
+POOL_WAIT = REGISTRY.histogram(
+    'library_db_pool_wait_seconds',
+    'Time to check a connection out of the pool, by database alias.',
+    ['alias'],
+)
+POOL_EXHAUSTED = REGISTRY.counter(
+    'library_db_pool_exhausted_total',
+    'Checkouts that found every pooled connection in use and had to wait.',
+    ['alias'],
+)
+POOL_CONNECTIONS = REGISTRY.counter(
+    'library_db_pool_connections_total',
+    'Connections opened and discarded by the pool, by database alias and event.',
+    ['alias', 'event'],
+)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    """A DB-API connection and the times the pool needs to recycle it."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = self.returned = time.monotonic()
+
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of DB-API connections.
+
+    ``connect()`` opens a new connection; the pool never holds more than
+    ``max_size`` of them, idle, being opened and checked out together.
+    """
+
+    def __init__(self, connect, alias='default', max_size=10, timeout=10.0,
+                 max_lifetime=3600.0, max_idle=600.0, check=True):
+        self.connect = connect
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check = check
+        self.idle = deque()
+        self.checked_out = {}           # id(connection) -> PooledConnection
+        self.opening = 0
+        self.condition = threading.Condition()
+
+    @property
+    def size(self):
+        return len(self.idle) + len(self.checked_out) + self.opening
+
+    def acquire(self):
+        """A usable connection; raises PoolTimeout when none frees up in time."""
+        started = time.monotonic()
+        pooled = self._take()
+        if pooled is not None and self.check and not self._usable(pooled.connection):
+            with self.condition:
+                del self.checked_out[id(pooled.connection)]
+                self.opening += 1
+            self._discard(pooled, 'failed_check')
+            pooled = None
+        if pooled is None:
+            try:
+                pooled = PooledConnection(self.connect())
+            finally:
+                with self.condition:
+                    self.opening -= 1
+                    if pooled is not None:
+                        self.checked_out[id(pooled.connection)] = pooled
+                    self.condition.notify()
+            POOL_CONNECTIONS.inc(alias=self.alias, event='opened')
+        POOL_WAIT.observe(time.monotonic() - started, alias=self.alias)
+        return pooled.connection
+
+    def _take(self):
+        """An idle connection, checked out, or None with a slot reserved to open one."""
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        with self.condition:
+            while True:
+                while self.idle:
+                    pooled = self.idle.pop()
+                    if not self._expired(pooled):
+                        self.checked_out[id(pooled.connection)] = pooled
+                        return pooled
+                    self._discard(pooled, 'expired')
+                if self.size < self.max_size:
+                    self.opening += 1
+                    return None
+                if not waited:
+                    waited = True
+                    POOL_EXHAUSTED.inc(alias=self.alias)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        f"No connection to '{self.alias}' was returned within {self.timeout}s "
+                        f"(pool size {self.max_size})."
+                    )
+                self.condition.wait(remaining)
+
+    def release(self, connection, reusable=True):
+        """Return a checked-out connection; close it instead when not ``reusable``."""
+        with self.condition:
+            pooled = self.checked_out.pop(id(connection), None)
+            if pooled is None:
+                # Not ours (checked out before a fork, or released twice)
+                return
+            if reusable and not self._expired(pooled):
+                pooled.returned = time.monotonic()
+                self.idle.append(pooled)
+            else:
+                self._discard(pooled, 'expired' if reusable else 'unusable')
+            self.condition.notify()
+
+    def close_all(self):
+        """Close the idle connections; checked-out ones are closed when released."""
+        with self.condition:
+            while self.idle:
+                self._discard(self.idle.pop(), 'closed')
+            self.max_lifetime = 0
+            self.condition.notify_all()
+
+    def _expired(self, pooled):
+        now = time.monotonic()
+        return now - pooled.created >= self.max_lifetime or now - pooled.returned >= self.max_idle
+
+    def _usable(self, connection):
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+                cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def _discard(self, pooled, reason):
+        POOL_CONNECTIONS.inc(alias=self.alias, event=f'discarded_{reason}')
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def get_pool(key, connect, alias, options):
+    """The process's pool for ``key``, created with ``options`` on first use."""
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # A forked worker must not share its parent's sockets
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(connect, alias, **{**POOL_DEFAULTS, **options})
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
+        _pools.clear()
+
+
+class PooledDatabaseWrapperMixin:
+    """Take connections from a ``ConnectionPool`` and give them back on close.
+
+    Without ``OPTIONS['pool']`` the backend behaves like the stock one.
+    """
+
+    pool = None
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # The driver must not see the pool's options
+        params.pop('pool', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict['OPTIONS'].get('pool')
+        if not options:
+            return super().get_new_connection(conn_params)
+        settings_dict = self.settings_dict
+        self.pool = get_pool(
+            (self.alias, *(settings_dict[key] for key in ('NAME', 'HOST', 'PORT', 'USER'))),
+            lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params),
+            self.alias,
+            {} if options is True else options,
+        )
+        try:
+            return self.pool.acquire()
+        except PoolTimeout as exc:
+            raise self.Database.OperationalError(str(exc)) from exc
+
+    def _close(self):
+        if self.pool is None or self.connection is None:
+            return super()._close()
+        connection = self.connection
+        # Closed inside atomic(): Django keeps using the object until the block exits
+        reusable = not self.in_atomic_block
+        if reusable and not self.get_autocommit():
+            try:
+                connection.rollback()
+            except Exception:
+                reusable = False
+        self.pool.release(connection, reusable)
@@ -1,8 +1,64 @@
 from django import forms
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.urls import reverse_lazy
+from django.utils.html import format_html
 from .models import Book, Student, IssuedBook
 
 
+class LookupSelect(forms.Select):
+    """A select filled on demand from a JSON lookup endpoint.
+
+    Only the currently chosen option is rendered (one ``pk__in`` query),
+    instead of one ``<option>`` per row in the table.  A search box in
+    front of it queries ``lookup_url`` as the user types; see
+    ``issue_book_form.html``.  Validation is unchanged: the model choice
+    field still resolves just the submitted primary key.
+    """
+
+    def __init__(self, lookup_url, placeholder='Type to search...', attrs=None):
+        super().__init__(attrs)
+        self.lookup_url = lookup_url
+        self.placeholder = placeholder
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-lookup-url'] = str(self.lookup_url)
+        return context
+
+    def selected_keys(self, value):
+        """The submitted values that are valid primary keys; the field reports the others."""
+        pk = self.choices.queryset.model._meta.pk
+        keys = []
+        for item in value:
+            if item in (None, ''):
+                continue
+            try:
+                keys.append(pk.to_python(item))
+            except ValidationError:
+                continue
+        return keys
+
+    def optgroups(self, name, value, attrs=None):
+        selected = self.selected_keys(value)
+        chosen = list(self.choices.queryset.filter(pk__in=selected)) if selected else []
+        groups = [(None, [self.create_option(name, '', '---------', not chosen, 0)], 0)]
+        for index, obj in enumerate(chosen, start=1):
+            option = self.create_option(name, str(obj.pk), str(obj), True, index)
+            groups.append((None, [option], index))
+        return groups
+
+    def render(self, name, value, attrs=None, renderer=None):
+        select = super().render(name, value, attrs, renderer)
+        search = format_html(
+            '<input type="search" class="form-control lookup-search" data-lookup-for="{}" '
+            'placeholder="{}" autocomplete="off">',
+            (attrs or {}).get('id', f'id_{name}'),
+            self.placeholder,
+        )
+        return search + select
+
+
 class BookForm(forms.ModelForm):
     class Meta:
         model = Book
@@ -77,14 +133,22 @@ class IssuedBookForm(forms.ModelForm):
         model = IssuedBook
         fields = ['student', 'book', 'quantity']
         widgets = {
-            'student': forms.Select(attrs={
-                'class': 'form-control',
-                'required': True
-            }),
-            'book': forms.Select(attrs={
-                'class': 'form-control',
-                'required': True
-            }),
+            'student': LookupSelect(
+                reverse_lazy('myapp:lookup_students'),
+                placeholder='Search by ID number or name',
+                attrs={
+                    'class': 'form-control',
+                    'required': True
+                },
+            ),
+            'book': LookupSelect(
+                reverse_lazy('myapp:lookup_books'),
+                placeholder='Search by ISBN, title or author',
+                attrs={
+                    'class': 'form-control',
+                    'required': True
+                },
+            ),
             'quantity': forms.NumberInput(attrs={
                 'class': 'form-control',
                 'placeholder': 'Enter quantity',
@@ -103,6 +167,8 @@ class IssuedBookForm(forms.ModelForm):
         book = cleaned_data.get('book')
         quantity = cleaned_data.get('quantity')
 
+        if quantity is not None and quantity < 1:
+            raise forms.ValidationError("Quantity must be at least 1.")
         if book and quantity and quantity > book.quantity:
             raise forms.ValidationError(
                 f"Not enough books available. Available: {book.quantity}"
@@ -129,10 +195,87 @@ class ReturnBookForm(forms.ModelForm):
     def clean(self):
         cleaned_data = super().clean()
         quantity = cleaned_data.get('quantity')
-        # quantity validation will be done in the view
+        if quantity is not None and quantity < 1:
+            raise forms.ValidationError("Quantity must be at least 1.")
+        # the upper bound is enforced atomically when the return is applied
         return cleaned_data
 
 
+def resolve_loan_items(rows):
+    """Turn ``{'student', 'book', 'quantity'}`` rows into (Student, Book, quantity).
+
+    Students are matched on ``id_number`` and books on ``isbn``, with one
+    query per model for the whole batch.  Every bad row is reported.
+    """
+    errors = []
+    parsed = []
+    for number, row in enumerate(rows, start=1):
+        try:
+            student_key = str(row['student']).strip()
+            book_key = str(row['book']).strip()
+            quantity = int(row.get('quantity') or 1)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            errors.append(f"Row {number}: expected student ID number, ISBN and quantity.")
+            continue
+        if quantity < 1:
+            errors.append(f"Row {number}: quantity must be at least 1.")
+            continue
+        parsed.append((number, student_key, book_key, quantity))
+
+    students = Student.objects.in_bulk({row[1] for row in parsed}, field_name='id_number')
+    books = Book.objects.in_bulk({row[2] for row in parsed}, field_name='isbn')
+    items = []
+    for number, student_key, book_key, quantity in parsed:
+        if student_key not in students:
+            errors.append(f"Row {number}: no student with ID number '{student_key}'.")
+        elif book_key not in books:
+            errors.append(f"Row {number}: no book with ISBN '{book_key}'.")
+        else:
+            items.append((students[student_key], books[book_key], quantity))
+
+    if errors:
+        raise forms.ValidationError(errors)
+    if not items:
+        raise forms.ValidationError("Enter at least one loan.")
+    return items
+
+
+class BulkLoanForm(forms.Form):
+    items = forms.CharField(
+        label='Loans (one per line: student ID number, ISBN, quantity)',
+        widget=forms.Textarea(attrs={
+            'class': 'form-control',
+            'rows': 12,
+            'placeholder': 'S1001, 9780140449136, 1',
+            'required': True
+        })
+    )
+
+    def clean_items(self):
+        rows = []
+        for line in self.cleaned_data['items'].splitlines():
+            if not line.strip():
+                continue
+            parts = [part.strip() for part in line.split(',')]
+            rows.append(dict(zip(('student', 'book', 'quantity'), parts)) if len(parts) <= 3 else None)
+        return resolve_loan_items(rows)
+
+
+class CatalogueImportForm(forms.Form):
+    kind = forms.ChoiceField(
+        label='Import',
+        choices=[('books', 'Books'), ('students', 'Students')],
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    file = forms.FileField(
+        label='CSV or JSON-lines file',
+        widget=forms.FileInput(attrs={
+            'class': 'form-control',
+            'accept': '.csv,.jsonl,.ndjson'
+        })
+    )
+
+
 class RegistrationForm(forms.Form):
     username = forms.CharField(
         max_length=150,
@@ -0,0 +1,72 @@
+"""Version numbers for the template fragments cached with ``{% cache %}``.
+
+A cached fragment's key includes the versions of the data it shows, so a
+change makes the next render miss and the stale entry is never read
+again; it simply ages out.  The versions live in ``LIBRARY_FRAGMENT_CACHE``:
+
+``books``
+    Any change to a Book row, including its stock and loan counters.
+``catalogue``
+    A Book saved or deleted through the ORM or imported, i.e. a possible
+    change of title or author.  Stock movements do not touch it.
+``loans:<student pk>``
+    The student's loans changed.
+
+``myapp.signals`` bumps them on saves and deletes; ``myapp.inventory``
+and the importer bump them for the writes that bypass signals.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _fragment_cache():
+    return caches[settings.LIBRARY_FRAGMENT_CACHE]
+
+
+def _key(name):
+    return f'fragment-version:{name}'
+
+
+def _initial_version():
+    # Never 0: a version that was evicted must not restart at a value whose
+    # fragments may still be cached
+    return time.time_ns()
+
+
+def fragment_versions(**names):
+    """``{alias: version}`` for version ``names`` given as ``alias=name``."""
+    cache = _fragment_cache()
+    keys = {alias: _key(name) for alias, name in names.items()}
+    versions = cache.get_many(keys.values())
+    for key in set(keys.values()) - set(versions):
+        cache.add(key, _initial_version(), timeout=None)
+        versions[key] = cache.get(key)
+    return {alias: versions[key] for alias, key in keys.items()}
+
+
+def fragment_context(**names):
+    """Template context for ``{% cache fragment_timeout ... using=fragment_cache %}``."""
+    return {
+        'fragment_versions': fragment_versions(**names),
+        'fragment_cache': settings.LIBRARY_FRAGMENT_CACHE,
+        'fragment_timeout': settings.LIBRARY_FRAGMENT_CACHE_TIMEOUT,
+    }
+
+
+def bump_fragment_versions(*names):
+    """Outdate every fragment cached under the given versions."""
+    cache = _fragment_cache()
+    for name in names:
+        key = _key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not stored yet, or evicted: nothing can be cached under it
+            if not cache.add(key, _initial_version(), timeout=None):
+                cache.incr(key)
+
+
+def loan_versions(student_pks):
+    return [f'loans:{pk}' for pk in student_pks]
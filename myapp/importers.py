@@ -0,0 +1,150 @@
+"""Streaming CSV / JSON-lines import of books and students.
+
+Rows are read one at a time, validated with the same rules as
+``BookForm`` / ``StudentForm`` and written in chunks with a single
+``bulk_create(update_conflicts=True)`` per chunk, so an existing ``isbn``
+or ``id_number`` is updated in place and memory use does not depend on
+the size of the file.
+"""
+import csv
+import json
+
+from django.db import connection, transaction
+from django.db.models import F
+
+from .forms import BookForm, StudentForm
+from .fragments import bump_fragment_versions
+from .models import Book, Student
+from .search import get_backend
+from .stats import invalidate_library_stats
+
+FORMATS = ('csv', 'jsonl')
+MAX_REPORTED_ERRORS = 1000
+
+
+class BookImportForm(BookForm):
+    def validate_unique(self):
+        # An existing ISBN is not an error here: the row updates that book
+        pass
+
+
+class StudentImportForm(StudentForm):
+    def validate_unique(self):
+        # An existing ID number is not an error here: the row updates that student
+        pass
+
+
+IMPORTERS = {
+    'books': {
+        'model': Book,
+        'form': BookImportForm,
+        'key': 'isbn',
+        'update_fields': ['title', 'author', 'quantity', 'updated_at'],
+        # Recomputed after each upsert: an updated book may have copies on loan
+        'derived': {'total_copies': F('quantity') + F('on_loan_copies')},
+        'fragments': ('books', 'catalogue'),
+    },
+    'students': {
+        'model': Student,
+        'form': StudentImportForm,
+        'key': 'id_number',
+        'update_fields': ['name', 'department', 'phone_number', 'updated_at'],
+        'derived': {},
+        'fragments': (),
+    },
+}
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def guess_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def iter_records(stream, fmt):
+    """Yield ``(line_number, record_dict)`` from a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield line_number, exc
+                continue
+            yield line_number, record
+    else:
+        raise ValueError(f"Unknown import format '{fmt}'; expected one of {FORMATS}.")
+
+
+def _upsert(importer, chunk):
+    options = {'update_conflicts': True, 'update_fields': importer['update_fields']}
+    if connection.features.supports_update_conflicts_with_target:
+        # MySQL upserts on any unique key and rejects an explicit target
+        options['unique_fields'] = [importer['key']]
+    with transaction.atomic():
+        importer['model'].objects.bulk_create(chunk.values(), **options)
+        if importer['derived']:
+            importer['model'].objects.filter(
+                **{f"{importer['key']}__in": list(chunk)}
+            ).update(**importer['derived'])
+
+
+def import_records(kind, stream, fmt='csv', chunk_size=1000, on_error=None):
+    """Validate and upsert every record in ``stream``; return an ``ImportResult``."""
+    importer = IMPORTERS[kind]
+    form_class = importer['form']
+    key = importer['key']
+    result = ImportResult()
+    chunk = {}
+
+    for line, record in iter_records(stream, fmt):
+        result.rows += 1
+        if not isinstance(record, dict):
+            message = f"not a JSON object ({record})" if isinstance(record, Exception) else "not a JSON object"
+            result.add_error(line, message)
+            if on_error:
+                on_error(line, message)
+            continue
+
+        form = form_class(data=record)
+        if not form.is_valid():
+            message = '; '.join(
+                f"{field}: {' '.join(errors)}" for field, errors in form.errors.items()
+            )
+            result.add_error(line, message)
+            if on_error:
+                on_error(line, message)
+            continue
+
+        # A key repeated within a chunk would make the upsert ambiguous; last row wins
+        chunk[getattr(form.instance, key)] = form.instance
+        if len(chunk) >= chunk_size:
+            _upsert(importer, chunk)
+            result.imported += len(chunk)
+            chunk = {}
+
+    if chunk:
+        _upsert(importer, chunk)
+        result.imported += len(chunk)
+    if result.imported:
+        # bulk_create() sends no signals, so rebuild the search index lazily
+        get_backend().reset(importer['model'])
+        invalidate_library_stats()
+        bump_fragment_versions(*importer['fragments'])
+    return result
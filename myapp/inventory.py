@@ -0,0 +1,328 @@
+"""Stock movements for issuing and returning books.
+
+Availability is enforced by the UPDATE itself (``... WHERE quantity >= n``)
+instead of being read, adjusted in Python and saved back, so concurrent
+librarians can neither oversell a title nor overwrite each other's
+changes.  Only the columns that actually change are written.
+
+The same statements keep the denormalised loan counters current
+(``Book.on_loan_copies`` and ``Student.active_loan_count``), so they
+commit or roll back together with the stock and the loans they count.
+Every statement also moves ``updated_at``, which the conditional GET
+validators in ``myapp.conditional`` rely on.
+``reconcile_counters`` recomputes them from the loans table.
+
+Committed movements and refused ones (conflicts) are counted in
+``myapp.metrics``.
+"""
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import loan_policy
+from .fragments import bump_fragment_versions, loan_versions
+from .metrics import INVENTORY_CONFLICTS, record_inventory
+from .models import Book, Student, IssuedBook
+from .stats import invalidate_library_stats
+
+
+class InventoryError(Exception):
+    """A stock movement could not be applied; nothing was written."""
+
+
+def _conflict(operation, message):
+    """An InventoryError for a movement the stock or loans refused, counted as a conflict."""
+    INVENTORY_CONFLICTS.inc(operation=operation)
+    return InventoryError(message)
+
+
+def issue_copies(student, book, quantity):
+    """Take ``quantity`` copies of ``book`` out of stock and lend them to ``student``."""
+    if quantity < 1:
+        raise InventoryError("Quantity must be at least 1.")
+    now = timezone.now()
+    with transaction.atomic():
+        taken = Book.objects.filter(pk=book.pk, quantity__gte=quantity).update(
+            quantity=F('quantity') - quantity,
+            on_loan_copies=F('on_loan_copies') + quantity,
+            updated_at=now,
+        )
+        if not taken:
+            raise _conflict('issue', f"Not enough copies of '{book.title}' available.")
+        Student.objects.filter(pk=student.pk).update(
+            active_loan_count=F('active_loan_count') + 1, updated_at=now
+        )
+        issued_book = IssuedBook.objects.create(student=student, book=book, quantity=quantity)
+        transaction.on_commit(invalidate_library_stats)
+        transaction.on_commit(lambda: bump_fragment_versions('books', f'loans:{student.pk}'))
+        transaction.on_commit(lambda: record_inventory('issue', quantity))
+    return issued_book
+
+
+def return_copies(issued_book, quantity):
+    """Put ``quantity`` copies of a loan back into stock.
+
+    The loan is marked returned once no copies are outstanding.
+    ``issued_book`` is refreshed with the stored quantity and status.
+    """
+    if quantity < 1:
+        raise InventoryError("Quantity must be at least 1.")
+    now = timezone.now()
+    with transaction.atomic():
+        returned = IssuedBook.objects.filter(
+            pk=issued_book.pk, is_returned=False, quantity__gte=quantity
+        ).update(quantity=F('quantity') - quantity, updated_at=now)
+        if not returned:
+            raise _conflict('return', "The loan does not have that many copies outstanding.")
+        closed = IssuedBook.objects.filter(pk=issued_book.pk, quantity=0).update(
+            is_returned=True,
+            return_date=timezone.localdate(),
+        )
+        Book.objects.filter(pk=issued_book.book_id).update(
+            quantity=F('quantity') + quantity,
+            on_loan_copies=F('on_loan_copies') - quantity,
+            updated_at=now,
+        )
+        if closed:
+            Student.objects.filter(pk=issued_book.student_id).update(
+                active_loan_count=F('active_loan_count') - 1, updated_at=now
+            )
+        transaction.on_commit(invalidate_library_stats)
+        transaction.on_commit(lambda: bump_fragment_versions('books', f'loans:{issued_book.student_id}'))
+        transaction.on_commit(lambda: record_inventory('return', quantity))
+    issued_book.refresh_from_db(fields=['quantity', 'is_returned', 'return_date', 'updated_at'])
+    return issued_book
+
+
+def _batch_demand(items):
+    demand = defaultdict(int)
+    for _, book, quantity in items:
+        if quantity < 1:
+            raise InventoryError("Quantity must be at least 1.")
+        demand[book.pk] += quantity
+    return demand
+
+
+def _adjust_stock(changes, now, require_stock=False):
+    """Apply ``{book_pk: delta}`` to Book.quantity in a single UPDATE.
+
+    The copies leave or join ``on_loan_copies`` in the same statement.
+    With ``require_stock`` every book must still hold at least ``-delta``
+    copies; the statement's row count tells whether all of them did.
+    """
+    condition = reduce(or_, (
+        Q(pk=pk, quantity__gte=-delta) if require_stock else Q(pk=pk)
+        for pk, delta in changes.items()
+    ))
+    return Book.objects.filter(condition).update(
+        quantity=Case(
+            *[When(pk=pk, then=F('quantity') + delta) for pk, delta in changes.items()],
+            default=F('quantity'),
+        ),
+        on_loan_copies=Case(
+            *[When(pk=pk, then=F('on_loan_copies') - delta) for pk, delta in changes.items()],
+            default=F('on_loan_copies'),
+        ),
+        updated_at=now,
+    )
+
+
+def _adjust_active_loans(changes, now):
+    """Apply ``{student_pk: delta}`` to Student.active_loan_count in a single UPDATE."""
+    changes = {pk: delta for pk, delta in changes.items() if delta}
+    if not changes:
+        return
+    Student.objects.filter(pk__in=changes).update(
+        active_loan_count=Case(
+            *[When(pk=pk, then=F('active_loan_count') + delta) for pk, delta in changes.items()],
+            default=F('active_loan_count'),
+        ),
+        updated_at=now,
+    )
+
+
+def bulk_issue_copies(items):
+    """Issue many ``(student, book, quantity)`` loans as one batch.
+
+    Stock for the whole batch is checked with one query, the stock change
+    is one UPDATE and the loans are written with ``bulk_create``.  Either
+    every loan is issued or none is.
+    """
+    items = list(items)
+    if not items:
+        return []
+    demand = _batch_demand(items)
+    books = {book.pk: book for _, book, _ in items}
+    now = timezone.now()
+    with transaction.atomic():
+        stock = dict(
+            Book.objects.select_for_update()
+            .filter(pk__in=demand)
+            .values_list('pk', 'quantity')
+        )
+        short = [
+            f"'{books[pk].title}' (requested {wanted}, available {stock.get(pk, 0)})"
+            for pk, wanted in demand.items() if stock.get(pk, 0) < wanted
+        ]
+        if short:
+            raise _conflict('issue', "Not enough copies available: " + ", ".join(short))
+
+        taken = _adjust_stock({pk: -n for pk, n in demand.items()}, now, require_stock=True)
+        if taken != len(demand):
+            raise _conflict('issue', "Stock changed while the batch was being issued; please retry.")
+
+        issued = IssuedBook.objects.bulk_create([
+            IssuedBook(
+                student=student, book=book, quantity=quantity,
+                # bulk_create() skips IssuedBook.save()
+                due_date=loan_policy.due_date(student=student),
+            )
+            for student, book, quantity in items
+        ])
+        _adjust_active_loans(Counter(student.pk for student, _, _ in items), now)
+        transaction.on_commit(invalidate_library_stats)
+        transaction.on_commit(lambda: bump_fragment_versions(
+            'books', *loan_versions({student.pk for student, _, _ in items})
+        ))
+        transaction.on_commit(lambda: record_inventory('issue', sum(demand.values())))
+    return issued
+
+
+def bulk_return_copies(items):
+    """Return many ``(student, book, quantity)`` entries as one batch.
+
+    Each entry is taken from the student's active loans of that book,
+    oldest first.  The outstanding loans are read with one query, then
+    one UPDATE adjusts the loans and one adjusts the stock.
+    """
+    items = list(items)
+    if not items:
+        return 0
+    demand = defaultdict(int)
+    for student, book, quantity in items:
+        if quantity < 1:
+            raise InventoryError("Quantity must be at least 1.")
+        demand[(student.pk, book.pk)] += quantity
+    names = {(student.pk, book.pk): (student, book) for student, book, _ in items}
+
+    now = timezone.now()
+    with transaction.atomic():
+        loans = defaultdict(list)
+        active = (
+            IssuedBook.objects.select_for_update()
+            .filter(
+                is_returned=False,
+                student__in={student_pk for student_pk, _ in demand},
+                book__in={book_pk for _, book_pk in demand},
+            )
+            .order_by('issue_date', 'pk')
+            .values_list('pk', 'student_id', 'book_id', 'quantity')
+        )
+        for pk, student_pk, book_pk, outstanding in active:
+            if (student_pk, book_pk) in demand:
+                loans[student_pk, book_pk].append((pk, outstanding))
+
+        taken_from = {}
+        restock = defaultdict(int)
+        closed = defaultdict(int)
+        short = []
+        for key, wanted in demand.items():
+            remaining = wanted
+            for pk, outstanding in loans[key]:
+                if not remaining:
+                    break
+                take = min(outstanding, remaining)
+                taken_from[pk] = (take, take == outstanding)
+                if take == outstanding:
+                    closed[key[0]] -= 1
+                remaining -= take
+            if remaining:
+                student, book = names[key]
+                short.append(f"'{book.title}' for {student.name} ({remaining} too many)")
+            restock[key[1]] += wanted
+        if short:
+            raise _conflict('return', "Cannot return more than was issued: " + ", ".join(short))
+
+        returned = IssuedBook.objects.filter(reduce(or_, (
+            Q(pk=pk, is_returned=False, quantity__gte=take) for pk, (take, _) in taken_from.items()
+        ))).update(
+            quantity=Case(
+                *[When(pk=pk, then=F('quantity') - take) for pk, (take, _) in taken_from.items()],
+                default=F('quantity'),
+            ),
+            is_returned=Case(
+                When(pk__in=[pk for pk, (_, full) in taken_from.items() if full], then=Value(True)),
+                default=F('is_returned'),
+            ),
+            return_date=Case(
+                When(pk__in=[pk for pk, (_, full) in taken_from.items() if full],
+                     then=Value(timezone.localdate())),
+                default=F('return_date'),
+            ),
+            updated_at=now,
+        )
+        if returned != len(taken_from):
+            raise _conflict('return', "Loans changed while the batch was being returned; please retry.")
+
+        _adjust_stock(restock, now)
+        _adjust_active_loans(closed, now)
+        transaction.on_commit(invalidate_library_stats)
+        transaction.on_commit(lambda: bump_fragment_versions(
+            'books', *loan_versions({student_pk for student_pk, _ in demand})
+        ))
+        transaction.on_commit(lambda: record_inventory('return', sum(demand.values())))
+    return sum(demand.values())
+
+
+# ============= COUNTER RECONCILIATION =============
+def _actual_on_loan():
+    active = IssuedBook.objects.filter(is_returned=False, book=OuterRef('pk'))
+    return Coalesce(Subquery(
+        active.values('book').annotate(copies=Sum('quantity')).values('copies')
+    ), 0)
+
+
+def _actual_active_loans():
+    active = IssuedBook.objects.filter(is_returned=False, student=OuterRef('pk'))
+    return Coalesce(Subquery(
+        active.values('student').annotate(loans=Count('pk')).values('loans')
+    ), 0)
+
+
+def counter_drift():
+    """Books and students whose stored counters disagree with the loans table.
+
+    Returns two querysets, annotated with ``actual_on_loan`` and
+    ``actual_active_loans`` respectively.
+    """
+    books = Book.objects.annotate(actual_on_loan=_actual_on_loan()).filter(
+        ~Q(on_loan_copies=F('actual_on_loan'))
+        | ~Q(total_copies=F('quantity') + F('actual_on_loan'))
+    )
+    students = Student.objects.annotate(actual_active_loans=_actual_active_loans()).exclude(
+        active_loan_count=F('actual_active_loans')
+    )
+    return books, students
+
+
+def reconcile_counters(book_pks, student_pks):
+    """Recompute the counters of the given books and students in one UPDATE each."""
+    now = timezone.now()
+    with transaction.atomic():
+        if book_pks:
+            Book.objects.filter(pk__in=book_pks).update(
+                on_loan_copies=_actual_on_loan(),
+                total_copies=F('quantity') + _actual_on_loan(),
+                updated_at=now,
+            )
+            transaction.on_commit(lambda: bump_fragment_versions('books'))
+        if student_pks:
+            Student.objects.filter(pk__in=student_pks).update(
+                active_loan_count=_actual_active_loans(),
+                updated_at=now,
+            )
@@ -0,0 +1,111 @@
+"""The library's background jobs, run by ``manage.py run_worker``.
+
+The loan receipts are enqueued by the issue and return views; the others
+run on the ``LIBRARY_TASK_SCHEDULE`` schedule.  Each job reads what it
+needs by primary key when it runs, and does nothing if it has gone.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mail, send_mass_mail
+from django.utils import timezone
+
+from .inventory import counter_drift, reconcile_counters
+from .models import IssuedBook, Task
+from .stats import cache_overdue_report, cached_library_stats, overdue_report
+from .tasks import task
+
+
+def _student_email(student):
+    return student.user.email if student.user_id and student.user.email else None
+
+
+# ============= LOAN RECEIPTS =============
+@task
+def loan_issued(loan_id):
+    """Email the student a receipt for a new loan, with its due date."""
+    loan = IssuedBook.objects.select_related('book', 'student__user').filter(pk=loan_id).first()
+    email = loan and _student_email(loan.student)
+    if not email:
+        return
+    send_mail(
+        f"Borrowed: {loan.book.title}",
+        f"Hello {loan.student.name},\n\nYou borrowed {loan.quantity} copy/copies of "
+        f"'{loan.book.title}' on {loan.issue_date:%Y-%m-%d}. Please return them by {loan.due_date:%Y-%m-%d}.",
+        None,
+        [email],
+    )
+
+
+@task
+def loan_returned(loan_id, quantity):
+    """Email the student a receipt for returned copies."""
+    loan = IssuedBook.objects.select_related('book', 'student__user').filter(pk=loan_id).first()
+    email = loan and _student_email(loan.student)
+    if not email:
+        return
+    outstanding = "" if loan.is_returned else f" {loan.quantity} copy/copies are still due on {loan.due_date:%Y-%m-%d}."
+    send_mail(
+        f"Returned: {loan.book.title}",
+        f"Hello {loan.student.name},\n\nWe received {quantity} copy/copies of '{loan.book.title}'.{outstanding}",
+        None,
+        [email],
+    )
+
+
+# ============= SCHEDULED JOBS =============
+@task
+def send_overdue_reminders():
+    """Email every student with overdue loans one reminder listing them all."""
+    today = timezone.localdate()
+    loans = (
+        IssuedBook.objects.overdue(today)
+        .select_related('book', 'student__user')
+        .order_by('student_id', 'due_date')
+    )
+    by_student = {}
+    for loan in loans:
+        if _student_email(loan.student):
+            by_student.setdefault(loan.student, []).append(loan)
+
+    messages = []
+    for student, student_loans in by_student.items():
+        lines = "\n".join(
+            f"- '{loan.book.title}' x{loan.quantity}, due {loan.due_date:%Y-%m-%d} ({(today - loan.due_date).days} days ago)"
+            for loan in student_loans
+        )
+        messages.append((
+            f"{len(student_loans)} overdue book loan(s)",
+            f"Hello {student.name},\n\nThese loans are overdue:\n{lines}\n\nPlease return them to the library.",
+            None,
+            [student.user.email],
+        ))
+    # One connection for every reminder
+    return send_mass_mail(messages)
+
+
+@task
+def refresh_overdue_report():
+    """Recompute the dashboards' overdue report before the cached one expires."""
+    cache_overdue_report(overdue_report())
+
+
+@task
+def reconcile_loan_counters():
+    """Recompute the books' and students' loan counters that have drifted."""
+    books, students = counter_drift()
+    reconcile_counters(list(books.values_list('pk', flat=True)), list(students.values_list('pk', flat=True)))
+
+
+@task
+def nightly_rollup():
+    """Compute the new day's dashboard statistics before the first page asks for them."""
+    cached_library_stats()
+    refresh_overdue_report()
+
+
+@task
+def prune_tasks():
+    """Delete finished tasks older than ``LIBRARY_TASK_KEEP_DAYS``; failed ones are kept."""
+    cutoff = timezone.now() - timedelta(days=settings.LIBRARY_TASK_KEEP_DAYS)
+    Task.objects.filter(status=Task.DONE, finished_at__lt=cutoff).delete()
@@ -0,0 +1,30 @@
+"""When loans fall due.
+
+A loan is due ``LIBRARY_LOAN_PERIOD_DAYS`` after it is issued, or after
+the period set for the student's department in
+``LIBRARY_LOAN_PERIOD_DAYS_BY_DEPARTMENT``.  The date is stored on the
+loan when it is issued (``IssuedBook.due_date``), so a policy change only
+applies to new loans, and a loan is overdue while it is out and its due
+date has passed, a range on the ``(is_returned, due_date)`` index.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def loan_period(student=None):
+    """How long ``student`` may keep a book."""
+    periods = settings.LIBRARY_LOAN_PERIOD_DAYS_BY_DEPARTMENT
+    if student is not None and student.department in periods:
+        return timedelta(days=periods[student.department])
+    return timedelta(days=settings.LIBRARY_LOAN_PERIOD_DAYS)
+
+
+def due_date(issue_date=None, student=None):
+    """The due date of a loan issued to ``student`` on ``issue_date`` (default today)."""
+    return (issue_date or timezone.localdate()) + loan_period(student)
+
+
+def is_overdue(loan, today=None):
+    return not loan.is_returned and loan.due_date < (today or timezone.localdate())
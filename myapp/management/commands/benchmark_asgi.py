@@ -0,0 +1,143 @@
+import asyncio
+import io
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+from django.urls import include, path, reverse
+
+from myapp import urls as myapp_urls
+from myapp.async_views import ASYNC_VIEWS, with_async_views
+from myapp.management.commands.run_benchmarks import Command as RunBenchmarks, percentile
+
+
+class AsyncURLConf:
+    urlpatterns = [path('', include((with_async_views(myapp_urls.urlpatterns), 'myapp')))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the throughput of the read-heavy pages served through the WSGI handler (sync views, "
+        "one thread per concurrent request) and the ASGI handler (sync and async views), in process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300, help="Requests per mode.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Requests in flight at once.")
+        parser.add_argument('--pages', nargs='+', choices=sorted(ASYNC_VIEWS), default=sorted(ASYNC_VIEWS))
+
+    def handle(self, *args, **options):
+        runner = RunBenchmarks()
+        samples = runner.sample_objects()
+        clients = runner.clients(samples['student'])
+        cookies = {
+            role: f"{settings.SESSION_COOKIE_NAME}={clients[role].cookies[settings.SESSION_COOKIE_NAME].value}"
+            for role in ('librarian', 'student')
+        }
+        targets = []
+        for name in options['pages']:
+            args = [samples['student'].pk] if name == 'student_detail' else []
+            role = 'student' if name == 'student_dashboard' else 'librarian'
+            targets.append((reverse(f'myapp:{name}', args=args), cookies[role]))
+        requests = [targets[n % len(targets)] for n in range(max(1, options['requests']))]
+
+        self.stdout.write(
+            f"{len(requests)} requests over {', '.join(options['pages'])}; concurrency {options['concurrency']}"
+        )
+        self.stdout.write(f"{'mode':<12} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7}")
+        modes = [
+            ('wsgi', self.run_wsgi, settings.ROOT_URLCONF),
+            ('asgi-sync', self.run_asgi, settings.ROOT_URLCONF),
+            ('asgi-async', self.run_asgi, AsyncURLConf),
+        ]
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for mode, run, urlconf in modes:
+                with override_settings(ROOT_URLCONF=urlconf):
+                    # Warm up the templates, URL resolvers and caches
+                    run(requests[:len(targets)], 1)
+                    started = time.perf_counter()
+                    results = run(requests, max(1, options['concurrency']))
+                    elapsed = time.perf_counter() - started
+                timings = sorted(duration for _, duration in results)
+                errors = sum(1 for status, _ in results if status != 200)
+                self.stdout.write(
+                    f"{mode:<12} {len(results) / elapsed:>8.1f} {percentile(timings, 0.50):>9.2f} "
+                    f"{percentile(timings, 0.95):>9.2f} {errors:>7}"
+                )
+                if errors:
+                    raise CommandError(f"{errors} requests in {mode} mode did not return 200.")
+
+    def run_wsgi(self, requests, concurrency):
+        """``[(status, milliseconds)]``, one thread per concurrent request, as a threaded server."""
+        application = get_wsgi_application()
+
+        def request(target):
+            url, cookie = target
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': url, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+                'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'testserver', 'HTTP_COOKIE': cookie, 'REMOTE_ADDR': '127.0.0.1',
+                'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+                'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            status = []
+            started = time.perf_counter()
+            body = application(environ, lambda line, headers, exc_info=None: status.append(line))
+            try:
+                for _ in body:
+                    pass
+            finally:
+                body.close()
+            return int(status[0].split()[0]), (time.perf_counter() - started) * 1000
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(request, requests))
+
+    def run_asgi(self, requests, concurrency):
+        """``[(status, milliseconds)]`` with ``concurrency`` requests in flight on one event loop."""
+        application = get_asgi_application()
+
+        async def request(target, limit):
+            url, cookie = target
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': url, 'raw_path': url.encode(), 'query_string': b'',
+                'root_path': '', 'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+                'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+            }
+            received = asyncio.Event()
+            status = []
+
+            async def receive():
+                if not received.is_set():
+                    received.set()
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # No disconnect; Django stops listening once the response is sent
+                await asyncio.Future()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            async with limit:
+                started = time.perf_counter()
+                await application(scope, receive, send)
+                return status[0], (time.perf_counter() - started) * 1000
+
+        async def run_all():
+            limit = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(request(target, limit) for target in requests))
+
+        # A loop of its own, away from any loop the caller may be running
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(asyncio.run(run_all())))
+        thread.start()
+        thread.join()
+        return results
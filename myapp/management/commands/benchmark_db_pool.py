@@ -0,0 +1,89 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+
+from myapp.dbpool import POOL_CONNECTIONS, POOL_EXHAUSTED, POOLED_ENGINES, close_pools
+from myapp.management.commands.run_benchmarks import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Time simulated requests (connect, run a few queries, close) against a database "
+        "with and without the connection pool of myapp.dbpool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--requests', type=int, default=500, help="Requests per mode.")
+        parser.add_argument('--queries', type=int, default=3, help="Queries per request.")
+        parser.add_argument('--threads', type=int, default=1, help="Concurrent request threads.")
+        parser.add_argument('--max-size', type=int, default=5, help="Pool size.")
+
+    def handle(self, *args, **options):
+        settings_dict = connections[options['database']].settings_dict
+        engines = {**POOLED_ENGINES, **{pooled: stock for stock, pooled in POOLED_ENGINES.items()}}
+        if settings_dict['ENGINE'] not in engines:
+            raise CommandError(f"No pooled backend for {settings_dict['ENGINE']}.")
+        stock = settings_dict['ENGINE'] if settings_dict['ENGINE'] in POOLED_ENGINES else engines[settings_dict['ENGINE']]
+        plain_options = {k: v for k, v in settings_dict['OPTIONS'].items() if k != 'pool'}
+        modes = {
+            'unpooled': {**settings_dict, 'ENGINE': stock, 'OPTIONS': plain_options},
+            'pooled': {
+                **settings_dict, 'ENGINE': POOLED_ENGINES[stock],
+                'OPTIONS': {**plain_options, 'pool': {'max_size': options['max_size']}},
+            },
+        }
+
+        self.stdout.write(
+            f"{options['requests']} requests of {options['queries']} queries, {options['threads']} threads, "
+            f"{connections[options['database']].vendor}"
+        )
+        self.stdout.write(f"{'mode':<10} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'opened':>7} {'waits':>6}")
+        results = {}
+        try:
+            for mode, mode_settings in modes.items():
+                alias = f'benchmark-{mode}'
+                timings = self.run(mode_settings, alias, options)
+                results[mode] = statistics.mean(timings)
+                opened = POOL_CONNECTIONS.get(alias=alias, event='opened') if mode == 'pooled' else len(timings)
+                self.stdout.write(
+                    f"{mode:<10} {results[mode]:>9.3f} {percentile(timings, 0.50):>9.3f} "
+                    f"{percentile(timings, 0.95):>9.3f} {opened:>7} {POOL_EXHAUSTED.get(alias=alias):>6}"
+                )
+        finally:
+            close_pools()
+        self.stdout.write(f"Saved per request: {results['unpooled'] - results['pooled']:.3f} ms")
+
+    def run(self, settings_dict, alias, options):
+        """Per-request times in milliseconds, sorted."""
+        backend = load_backend(settings_dict['ENGINE'])
+        timings = []
+        lock = threading.Lock()
+        per_thread = max(1, options['requests'] // max(1, options['threads']))
+
+        def worker():
+            connection = backend.DatabaseWrapper(settings_dict, alias)
+            measured = []
+            for _ in range(per_thread):
+                started = time.perf_counter()
+                connection.ensure_connection()
+                with connection.cursor() as cursor:
+                    for _ in range(options['queries']):
+                        cursor.execute('SELECT 1')
+                        cursor.fetchall()
+                # As at the end of a request with CONN_MAX_AGE = 0
+                connection.close()
+                measured.append((time.perf_counter() - started) * 1000)
+            with lock:
+                timings.extend(measured)
+
+        threads = [threading.Thread(target=worker) for _ in range(max(1, options['threads']))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(timings)
@@ -0,0 +1,70 @@
+import itertools
+import random
+import statistics
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.models import Book
+from myapp.search import SEARCH_FIELDS, InvertedIndex
+
+
+class Command(BaseCommand):
+    help = "Time the in-process search index on a synthetic catalogue (no database needed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1_000_000)
+        parser.add_argument('--vocabulary', type=int, default=60_000)
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words = sorted({
+            ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10)))
+            for _ in range(options['vocabulary'])
+        })
+        # Zipf-like word frequencies, as in real titles
+        cumulative = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+        surnames = rng.sample(words, min(len(words), 20_000))
+
+        titles = []
+
+        def catalogue():
+            for pk in range(1, options['books'] + 1):
+                title = ' '.join(rng.choices(words, cum_weights=cumulative, k=rng.randint(2, 6)))
+                author = f"{rng.choice(surnames)} {rng.choice(surnames)}"
+                if pk % 1000 == 0:
+                    titles.append(title)
+                yield pk, {'title': title, 'author': author, 'isbn': f'{pk:013d}'}
+
+        index = InvertedIndex(SEARCH_FIELDS[Book])
+        started = time.perf_counter()
+        index.load(catalogue())
+        self.stdout.write(f"Indexed {len(index)} books in {time.perf_counter() - started:.1f}s")
+
+        queries = []
+        for _ in range(options['queries']):
+            title_words = rng.choice(titles).split()
+            kind = rng.random()
+            if kind < 0.4:
+                queries.append(rng.choice(title_words))
+            elif kind < 0.7:
+                queries.append(' '.join(rng.sample(title_words, min(2, len(title_words)))))
+            else:
+                word = rng.choice(title_words)
+                queries.append(word[:max(3, len(word) // 2)])
+
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query, limit=50)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        pick = lambda q: timings[min(len(timings) - 1, int(q * len(timings)))]
+        self.stdout.write(
+            f"{len(timings)} queries: mean {statistics.mean(timings):.2f} ms, "
+            f"p50 {pick(0.50):.2f} ms, p95 {pick(0.95):.2f} ms, "
+            f"p99 {pick(0.99):.2f} ms, max {timings[-1]:.2f} ms"
+        )
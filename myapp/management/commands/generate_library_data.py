@@ -0,0 +1,203 @@
+import itertools
+import random
+import string
+import time
+from contextlib import contextmanager
+from datetime import datetime, time as dtime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from myapp import loan_policy
+from myapp.inventory import reconcile_counters
+from myapp.models import Book, Student, IssuedBook
+from myapp.search import get_backend
+from myapp.stats import invalidate_library_stats
+
+# Generated ISBNs and ID numbers carry these prefixes, so later runs can continue the sequence
+ISBN_PREFIX = '979'
+ID_NUMBER_PREFIX = 'G'
+# Loans issued within this many days are mostly still out; older ones are mostly back
+RECENT_DAYS = 30
+
+
+@contextmanager
+def explicit_dates(model, *names):
+    """Let bulk_create store the given auto_now/auto_now_add fields as set on the objects."""
+    fields = [model._meta.get_field(name) for name in names]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _next_sequence(model, field, prefix):
+    """One past the highest generated number already stored in ``field``."""
+    highest = model.objects.filter(**{f'{field}__startswith': prefix}).aggregate(Max(field))
+    value = highest[f'{field}__max']
+    return int(value[len(prefix):]) + 1 if value else 1
+
+
+def _word(rng, shortest, longest):
+    return ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(shortest, longest)))
+
+
+def _zipf_weights(count, exponent=1.0):
+    """Cumulative weights making the first items far more likely than the last."""
+    return list(itertools.accumulate((rank + 1) ** -exponent for rank in range(count)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Add a synthetic catalogue, students and loans at any scale with bulk inserts. "
+        "The same seed on the same database state produces the same rows, dated relative to today."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10_000)
+        parser.add_argument('--students', type=int, default=1_000)
+        parser.add_argument('--loans', type=int, default=100_000)
+        parser.add_argument('--days', type=int, default=365, help="Spread issue dates over this many days.")
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.today = timezone.localdate()
+        self.days = max(1, options['days'])
+        started = time.perf_counter()
+
+        book_pks = self.create_books(options['books'])
+        student_pks = self.create_students(options['students'])
+        if options['loans'] and not (book_pks and student_pks):
+            self.stdout.write(self.style.WARNING("Loans need new books and students; skipping them."))
+        elif options['loans']:
+            self.create_loans(options['loans'], book_pks, student_pks)
+            self.reconcile(book_pks, student_pks)
+
+        invalidate_library_stats()
+        get_backend().reset()
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(book_pks)} books, {len(student_pks)} students and "
+            f"{options['loans'] if book_pks and student_pks else 0} loans "
+            f"in {time.perf_counter() - started:.1f}s."
+        ))
+
+    def insert(self, model, objects, total, label):
+        """bulk_create ``objects`` in batches, one transaction each; returns the new primary keys."""
+        first = (model.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1
+        done = 0
+        while True:
+            batch = list(itertools.islice(objects, self.batch_size))
+            if not batch:
+                break
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            done += len(batch)
+            self.stdout.write(f"  {label}: {done}/{total}")
+        # MySQL does not return the keys from bulk_create; read them back
+        return list(model.objects.filter(pk__gte=first).order_by('pk').values_list('pk', flat=True))
+
+    def _created_at(self):
+        return self.now - timedelta(seconds=self.rng.randrange(self.days * 86400))
+
+    def create_books(self, count):
+        rng = self.rng
+        words = sorted({_word(rng, 3, 10) for _ in range(max(100, min(count, 50_000)))})
+        # Title words follow a Zipf-like distribution, as in real catalogues
+        cumulative = _zipf_weights(len(words))
+        surnames = rng.sample(words, min(len(words), 5_000))
+        start = _next_sequence(Book, 'isbn', ISBN_PREFIX)
+
+        def books():
+            for n in range(start, start + count):
+                created_at = self._created_at()
+                # About one title in ten is out of stock
+                quantity = 0 if rng.random() < 0.1 else rng.randint(1, 10)
+                yield Book(
+                    title=' '.join(rng.choices(words, cum_weights=cumulative, k=rng.randint(1, 6))).title(),
+                    author=f"{rng.choice(surnames).title()} {rng.choice(surnames).title()}",
+                    isbn=f'{ISBN_PREFIX}{n:010d}',
+                    quantity=quantity,
+                    # bulk_create skips Book.save(); the loans are added by reconcile()
+                    total_copies=quantity,
+                    created_at=created_at,
+                    updated_at=created_at,
+                )
+
+        with explicit_dates(Book, 'created_at', 'updated_at'):
+            return self.insert(Book, books(), count, 'books')
+
+    def create_students(self, count):
+        rng = self.rng
+        first_names = [_word(rng, 3, 8).title() for _ in range(500)]
+        last_names = [_word(rng, 4, 10).title() for _ in range(2000)]
+        departments = [value for value, _ in Student.DEPARTMENT_CHOICES]
+        start = _next_sequence(Student, 'id_number', ID_NUMBER_PREFIX)
+
+        def students():
+            for n in range(start, start + count):
+                created_at = self._created_at()
+                yield Student(
+                    name=f"{rng.choice(first_names)} {rng.choice(last_names)}",
+                    id_number=f'{ID_NUMBER_PREFIX}{n:08d}',
+                    department=rng.choice(departments),
+                    phone_number=f'07{rng.randrange(10 ** 9):09d}',
+                    created_at=created_at,
+                    updated_at=created_at,
+                )
+
+        with explicit_dates(Student, 'created_at', 'updated_at'):
+            return self.insert(Student, students(), count, 'students')
+
+    def create_loans(self, count, book_pks, student_pks):
+        rng = self.rng
+        # Popular titles account for a large share of the loans; readers differ less
+        book_weights = _zipf_weights(len(book_pks), exponent=0.8)
+        student_weights = _zipf_weights(len(student_pks), exponent=0.3)
+        book_order = rng.sample(book_pks, len(book_pks))
+        student_order = rng.sample(student_pks, len(student_pks))
+
+        def loans():
+            for _ in range(count):
+                age = min(int(rng.expovariate(3 / self.days)), self.days - 1)
+                issue_date = self.today - timedelta(days=age)
+                returned = rng.random() < (0.3 if age < RECENT_DAYS else 0.97)
+                return_date = None
+                if returned:
+                    return_date = min(self.today, issue_date + timedelta(days=rng.randint(1, 28)))
+                issued_at = timezone.make_aware(datetime.combine(issue_date, dtime(9)) + timedelta(
+                    seconds=rng.randrange(8 * 3600)
+                ))
+                yield IssuedBook(
+                    student_id=rng.choices(student_order, cum_weights=student_weights)[0],
+                    book_id=rng.choices(book_order, cum_weights=book_weights)[0],
+                    # A closed loan has no copies outstanding, as after return_copies()
+                    quantity=0 if returned else (1 if rng.random() < 0.9 else 2),
+                    issue_date=issue_date,
+                    # The default period: only the students' keys are at hand here
+                    due_date=loan_policy.due_date(issue_date),
+                    return_date=return_date,
+                    is_returned=returned,
+                    created_at=issued_at,
+                    updated_at=issued_at,
+                )
+
+        with explicit_dates(IssuedBook, 'issue_date', 'created_at', 'updated_at'):
+            self.insert(IssuedBook, loans(), count, 'loans')
+
+    def reconcile(self, book_pks, student_pks):
+        """Bring the new rows' loan counters up to date, one batch of keys at a time."""
+        for start in range(0, len(book_pks), self.batch_size):
+            reconcile_counters(book_pks[start:start + self.batch_size], [])
+        for start in range(0, len(student_pks), self.batch_size):
+            reconcile_counters([], student_pks[start:start + self.batch_size])
+        self.stdout.write(f"  counters recomputed for {len(book_pks)} books and {len(student_pks)} students")
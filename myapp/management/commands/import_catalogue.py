@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.importers import FORMATS, IMPORTERS, guess_format, import_records
+
+
+class Command(BaseCommand):
+    help = "Stream books or students from a CSV or JSON-lines file, upserting on ISBN / ID number."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or guess_format(options['path'])
+
+        def report(line, message):
+            self.stderr.write(f"line {line}: {message}")
+
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as stream:
+                result = import_records(
+                    options['kind'], stream, fmt,
+                    chunk_size=options['chunk_size'], on_error=report,
+                )
+        except OSError as exc:
+            raise CommandError(exc)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.imported} {options['kind']} from {result.rows} rows "
+            f"({result.error_count} rejected)."
+        ))
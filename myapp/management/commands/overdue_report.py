@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.stats import cache_overdue_report, overdue_report
+
+
+class Command(BaseCommand):
+    help = (
+        "List the overdue loans and every student's overdue count, from a single query, and store "
+        "the dashboards' copy. Run it daily shortly after midnight."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--summary', action='store_true', help="Print the totals only.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        report = overdue_report()
+        elapsed = (time.perf_counter() - started) * 1000
+        cache_overdue_report(report)
+
+        if not options['summary']:
+            self.stdout.write("Overdue loans, most overdue first:")
+            for loan in report['loans']:
+                self.stdout.write(
+                    f"  due {loan['due_date']:%Y-%m-%d} ({loan['days_overdue']} days)  "
+                    f"{loan['student_id_number']} {loan['student_name']}: {loan['book_title']} x{loan['quantity']}"
+                )
+            self.stdout.write("Overdue loans per student:")
+            for student in report['top_students']:
+                self.stdout.write(f"  {student['id_number']} {student['name']}: {student['overdue']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['total']} overdue loans held by {len(report['students'])} students "
+            f"on {report['date']:%Y-%m-%d} ({elapsed:.1f} ms)."
+        ))
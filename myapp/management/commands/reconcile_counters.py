@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from myapp.inventory import counter_drift, reconcile_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the books' and students' loan counters from the loans table and report any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without fixing it.")
+
+    def handle(self, *args, **options):
+        books, students = counter_drift()
+        book_pks, student_pks = [], []
+        for book in books:
+            book_pks.append(book.pk)
+            self.stdout.write(
+                f"Book {book.pk} '{book.title}': on loan {book.on_loan_copies} -> {book.actual_on_loan}, "
+                f"total {book.total_copies} -> {book.quantity + book.actual_on_loan}"
+            )
+        for student in students:
+            student_pks.append(student.pk)
+            self.stdout.write(
+                f"Student {student.pk} '{student.name}': active loans "
+                f"{student.active_loan_count} -> {student.actual_active_loans}"
+            )
+
+        if not book_pks and not student_pks:
+            self.stdout.write(self.style.SUCCESS("All counters are consistent."))
+            return
+        summary = f"{len(book_pks)} books and {len(student_pks)} students had drifted."
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{summary} Nothing was changed (--dry-run)."))
+            return
+        reconcile_counters(book_pks, student_pks)
+        self.stdout.write(self.style.SUCCESS(f"{summary} Counters recomputed."))
@@ -0,0 +1,240 @@
+import json
+import resource
+import statistics
+import sys
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, reset_queries
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from myapp import urls as myapp_urls
+from myapp.exports import EXPORTS
+from myapp.metrics import QueryCounter
+from myapp.models import Book, Student, IssuedBook
+
+# URL names that need a user other than the librarian, or none at all
+ROLES = {'login': 'anonymous', 'register': 'anonymous', 'student_dashboard': 'student'}
+# Logging out would end the benchmark's session
+SKIPPED = {'logout'}
+# Which sample object fills the <pk> of each URL
+PK_SOURCES = {
+    'edit_book': 'book', 'delete_book': 'book',
+    'student_detail': 'student', 'edit_student': 'student', 'delete_student': 'student',
+    'return_book': 'loan',
+}
+# A latency increase smaller than this is treated as noise, whatever the tolerance
+NOISE_FLOOR_MS = 1.0
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class Command(BaseCommand):
+    help = (
+        "Request every URL in myapp.urls through the test client against the current database, "
+        "report p50/p95/p99 latency, queries per request and peak RSS, and compare with a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=30, help="Timed requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=3, help="Untimed requests per scenario.")
+        parser.add_argument('--only', nargs='+', metavar='SCENARIO', help="Run only these scenarios.")
+        parser.add_argument('--skip', nargs='+', metavar='SCENARIO', default=[], help="Leave out these scenarios.")
+        parser.add_argument('--output', help="Write the results to this JSON file (e.g. to use as a baseline).")
+        parser.add_argument('--baseline', help="Compare with results saved earlier by --output.")
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help="Allowed relative increase of p95 latency and peak RSS over the baseline.",
+        )
+
+    def handle(self, *args, **options):
+        samples = self.sample_objects()
+        clients = self.clients(samples['student'])
+        scenarios = self.scenarios(samples)
+        selected = set(options['only'] or [name for name, _, _ in scenarios]) - set(options['skip'])
+        unknown = selected.union(options['skip']) - {name for name, _, _ in scenarios}
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        scenarios = [scenario for scenario in scenarios if scenario[0] in selected]
+
+        results = {
+            'dataset': {
+                'database': connection.vendor,
+                'books': Book.objects.count(),
+                'students': Student.objects.count(),
+                'loans': IssuedBook.objects.count(),
+            },
+            'requests': options['requests'],
+            'scenarios': {},
+        }
+        self.stdout.write(
+            f"{'scenario':<50} {'status':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+            f"{'queries':>7} {'rss MB':>8}"
+        )
+        # The test client's host name may not be in the deployment's ALLOWED_HOSTS
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, role, url in scenarios:
+                result = self.measure(clients[role], url, options['warmup'], max(1, options['requests']))
+                results['scenarios'][name] = result
+                self.stdout.write(
+                    f"{name:<50} {result['status']:>6} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                    f"{result['p99_ms']:>9.2f} {result['queries']:>7} {result['peak_rss_mb']:>8.1f}"
+                )
+        results['peak_rss_mb'] = peak_rss_mb()
+        self.stdout.write(f"Peak RSS: {results['peak_rss_mb']:.1f} MB")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def sample_objects(self):
+        """A typical book, student and active loan, to fill URL parameters.
+
+        The book and student are the median ones by their loan counters, so
+        a few extreme rows do not decide the timings of the detail pages.
+        """
+        books = Book.objects.order_by('on_loan_copies', 'pk')
+        students = Student.objects.order_by('active_loan_count', 'pk')
+        book = books[books.count() // 2] if books.exists() else None
+        student = students[students.count() // 2] if students.exists() else None
+        loan = IssuedBook.objects.filter(is_returned=False).order_by('pk').first()
+        if book is None or student is None or loan is None:
+            raise CommandError(
+                "The database needs books, students and an active loan; run generate_library_data first."
+            )
+        return {'book': book, 'student': student, 'loan': loan}
+
+    def clients(self, student):
+        librarian, _ = User.objects.get_or_create(username='benchmark-librarian', defaults={'is_staff': True})
+        if student.user_id is None:
+            reader, _ = User.objects.get_or_create(username='benchmark-student')
+            # Move the benchmark reader over from the student an earlier run used
+            Student.objects.filter(user=reader).update(user=None)
+            Student.objects.filter(pk=student.pk).update(user=reader)
+        else:
+            reader = student.user
+        clients = {'anonymous': Client(), 'librarian': Client(), 'student': Client()}
+        clients['librarian'].force_login(librarian)
+        clients['student'].force_login(reader)
+        return clients
+
+    def scenarios(self, samples):
+        """``(name, role, url)`` for every URL in myapp.urls, plus the list filters and searches."""
+        scenarios = []
+        for pattern in myapp_urls.urlpatterns:
+            name = pattern.name
+            if name in SKIPPED:
+                continue
+            role = ROLES.get(name, 'librarian')
+            parameters = set(pattern.pattern.converters)
+            if not parameters:
+                scenarios.append((name, role, reverse(f'myapp:{name}')))
+            elif parameters == {'pk'} and name in PK_SOURCES:
+                pk = samples[PK_SOURCES[name]].pk
+                scenarios.append((name, role, reverse(f'myapp:{name}', args=[pk])))
+            elif parameters == {'name'} and name == 'export_data':
+                for export in EXPORTS:
+                    scenarios.append((f'{name}:{export}', role, reverse(f'myapp:{name}', args=[export])))
+            else:
+                raise CommandError(f"No benchmark parameters for the URL '{name}'; add them to run_benchmarks.")
+
+        title_word = samples['book'].title.split()[0]
+        surname = samples['student'].name.split()[-1]
+        variants = [
+            ('book_list', {'q': title_word}),
+            ('book_list', {'sort': 'on_loan'}),
+            ('book_list', {'format': 'json'}),
+            ('student_list', {'q': surname}),
+            ('student_list', {'status': 'borrowing', 'sort': 'active_loans'}),
+            ('issued_books_list', {'status': 'active'}),
+            ('lookup_books', {'q': title_word[:3]}),
+            ('lookup_students', {'q': surname[:3]}),
+        ]
+        for name, query in variants:
+            query_string = urlencode(query)
+            scenarios.append((f'{name}?{query_string}', 'librarian', f"{reverse(f'myapp:{name}')}?{query_string}"))
+        return scenarios
+
+    def request(self, client, url):
+        response = client.get(url)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    def measure(self, client, url, warmup, requests):
+        for _ in range(warmup):
+            self.request(client, url)
+        timings, queries = [], []
+        for _ in range(requests):
+            counter = QueryCounter()
+            # DEBUG keeps a log of every query; start each request with an empty one
+            reset_queries()
+            with ExitStack() as stack:
+                for db in connections.all():
+                    stack.enter_context(db.execute_wrapper(counter))
+                started = time.perf_counter()
+                response = self.request(client, url)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(counter.count)
+        timings.sort()
+        return {
+            'status': response.status_code,
+            'mean_ms': statistics.mean(timings),
+            'p50_ms': percentile(timings, 0.50),
+            'p95_ms': percentile(timings, 0.95),
+            'p99_ms': percentile(timings, 0.99),
+            'queries': max(queries),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+    def compare(self, results, path, tolerance):
+        try:
+            with open(path, encoding='utf-8') as baseline_file:
+                baseline = json.load(baseline_file)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Cannot read the baseline {path}: {exc}")
+        if baseline.get('dataset') != results['dataset']:
+            self.stdout.write(self.style.WARNING(
+                f"The baseline was measured on a different dataset ({baseline.get('dataset')}); "
+                "latencies may not be comparable."
+            ))
+
+        regressions = []
+        for name, result in results['scenarios'].items():
+            before = baseline.get('scenarios', {}).get(name)
+            if before is None:
+                self.stdout.write(f"{name}: not in the baseline")
+                continue
+            if result['queries'] > before['queries']:
+                regressions.append(f"{name}: {before['queries']} -> {result['queries']} queries")
+            allowed = max(before['p95_ms'] * (1 + tolerance), before['p95_ms'] + NOISE_FLOOR_MS)
+            if result['p95_ms'] > allowed:
+                regressions.append(f"{name}: p95 {before['p95_ms']:.2f} -> {result['p95_ms']:.2f} ms")
+            if result['status'] != before['status']:
+                regressions.append(f"{name}: status {before['status']} -> {result['status']}")
+        if results['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"peak RSS {baseline['peak_rss_mb']:.1f} -> {results['peak_rss_mb']:.1f} MB")
+
+        if regressions:
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            raise CommandError(f"{len(regressions)} regressions against {path}.")
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {path}."))
@@ -0,0 +1,42 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from myapp.metrics import REGISTRY
+from myapp.tasks import Worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the queued background tasks and enqueue the scheduled ones (LIBRARY_TASK_SCHEDULE). "
+        "Start as many workers as needed; SIGTERM or Ctrl-C stops one after its running tasks finish."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.LIBRARY_TASK_CONCURRENCY,
+            help="Tasks run at the same time (default: LIBRARY_TASK_CONCURRENCY).",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.LIBRARY_TASK_POLL_INTERVAL,
+            help="Seconds between looks for new tasks when the queue is empty.",
+        )
+        parser.add_argument('--once', action='store_true', help="Run the tasks due now, then exit.")
+
+    def handle(self, *args, **options):
+        worker = Worker(concurrency=max(1, options['concurrency']))
+        if settings.LIBRARY_METRICS:
+            REGISTRY.enable()
+        if options['once']:
+            count = worker.run_pending()
+            self.stdout.write(self.style.SUCCESS(f"Ran {count} tasks."))
+            return
+
+        stop = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop.set())
+        self.stdout.write(f"Worker {worker.name} running up to {worker.concurrency} tasks at a time.")
+        worker.run(stop, poll_interval=options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS("Worker stopped."))
@@ -0,0 +1,459 @@
+"""Prometheus metrics for the library application.
+
+Counters and histograms are kept in memory by each worker process and
+written, at most every ``LIBRARY_METRICS_FLUSH_INTERVAL`` seconds, to a
+JSON file of their own in ``LIBRARY_METRICS_DIR``.  The ``/metrics`` view
+merges every process's file and renders the Prometheus text format, so a
+scrape sees the totals of all workers whichever one answers it.  A
+recorded value costs a dict update under a lock; the file is written
+after a response has been produced, never while one is being built.
+
+Only processes that serve requests or run tasks write a file: the
+middleware and ``run_worker`` call ``REGISTRY.enable()``, and other
+``manage.py`` commands leave the directory alone.  A scrape folds the
+files of exited processes into ``archive.json``, so their counts stay
+in the totals without a file per process piling up, and a process
+starting under the PID of an exited one folds that file before writing
+its own.  Exited processes are detected with signal 0, so on systems
+without POSIX signals their files are only folded on PID reuse.
+"""
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .queryhooks import observe_queries
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+
+# Seconds; the default Prometheus client buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+logger = logging.getLogger(__name__)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}        # label values -> sample
+        self.lock = registry.lock
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes the labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def describe(self):
+        return {'type': self.type, 'help': self.documentation, 'labels': list(self.labelnames)}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Per-bucket (not cumulative) counts, then sum and count
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            sample = self.values.get(key)
+            if sample is None:
+                sample = self.values[key] = [0] * (len(self.buckets) + 3)
+            sample[index] += 1
+            sample[-2] += value
+            sample[-1] += 1
+
+    def describe(self):
+        return {**super().describe(), 'buckets': list(self.buckets)}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.enabled = False
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self.metrics[metric.name] = metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return Counter(self, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return Histogram(self, name, documentation, labelnames, buckets)
+
+    def snapshot(self):
+        """``{name: description + samples}`` for every metric with a value."""
+        with self.lock:
+            return {
+                metric.name: {
+                    **metric.describe(),
+                    'samples': [
+                        [list(key), list(value) if isinstance(value, list) else value]
+                        for key, value in metric.values.items()
+                    ],
+                }
+                for metric in self.metrics.values() if metric.values
+            }
+
+    def clear(self):
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.values.clear()
+
+    def enable(self):
+        """Write this process's file from now on; for serving and worker processes."""
+        if self.enabled:
+            return
+        directory = Path(settings.LIBRARY_METRICS_DIR)
+        with _locked(directory):
+            # Left by an exited process with the same PID: keep its counts
+            _fold(directory, [directory / f'{os.getpid()}.json'])
+        self.enabled = True
+
+    def flush(self, force=False):
+        """Write this process's snapshot, if enabled and the flush interval has passed."""
+        now = time.monotonic()
+        if not self.enabled:
+            return
+        if not force and now - self.last_flush < settings.LIBRARY_METRICS_FLUSH_INTERVAL:
+            return
+        self.last_flush = now
+        directory = Path(settings.LIBRARY_METRICS_DIR)
+        with self.flush_lock:
+            directory.mkdir(parents=True, exist_ok=True)
+            _write(directory / f'{os.getpid()}.json', self.snapshot())
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    'library_http_request_duration_seconds',
+    'Time to produce a response, by URL name and method.',
+    ['view', 'method'],
+)
+RESPONSES = REGISTRY.counter(
+    'library_http_responses_total',
+    'Responses sent, by URL name and status code.',
+    ['view', 'status'],
+)
+REQUEST_QUERIES = REGISTRY.histogram(
+    'library_db_queries_per_request',
+    'SQL queries executed while handling a request, by URL name.',
+    ['view'],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+INVENTORY_OPERATIONS = REGISTRY.counter(
+    'library_inventory_operations_total',
+    'Committed issue and return operations (a bulk batch counts once).',
+    ['operation'],
+)
+INVENTORY_COPIES = REGISTRY.counter(
+    'library_inventory_copies_total',
+    'Copies moved by committed issue and return operations.',
+    ['operation'],
+)
+INVENTORY_CONFLICTS = REGISTRY.counter(
+    'library_inventory_conflicts_total',
+    'Stock movements refused because the stock or the loans did not allow them.',
+    ['operation'],
+)
+LOGINS = REGISTRY.counter(
+    'library_logins_total',
+    'Login attempts, by result.',
+    ['result'],
+)
+REGISTRATIONS = REGISTRY.counter(
+    'library_registrations_total',
+    'Accounts created through the registration form, by role.',
+    ['role'],
+)
+
+
+def record_inventory(operation, copies):
+    """Count a committed stock movement; call it from ``transaction.on_commit``."""
+    INVENTORY_OPERATIONS.inc(operation=operation)
+    INVENTORY_COPIES.inc(copies, operation=operation)
+
+
+@atexit.register
+def _flush_at_exit():
+    if settings.configured and getattr(settings, 'LIBRARY_METRICS', False):
+        try:
+            REGISTRY.flush(force=True)
+        except OSError:
+            pass
+
+
+# ============= PROCESS FILES =============
+ARCHIVE_NAME = 'archive.json'
+
+
+@contextmanager
+def _locked(directory):
+    """Hold the directory's lock while the archive is folded into or read."""
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / '.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _write(path, snapshot):
+    temporary = path.with_name(f'.{path.stem}.tmp')
+    temporary.write_text(json.dumps(snapshot), encoding='utf-8')
+    # Readers see either the previous file or this one, never half of it
+    os.replace(temporary, path)
+
+
+def _read(path):
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        # Removed or unreadable between the listing and the read
+        return {}
+
+
+def _merge(merged, snapshot):
+    for name, metric in snapshot.items():
+        target = merged.setdefault(name, {**metric, 'samples': {}})
+        for key, value in metric['samples']:
+            key = tuple(key)
+            if key not in target['samples']:
+                target['samples'][key] = value
+            elif isinstance(value, list):
+                target['samples'][key] = [a + b for a, b in zip(target['samples'][key], value)]
+            else:
+                target['samples'][key] += value
+
+
+def _fold(directory, paths):
+    """Add the snapshots in ``paths`` to the archive and delete them; call under ``_locked``."""
+    paths = [path for path in paths if path.exists()]
+    if not paths:
+        return
+    merged = {}
+    for path in [directory / ARCHIVE_NAME, *paths]:
+        _merge(merged, _read(path))
+    _write(directory / ARCHIVE_NAME, {
+        name: {**metric, 'samples': [[list(key), value] for key, value in metric['samples'].items()]}
+        for name, metric in merged.items()
+    })
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+
+def _exited(pid):
+    """Whether no process has ``pid``; without POSIX signals it cannot be told."""
+    if os.name != 'posix':
+        # os.kill() would terminate the process there
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+# ============= EXPOSITION =============
+def collect():
+    """Merge the snapshots written by every process into one."""
+    merged = {}
+    directory = Path(settings.LIBRARY_METRICS_DIR)
+    with _locked(directory):
+        _fold(directory, [
+            path for path in directory.glob('*.json')
+            if path.stem.isdigit() and int(path.stem) != os.getpid() and _exited(int(path.stem))
+        ])
+        for path in sorted(directory.glob('*.json')):
+            _merge(merged, _read(path))
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return '+Inf' if value == float('inf') else repr(value)
+
+
+def _header(lines, name, documentation, kind):
+    lines.append(f'# HELP {name} {_escape(documentation)}')
+    lines.append(f'# TYPE {name} {kind}')
+
+
+def render(merged, extra=()):
+    """The Prometheus text exposition format (0.0.4) of ``merged`` samples.
+
+    ``extra`` adds ``(name, help, type, value)`` single-sample metrics.
+    """
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        _header(lines, name, metric['help'], metric['type'])
+        for key, value in sorted(metric['samples'].items()):
+            pairs = list(zip(metric['labels'], key))
+            if metric['type'] != 'histogram':
+                lines.append(f'{name}{_labels(pairs)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip([*metric['buckets'], float('inf')], value):
+                cumulative += count
+                le = [('le', _number(float(bound)))]
+                lines.append(f'{name}_bucket{_labels(pairs + le)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(pairs)} {_number(value[-2])}')
+            lines.append(f'{name}_count{_labels(pairs)} {value[-1]}')
+    for name, documentation, kind, value in extra:
+        _header(lines, name, documentation, kind)
+        lines.append(f'{name} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def cache_metrics():
+    """Statistics-cache counters; the cache already shares them between workers."""
+    from .stats import stats_cache_info
+
+    info = stats_cache_info()
+    lookups = info['hits'] + info['misses']
+    return [
+        ('library_stats_cache_hits_total', 'Dashboard statistics served from the cache.',
+         'counter', info['hits']),
+        ('library_stats_cache_misses_total', 'Dashboard statistics recomputed on a cache miss.',
+         'counter', info['misses']),
+        ('library_stats_cache_hit_ratio', 'Hits over all statistics-cache lookups so far.',
+         'gauge', info['hits'] / lookups if lookups else 0.0),
+    ]
+
+
+def exposition():
+    """Every worker's metrics, current as of this call for the calling process."""
+    REGISTRY.flush(force=True)
+    return render(collect(), extra=cache_metrics())
+
+
+def client_address(request):
+    """The address of the client that sent ``request``, for the scrape allowlist.
+
+    ``REMOTE_ADDR`` is the peer of the connection, which behind a reverse
+    proxy is the proxy.  When it is listed in
+    ``LIBRARY_METRICS_TRUSTED_PROXIES``, the ``X-Forwarded-For`` entries
+    are read from the right, skipping the trusted proxies; the first
+    other address is the client.  Entries left of it could have been
+    sent by the client itself and are ignored.
+    """
+    trusted = settings.LIBRARY_METRICS_TRUSTED_PROXIES
+    address = request.META.get('REMOTE_ADDR')
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+    while address in trusted and hops:
+        address = hops.pop()
+    return address
+
+
+# ============= MIDDLEWARE =============
+class QueryCounter:
+    """Query hook (see ``myapp.queryhooks``) counting queries."""
+
+    def __init__(self):
+        self.count = 0
+        # Concurrent queries of one request run in threads of their own
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Time every request and count its queries, labelled by URL name.
+
+    Unresolved paths share the label ``'<unresolved>'`` so that stray URLs
+    cannot create a series each.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.LIBRARY_METRICS:
+            raise MiddlewareNotUsed
+        REGISTRY.enable()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with observe_queries(counter):
+            response = self.get_response(request)
+        return self.record(request, response, counter, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with observe_queries(counter):
+            response = await self.get_response(request)
+        return self.record(request, response, counter, time.perf_counter() - started)
+
+    def record(self, request, response, counter, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        REQUEST_LATENCY.observe(elapsed, view=view, method=request.method)
+        REQUEST_QUERIES.observe(counter.count, view=view)
+        RESPONSES.inc(view=view, status=response.status_code)
+        try:
+            REGISTRY.flush()
+        except OSError:
+            logger.warning('Could not write the metrics file', exc_info=True)
+        return response
@@ -0,0 +1,78 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.middleware.gzip import GZipMiddleware
+from django.utils.functional import SimpleLazyObject
+
+from .models import Student
+
+
+def get_student(request):
+    """The Student profile of the logged-in user, or None; cached per request."""
+    if not hasattr(request, '_cached_student'):
+        student = None
+        user = request.user
+        if user.is_authenticated:
+            student = Student.objects.filter(user=user).first()
+            if student is None:
+                # Profiles added by a librarian after the account was registered
+                student = Student.objects.link_user(user)
+        request._cached_student = student
+    return request._cached_student
+
+
+async def resolve_user(request):
+    """``await request.auser()``, kept as ``request.user`` too.
+
+    Sync code run for an async view (templates, context processors) reads
+    ``request.user``, which would otherwise load the user a second time.
+    """
+    request.user = await request.auser()
+    return request.user
+
+
+class StudentProfileMiddleware:
+    """Expose the user's Student profile as ``request.student``, looked up on first use."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Under ASGI, stay async so that async views keep running without a thread
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        request.student = SimpleLazyObject(lambda: get_student(request))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.student = SimpleLazyObject(lambda: get_student(request))
+        return await self.get_response(request)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Gzip HTML, JSON and export responses for clients that accept it.
+
+    Only the ``LIBRARY_COMPRESSION_TYPES`` are compressed, and buffered
+    responses only from ``LIBRARY_COMPRESSION_MIN_SIZE`` bytes; streamed
+    ones always are, a chunk at a time as they are produced.  Django's
+    GZipMiddleware pads the output with random bytes against BREACH.
+    """
+
+    def __init__(self, get_response):
+        if not settings.LIBRARY_COMPRESSION:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in settings.LIBRARY_COMPRESSION_TYPES:
+            return response
+        if not response.streaming and len(response.content) < settings.LIBRARY_COMPRESSION_MIN_SIZE:
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# FULLTEXT indexes backing the 'mysql' search backend (see myapp.search).
+# Column order must match SEARCH_FIELDS, as MATCH() names the same columns.
+FULLTEXT_INDEXES = [
+    ('myapp_book', 'book_search_ft', ['isbn', 'title', 'author']),
+    ('myapp_student', 'student_search_ft', ['id_number', 'name']),
+]
+
+
+def create_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    quote = schema_editor.quote_name
+    for table, name, columns in FULLTEXT_INDEXES:
+        schema_editor.execute(
+            f"CREATE FULLTEXT INDEX {quote(name)} ON {quote(table)} "
+            f"({', '.join(quote(column) for column in columns)})"
+        )
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    quote = schema_editor.quote_name
+    for table, name, columns in FULLTEXT_INDEXES:
+        schema_editor.execute(f"DROP INDEX {quote(name)} ON {quote(table)}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0004_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_indexes, drop_fulltext_indexes),
+    ]
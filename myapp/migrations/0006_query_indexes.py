@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_fulltext_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['created_at', 'id'], name='book_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['quantity', 'created_at', 'id'], name='book_quantity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuedbook',
+            index=models.Index(fields=['issue_date', 'id'], name='issuedbook_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuedbook',
+            index=models.Index(fields=['is_returned', 'issue_date', 'id'], name='issuedbook_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuedbook',
+            index=models.Index(fields=['student', 'is_returned', 'issue_date'], name='issuedbook_student_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def link_students_to_users(apps, schema_editor):
+    """Link each student to the account whose username is the student's name.
+
+    Names shared by several students are ambiguous and are left unlinked.
+    """
+    Student = apps.get_model('myapp', 'Student')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    unique_names = (
+        Student.objects.values('name')
+        .annotate(students=Count('pk'))
+        .filter(students=1)
+        .values_list('name', flat=True)
+    )
+    users = dict(User.objects.filter(username__in=unique_names).values_list('username', 'pk'))
+    students = list(Student.objects.filter(name__in=users))
+    for student in students:
+        student.user_id = users[student.name]
+    Student.objects.bulk_update(students, ['user'], batch_size=1000)
+
+
+def unlink_students(apps, schema_editor):
+    apps.get_model('myapp', 'Student').objects.update(user=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='user',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='student_profile', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(link_students_to_users, unlink_students),
+    ]
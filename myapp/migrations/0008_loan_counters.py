@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:55
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    """Compute every counter from the loans table, one UPDATE per model."""
+    Book = apps.get_model('myapp', 'Book')
+    Student = apps.get_model('myapp', 'Student')
+    IssuedBook = apps.get_model('myapp', 'IssuedBook')
+    active = IssuedBook.objects.filter(is_returned=False)
+    on_loan = Coalesce(Subquery(
+        active.filter(book=OuterRef('pk')).values('book').annotate(copies=Sum('quantity')).values('copies')
+    ), 0)
+    Book.objects.update(on_loan_copies=on_loan, total_copies=F('quantity') + on_loan)
+    Student.objects.update(active_loan_count=Coalesce(Subquery(
+        active.filter(student=OuterRef('pk')).values('student').annotate(loans=Count('pk')).values('loans')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_student_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='on_loan_copies',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='total_copies',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='active_loan_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['on_loan_copies', 'id'], name='book_on_loan_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['active_loan_count', 'id'], name='student_active_loans_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
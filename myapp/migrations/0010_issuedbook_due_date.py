@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:40
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, ExpressionWrapper, F, Value, When
+
+
+def backfill_due_dates(apps, schema_editor):
+    """Date every existing loan by the current policy, in a single UPDATE."""
+    IssuedBook = apps.get_model('myapp', 'IssuedBook')
+    Student = apps.get_model('myapp', 'Student')
+    # Departments with a loan period of their own
+    period = Case(
+        *(
+            When(
+                student__in=Student.objects.filter(department=department).values('pk'),
+                then=Value(timedelta(days=days)),
+            )
+            for department, days in settings.LIBRARY_LOAN_PERIOD_DAYS_BY_DEPARTMENT.items()
+        ),
+        default=Value(timedelta(days=settings.LIBRARY_LOAN_PERIOD_DAYS)),
+        output_field=models.DurationField(),
+    )
+    IssuedBook.objects.update(
+        due_date=ExpressionWrapper(F('issue_date') + period, output_field=models.DateField())
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_updated_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issuedbook',
+            name='due_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(backfill_due_dates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='issuedbook',
+            name='due_date',
+            field=models.DateField(),
+        ),
+        migrations.AddIndex(
+            model_name='issuedbook',
+            index=models.Index(fields=['is_returned', 'due_date'], name='issuedbook_overdue_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_task'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='book',
+            name='book_quantity_idx',
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='in_stock',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(quantity__gt=0, then=models.Value(1)), default=models.Value(0)), output_field=models.SmallIntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['in_stock', 'created_at', 'id'], name='book_in_stock_idx'),
+        ),
+    ]
@@ -1,18 +1,125 @@
+from django.conf import settings
 from django.db import models
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from . import loan_policy
+
+
+def _preserve_counters(instance, counters, kwargs):
+    """Leave ``counters`` out of a full save of an existing row.
+
+    The loan counters are only moved by the UPDATEs in myapp.inventory; an
+    instance loaded before a concurrent issue or return must not write its
+    stale copy back.
+    """
+    if not instance._state.adding and kwargs.get('update_fields') is None:
+        kwargs['update_fields'] = [
+            field.name for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name not in counters
+        ]
+
+
+class BookQuerySet(models.QuerySet):
+    def with_status(self, status):
+        """Filter on the availability choices used by the UI: all, available, unavailable."""
+        if status == 'available':
+            return self.filter(in_stock=1)
+        if status == 'unavailable':
+            return self.filter(in_stock=0)
+        return self
+
+
+class StudentQuerySet(models.QuerySet):
+    def with_status(self, status):
+        """Filter on the borrowing choices used by the UI: all, borrowing, idle."""
+        if status == 'borrowing':
+            return self.filter(active_loan_count__gt=0)
+        if status == 'idle':
+            return self.filter(active_loan_count=0)
+        return self
+
+    def link_user(self, user):
+        """Attach ``user`` to the one unlinked student whose name is its username.
+
+        Returns the linked student, or None when there is no such student or
+        the name is ambiguous.
+        """
+        candidates = list(self.filter(name=user.username, user__isnull=True)[:2])
+        if len(candidates) != 1:
+            return None
+        student = candidates[0]
+        student.user = user
+        student.save(update_fields=['user', 'updated_at'])
+        return student
+
+
+class IssuedBookQuerySet(models.QuerySet):
+    def with_status(self, status):
+        """Filter on the loan choices used by the UI: all, active, returned."""
+        if status == 'active':
+            return self.filter(is_returned=False)
+        if status == 'returned':
+            return self.filter(is_returned=True)
+        return self
+
+    def overdue(self, today=None):
+        """Loans still out after their due date, on the ``(is_returned, due_date)`` index."""
+        return self.filter(is_returned=False, due_date__lt=today or timezone.localdate())
+
 
 class Book(models.Model):
     title = models.CharField(max_length=200)
     author = models.CharField(max_length=200)
     isbn = models.CharField(max_length=13, unique=True)
     quantity = models.IntegerField(default=1)
+    # Copies owned (in stock + on loan) and copies out on active loans
+    total_copies = models.IntegerField(default=0, editable=False)
+    on_loan_copies = models.IntegerField(default=0, editable=False)
+    # 1 with copies in stock, else 0; computed by the database.  An equality on it
+    # keeps the listing order indexed, which quantity > 0 cannot.  Not a boolean:
+    # Django writes boolean filters as "WHERE in_stock", which no index matches.
+    in_stock = models.GeneratedField(
+        expression=Case(When(quantity__gt=0, then=Value(1)), default=Value(0)),
+        output_field=models.SmallIntegerField(),
+        db_persist=True,
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BookQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        _preserve_counters(self, ('on_loan_copies',), kwargs)
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding:
+            self.total_copies = self.quantity + self.on_loan_copies
+        elif 'quantity' in update_fields:
+            # Editing the stock changes the copies owned; add the on-loan count in SQL
+            self.total_copies = F('on_loan_copies') + self.quantity
+            kwargs['update_fields'] = {*update_fields, 'total_copies'}
+        super().save(*args, **kwargs)
+        if not isinstance(self.total_copies, int):
+            self.refresh_from_db(fields=['on_loan_copies', 'total_copies'])
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Prefix lookups (istartswith) from the issue form typeahead
+            models.Index(fields=['title'], name='book_title_idx'),
+            models.Index(fields=['author'], name='book_author_idx'),
+            # Keyset listing order (-created_at, -pk); read backwards
+            models.Index(fields=['created_at', 'id'], name='book_created_idx'),
+            # Availability filters in the listing order
+            models.Index(fields=['in_stock', 'created_at', 'id'], name='book_in_stock_idx'),
+            # "Most borrowed" listing order
+            models.Index(fields=['on_loan_copies', 'id'], name='book_on_loan_idx'),
+            # MAX(updated_at) for the conditional GET validators
+            models.Index(fields=['updated_at'], name='book_updated_idx'),
+        ]
 
 
 class Student(models.Model):
@@ -26,14 +133,35 @@ class Student(models.Model):
     id_number = models.CharField(max_length=20, unique=True)
     department = models.CharField(max_length=20, choices=DEPARTMENT_CHOICES)
     phone_number = models.CharField(max_length=20, default='')
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='student_profile',
+    )
+    # Loans not yet returned
+    active_loan_count = models.IntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = StudentQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.name} ({self.id_number})"
 
+    def save(self, *args, **kwargs):
+        _preserve_counters(self, ('active_loan_count',), kwargs)
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['id_number']
+        indexes = [
+            models.Index(fields=['name'], name='student_name_idx'),
+            # "Most active borrowers" listing order and the borrowing filter
+            models.Index(fields=['active_loan_count', 'id'], name='student_active_loans_idx'),
+            models.Index(fields=['updated_at'], name='student_updated_idx'),
+        ]
 
 
 class IssuedBook(models.Model):
@@ -41,13 +169,77 @@ class IssuedBook(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='issued_to')
     quantity = models.IntegerField(default=1)
     issue_date = models.DateField(auto_now_add=True)
+    # Set from myapp.loan_policy when the loan is issued
+    due_date = models.DateField()
     return_date = models.DateField(null=True, blank=True)
     is_returned = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = IssuedBookQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.book.title} - {self.student.name}"
 
+    def save(self, *args, **kwargs):
+        if self.due_date is None:
+            self.due_date = loan_policy.due_date(self.issue_date, self.student)
+        super().save(*args, **kwargs)
+
+    @property
+    def is_overdue(self):
+        return loan_policy.is_overdue(self)
+
     class Meta:
         ordering = ['-issue_date']
+        indexes = [
+            # Keyset listing order (-issue_date, -pk), unfiltered and by status;
+            # the status index also covers the loan counters
+            models.Index(fields=['issue_date', 'id'], name='issuedbook_date_idx'),
+            models.Index(fields=['is_returned', 'issue_date', 'id'], name='issuedbook_status_idx'),
+            # A student's loans, active ones first found by the bulk return FIFO
+            models.Index(fields=['student', 'is_returned', 'issue_date'], name='issuedbook_student_idx'),
+            # Overdue loans: is_returned = False AND due_date < today
+            models.Index(fields=['is_returned', 'due_date'], name='issuedbook_overdue_idx'),
+        ]
+
+
+class Task(models.Model):
+    """A unit of background work for the ``run_worker`` command (see myapp.tasks)."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    # Dotted path of the function, as registered with @task
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    # Set for scheduled runs, so that each one is enqueued once by however many workers
+    unique_key = models.CharField(max_length=200, null=True, blank=True, unique=True)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            # Due work in order: status = 'pending' AND run_at <= now
+            models.Index(fields=['status', 'run_at', 'id'], name='task_due_idx'),
+        ]
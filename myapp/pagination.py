@@ -0,0 +1,161 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Keep full microsecond precision; DjangoJSONEncoder truncates to ms."""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    """One page of rows plus the cursors pointing at its neighbours."""
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+class KeysetPaginator:
+    """Cursor pagination over a fixed ordering.
+
+    Instead of OFFSET, every page is fetched with a ``WHERE (ordering
+    columns) > (last row seen)`` condition, so page 1000 costs the same
+    index range scan as page 1.  ``ordering`` must end in a unique column
+    (the primary key is appended when it is missing) so that ties are
+    broken deterministically and no row is skipped or repeated.
+    """
+
+    def __init__(self, queryset, ordering, per_page=25):
+        self.queryset = queryset
+        self.per_page = per_page
+        ordering = list(ordering)
+        if ordering[-1].lstrip('-') not in ('pk', queryset.model._meta.pk.name):
+            ordering.append('-pk' if ordering[-1].startswith('-') else 'pk')
+        self.ordering = ordering
+        self.fields = [
+            self._resolve_field(name.lstrip('-')) for name in ordering
+        ]
+
+    def _resolve_field(self, name):
+        opts = self.queryset.model._meta
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+    # -- cursor encoding ---------------------------------------------------
+    def encode_cursor(self, row, direction):
+        values = [field.value_from_object(row) for field in self.fields]
+        payload = json.dumps([direction, values], cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (ValueError, TypeError, binascii.Error):
+            raise InvalidCursor(cursor)
+        if direction not in ('n', 'p') or len(values) != len(self.fields):
+            raise InvalidCursor(cursor)
+        try:
+            values = [field.to_python(value) for field, value in zip(self.fields, values)]
+        except Exception:
+            raise InvalidCursor(cursor)
+        return direction, values
+
+    # -- query building ----------------------------------------------------
+    def _seek(self, values, forward):
+        """Q() selecting rows strictly after (or before) ``values``."""
+        condition = Q()
+        equal = Q()
+        for name, value in zip(self.ordering, values):
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _reversed_ordering(self):
+        return [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+
+    def get_page(self, cursor=None):
+        """Return the page after/before ``cursor``; bad cursors give page 1."""
+        direction, values = None, None
+        if cursor:
+            try:
+                direction, values = self.decode_cursor(cursor)
+            except InvalidCursor:
+                pass
+
+        limit = self.per_page + 1
+        if direction == 'p':
+            queryset = self.queryset.filter(self._seek(values, forward=False))
+            rows = list(queryset.order_by(*self._reversed_ordering())[:limit])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_next = True
+        else:
+            queryset = self.queryset
+            if direction == 'n':
+                queryset = queryset.filter(self._seek(values, forward=True))
+            rows = list(queryset.order_by(*self.ordering)[:limit])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = direction == 'n'
+
+        if not rows:
+            return KeysetPage([])
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1], 'n') if has_next else None,
+            prev_cursor=self.encode_cursor(rows[0], 'p') if has_previous else None,
+        )
+
+    def iter_batches(self):
+        """Every row in order, ``per_page`` at a time, by the same seek as the pages."""
+        queryset = self.queryset.order_by(*self.ordering)
+        values = None
+        while True:
+            batch = queryset if values is None else queryset.filter(self._seek(values, forward=True))
+            rows = list(batch[:self.per_page])
+            if rows:
+                yield rows
+            if len(rows) < self.per_page:
+                return
+            values = [field.value_from_object(rows[-1]) for field in self.fields]
+
+
+def paginate(request, queryset, ordering, per_page):
+    """Keyset-paginate ``queryset`` using the request's ``cursor`` parameter."""
+    paginator = KeysetPaginator(queryset, ordering, per_page=per_page)
+    return paginator.get_page(request.GET.get('cursor'))
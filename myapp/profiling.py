@@ -0,0 +1,206 @@
+"""Opt-in, sampled request profiling.
+
+With ``LIBRARY_PROFILING`` enabled, ``ProfilingMiddleware`` profiles a
+``LIBRARY_PROFILING_SAMPLE_RATE`` fraction of requests.  For each one it
+records the wall time, every SQL query (count, total time and repeats of
+an identical statement) and the time spent rendering templates, keyed by
+the resolved URL name.  The figures go to the response's
+``Server-Timing`` header and, one JSON object per line, to a rotating log.
+
+Unsampled requests cost one random number, and the middleware removes
+itself entirely (``MiddlewareNotUsed``) while profiling is disabled.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import random
+import time
+import threading
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.template.base import Template
+from django.utils import timezone
+
+from .queryhooks import observe_queries
+
+# Statements reported per request in the log, most repeated first
+MAX_REPORTED_DUPLICATES = 5
+
+_active_profile = contextvars.ContextVar('library_profile', default=None)
+_original_template_render = None
+
+
+class RequestProfile:
+    """Timings collected for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.db_time = 0.0
+        self.queries = Counter()     # (sql, params) -> executions
+        self.template_time = 0.0
+        self.template_depth = 0
+        # Concurrent queries of one request run in threads of their own
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        """Query hook (see ``myapp.queryhooks``) timing every query."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.db_time += elapsed
+                self.queries[sql, repr(params)] += 1
+
+    def capture(self):
+        """Context manager recording the request's queries, in any thread, and template renders."""
+        stack = ExitStack()
+        stack.enter_context(observe_queries(self))
+        token = _active_profile.set(self)
+        stack.callback(_active_profile.reset, token)
+        stack.callback(self.finish)
+        return stack
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def duplicate_count(self):
+        """Executions that repeated an earlier identical statement and parameters."""
+        return sum(count - 1 for count in self.queries.values())
+
+    def duplicates(self):
+        repeated = [(key, count) for key, count in self.queries.most_common() if count > 1]
+        return [
+            {'sql': sql, 'params': params, 'count': count}
+            for (sql, params), count in repeated[:MAX_REPORTED_DUPLICATES]
+        ]
+
+    def server_timing(self):
+        return ', '.join([
+            f'total;dur={self.total * 1000:.1f}',
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.query_count} queries, '
+            f'{self.duplicate_count} duplicates"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+        ])
+
+    def as_record(self, request, response):
+        match = request.resolver_match
+        return {
+            'time': timezone.now().isoformat(),
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(self.total * 1000, 2),
+            'db_ms': round(self.db_time * 1000, 2),
+            'queries': self.query_count,
+            'duplicate_queries': self.duplicate_count,
+            'duplicates': self.duplicates(),
+            'template_ms': round(self.template_time * 1000, 2),
+        }
+
+
+def _timed_template_render(self, context):
+    """Template.render, timing the outermost render of a profiled request."""
+    profile = _active_profile.get()
+    if profile is None:
+        return _original_template_render(self, context)
+    profile.template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _original_template_render(self, context)
+    finally:
+        profile.template_depth -= 1
+        if not profile.template_depth:
+            # {% include %} renders nested templates; count them once
+            profile.template_time += time.perf_counter() - started
+
+
+def install_template_timer():
+    """Wrap ``Template.render`` once; unprofiled renders only pay a ContextVar lookup."""
+    global _original_template_render
+    if _original_template_render is None:
+        _original_template_render = Template.render
+        Template.render = _timed_template_render
+
+
+def get_profile_logger():
+    """The JSONL logger, with a rotating handler on ``LIBRARY_PROFILING_LOG``."""
+    path = Path(settings.LIBRARY_PROFILING_LOG)
+    logger = logging.getLogger('myapp.profiling')
+    for handler in logger.handlers:
+        if getattr(handler, 'baseFilename', None) == str(path.resolve()):
+            return logger
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        path,
+        maxBytes=settings.LIBRARY_PROFILING_LOG_MAX_BYTES,
+        backupCount=settings.LIBRARY_PROFILING_LOG_BACKUPS,
+        encoding='utf-8',
+    )
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.LIBRARY_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.sample_rate = settings.LIBRARY_PROFILING_SAMPLE_RATE
+        self.logger = get_profile_logger()
+        install_template_timer()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        with profile.capture():
+            response = self.get_response(request)
+        return self.report(request, response, profile)
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        profile = RequestProfile()
+        with profile.capture():
+            response = await self.get_response(request)
+        return self.report(request, response, profile)
+
+    def report(self, request, response, profile):
+        # Streaming responses are timed up to the first byte, not to the last
+        timing = profile.server_timing()
+        if response.has_header('Server-Timing'):
+            timing = f"{response['Server-Timing']}, {timing}"
+        response['Server-Timing'] = timing
+        self.logger.info(json.dumps(profile.as_record(request, response), default=str))
+        return response
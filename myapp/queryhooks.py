@@ -0,0 +1,43 @@
+"""Query hooks scoped to a request, wherever its queries run.
+
+``connection.execute_wrapper()`` only wraps the calling thread's
+connection, and Django keeps a connection per thread: under ASGI the
+view's queries run in ``sync_to_async`` threads, on connections the
+middleware never sees.  Instead, every connection gets one permanent
+wrapper when it opens, which passes each query to the hooks in
+``_hooks``.  That is a ContextVar, which ``sync_to_async`` copies into
+the threads it runs code in, so ``observe_queries()`` around a request
+sees every query run on its behalf, in any thread.
+"""
+import contextvars
+from contextlib import contextmanager
+from functools import partial
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_hooks = contextvars.ContextVar('library_query_hooks', default=())
+
+
+def _run_hooks(execute, sql, params, many, context):
+    hooks = _hooks.get()
+    for hook in reversed(hooks):
+        execute = partial(hook, execute)
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_hooks(sender, connection, **kwargs):
+    # A reconnecting wrapper sends the signal again
+    if _run_hooks not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _run_hooks)
+
+
+@contextmanager
+def observe_queries(hook):
+    """Call ``hook(execute, sql, params, many, context)`` for the queries run in this context."""
+    token = _hooks.set(_hooks.get() + (hook,))
+    try:
+        yield
+    finally:
+        _hooks.reset(token)
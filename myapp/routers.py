@@ -0,0 +1,171 @@
+"""Read replicas for the list and dashboard pages.
+
+``LIBRARY_READ_REPLICAS`` names the ``DATABASES`` aliases that replicate
+``default``.  The views decorated with ``replica_reads`` run their queries
+on one of them; everything else, and every write, stays on ``default``
+(``PrimaryReplicaRouter``).
+
+A replica is only used while it is at most ``LIBRARY_REPLICA_MAX_LAG``
+seconds behind.  The lag is read from the server (``SHOW REPLICA STATUS``
+on MySQL) at most every ``LIBRARY_REPLICA_LAG_CHECK_INTERVAL`` seconds per
+process; a replica that cannot be reached or has stopped replicating
+counts as infinitely far behind.  With no replica in tolerance the pages
+read from the primary.
+
+``ReadYourWritesMiddleware`` pins a session to the primary for
+``LIBRARY_REPLICA_STICKY_SECONDS`` after each POST, so a librarian who has
+just issued a book sees the loan on the next page even if the replicas
+have not caught up yet.  Other sessions may see it up to the lag later.
+"""
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+PINNED_UNTIL_KEY = 'library_primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+# The alias the current request reads from; None for the primary
+_read_alias = ContextVar('library_read_alias', default=None)
+_lags = {}                          # alias -> (checked at, seconds behind)
+_lags_lock = threading.Lock()
+
+
+class PrimaryReplicaRouter:
+    """Reads from the replica chosen for the request, writes to the primary."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Also for objects that were loaded from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.LIBRARY_READ_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema from the primary
+        if db in settings.LIBRARY_READ_REPLICAS:
+            return False
+        return None
+
+
+@contextmanager
+def reading_from(alias):
+    """Route the reads inside the block to ``alias`` (None: the primary)."""
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def replica_lag(alias):
+    """Seconds replica ``alias`` is behind, measured at most once per check interval."""
+    now = time.monotonic()
+    with _lags_lock:
+        checked = _lags.get(alias)
+    if checked is not None and now - checked[0] < settings.LIBRARY_REPLICA_LAG_CHECK_INTERVAL:
+        return checked[1]
+    lag = _measure_lag(connections[alias])
+    with _lags_lock:
+        _lags[alias] = (now, lag)
+    return lag
+
+
+def _measure_lag(connection):
+    if connection.vendor != 'mysql':
+        # No replication status to read (e.g. a SQLite copy)
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute('SHOW REPLICA STATUS')
+                column = 'Seconds_Behind_Source'
+            except DatabaseError:
+                # Before MySQL 8.0.22
+                cursor.execute('SHOW SLAVE STATUS')
+                column = 'Seconds_Behind_Master'
+            row = cursor.fetchone()
+            names = [description[0] for description in cursor.description or ()]
+    except DatabaseError:
+        return math.inf
+    if row is None:
+        # Not a replica: the primary itself under another alias
+        return 0.0
+    lag = row[names.index(column)]
+    # NULL while the replication threads are stopped
+    return math.inf if lag is None else float(lag)
+
+
+def read_database(request):
+    """The replica ``request`` may read from, or None for the primary."""
+    replicas = settings.LIBRARY_READ_REPLICAS
+    if not replicas or request.method not in READ_METHODS:
+        return None
+    session = getattr(request, 'session', None)
+    if session is not None and session.get(PINNED_UNTIL_KEY, 0) > time.time():
+        return None
+    current = [alias for alias in replicas if replica_lag(alias) <= settings.LIBRARY_REPLICA_MAX_LAG]
+    return random.choice(current) if current else None
+
+
+def replica_reads(view):
+    """Run ``view``'s queries on a read replica when ``read_database`` allows it.
+
+    The body of a streamed response is produced after the view returns,
+    and reads from the primary.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            with reading_from(await sync_to_async(read_database)(request)):
+                return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with reading_from(read_database(request)):
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReadYourWritesMiddleware:
+    """Pin a session to the primary for a while after each of its writes."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.pins(request) and request.user.is_authenticated:
+            request.session[PINNED_UNTIL_KEY] = time.time() + settings.LIBRARY_REPLICA_STICKY_SECONDS
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.pins(request) and (await request.auser()).is_authenticated:
+            await request.session.aset(PINNED_UNTIL_KEY, time.time() + settings.LIBRARY_REPLICA_STICKY_SECONDS)
+        return response
+
+    def pins(self, request):
+        return bool(settings.LIBRARY_READ_REPLICAS) and request.method not in READ_METHODS
@@ -0,0 +1,322 @@
+"""Relevance-ranked search over books and students.
+
+Backends answer ``search(model, query, limit)`` with primary keys, best
+match first.  ``LIBRARY_SEARCH_BACKEND`` selects one:
+
+``'mysql'``
+    ``MATCH ... AGAINST`` in boolean mode on the FULLTEXT indexes created
+    by migration 0005; every word must match and ``word*`` prefixes are
+    allowed.
+``'memory'``
+    An inverted index held in the worker process, built on the first
+    query and kept current by the model signals in ``myapp.signals``.
+    Writes made in other processes are not seen, so multi-worker MySQL
+    deployments should prefer ``'mysql'``.
+``'auto'`` (default)
+    ``'mysql'`` on MySQL, ``'memory'`` anywhere else.
+"""
+import bisect
+import heapq
+import itertools
+import math
+import re
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import Book, Student
+
+# Searchable fields and their weight in the ranking, per model
+SEARCH_FIELDS = {
+    Book: {'isbn': 5.0, 'title': 3.0, 'author': 2.0},
+    Student: {'id_number': 5.0, 'name': 3.0},
+}
+
+# A prefix expands to at most this many indexed words
+MAX_PREFIX_TERMS = 64
+# Ranking factor for a word matched only by prefix, relative to an exact match
+PREFIX_FACTOR = 0.6
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return _WORD_RE.findall(str(text).lower())
+
+
+class InvertedIndex:
+    """Word -> postings index with prefix expansion and TF-IDF-style ranking.
+
+    Each word's postings are bucketed by field weight ("impact"), and every
+    document in a bucket scores the same for that word.  A query combines
+    buckets of its words from the highest score down, intersecting them
+    as sets, and stops as soon as no remaining combination can beat the
+    results it already holds; a common word therefore costs about as much
+    as a rare one.  Ties keep indexing order (primary-key order after a
+    build).
+
+    Prefixes are resolved by bisecting the sorted vocabulary.  Words first
+    seen after the initial load go to a small sorted list that is merged
+    into the main one once it grows past ``MAX_RECENT_WORDS``, so single
+    updates never re-sort the whole vocabulary.
+    """
+
+    MAX_RECENT_WORDS = 4096
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.postings = {}      # word -> {weight: {pk: None}}
+        self.words = []         # sorted vocabulary, for prefix ranges
+        self.recent = []        # sorted words added since the last merge
+        self.documents = {}     # pk -> ((word, weight), ...), so a document can be re-indexed
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _weigh(self, values):
+        weighted = {}
+        for field, weight in self.weights.items():
+            for word in tokenize(values.get(field) or ''):
+                weighted[word] = weighted.get(word, 0.0) + weight
+        return weighted
+
+    def _add(self, pk, values, new_words):
+        self._remove(pk)
+        weighted = self._weigh(values)
+        for word, weight in weighted.items():
+            buckets = self.postings.get(word)
+            if buckets is None:
+                buckets = self.postings[word] = {}
+                new_words.append(word)
+            buckets.setdefault(weight, {})[pk] = None
+        self.documents[pk] = tuple(weighted.items())
+
+    def load(self, rows):
+        """Bulk-index ``(pk, {field: text})`` rows, sorting the vocabulary once."""
+        with self.lock:
+            new_words = []
+            for pk, values in rows:
+                self._add(pk, values, new_words)
+            self.words = sorted(self.postings)
+            self.recent = []
+
+    def add(self, pk, values):
+        """Index ``values`` ({field: text}) under ``pk``, replacing any earlier entry."""
+        with self.lock:
+            new_words = []
+            self._add(pk, values, new_words)
+            for word in new_words:
+                bisect.insort(self.recent, word)
+            if len(self.recent) > self.MAX_RECENT_WORDS:
+                self.words = list(heapq.merge(self.words, self.recent))
+                self.recent = []
+
+    def remove(self, pk):
+        with self.lock:
+            self._remove(pk)
+
+    def _remove(self, pk):
+        # Emptied words stay in the vocabulary with no buckets
+        for word, weight in self.documents.pop(pk, ()):
+            buckets = self.postings[word]
+            bucket = buckets[weight]
+            del bucket[pk]
+            if not bucket:
+                del buckets[weight]
+
+    def _expand(self, token):
+        matches = []
+        for words in (self.words, self.recent):
+            start = bisect.bisect_left(words, token)
+            end = bisect.bisect_left(words, token + '\uffff', lo=start)
+            matches.extend(words[start:min(end, start + MAX_PREFIX_TERMS)])
+        if len(matches) > MAX_PREFIX_TERMS:
+            matches = sorted(matches)[:MAX_PREFIX_TERMS]
+        return matches
+
+    def _term(self, token):
+        """Posting count and score-ordered ``(score, bucket)`` pairs for one query token."""
+        total = len(self.documents) or 1
+        count, impacts = 0, []
+        for word in self._expand(token):
+            buckets = self.postings[word]
+            size = sum(len(bucket) for bucket in buckets.values())
+            if not size:
+                continue
+            count += size
+            factor = math.log(1 + total / size)
+            if word != token:
+                factor *= PREFIX_FACTOR
+            impacts.extend((weight * factor, bucket) for weight, bucket in buckets.items())
+        impacts.sort(key=lambda impact: impact[0], reverse=True)
+        return count, impacts
+
+    def search(self, query, limit=50):
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        with self.lock:
+            # Rarest token first, so the later intersections start small
+            terms = sorted((self._term(token) for token in tokens), key=lambda term: term[0])
+            if not terms[0][0]:
+                return []
+            impacts = [term[1] for term in terms]
+            # bounds[i]: the most that the tokens after the i-th can add
+            top_scores = [term_impacts[0][0] for term_impacts in impacts[:0:-1]]
+            bounds = list(itertools.accumulate(top_scores, initial=0.0))[::-1]
+            best = []          # min-heap of (score, order, pk)
+            seen = set()
+            order = itertools.count(0, -1)
+
+            def done(score):
+                return len(best) >= limit and score <= best[0][0]
+
+            def collect(pks, score, depth):
+                """Rank ``pks``, which match terms[:depth] for a total of ``score``."""
+                if depth == len(impacts):
+                    # Same score for all of them, so only the first few can place
+                    for pk in itertools.islice(pks, limit):
+                        if done(score):
+                            return
+                        if pk not in seen:
+                            seen.add(pk)
+                            entry = (score, next(order), pk)
+                            if len(best) < limit:
+                                heapq.heappush(best, entry)
+                            else:
+                                heapq.heapreplace(best, entry)
+                    return
+                taken = set()
+                for impact, bucket in impacts[depth]:
+                    if done(score + impact + bounds[depth]):
+                        break
+                    if pks is None:
+                        hits = bucket.keys()
+                    else:
+                        # A document can match several words of a prefix; keep its best
+                        hits = (bucket.keys() & pks) - taken
+                        if not hits:
+                            continue
+                        taken |= hits
+                    collect(hits, score + impact, depth + 1)
+                    if pks is not None and len(taken) == len(pks):
+                        break
+
+            collect(None, 0.0, 0)
+        return [pk for _, _, pk in sorted(best, reverse=True)]
+
+
+class InMemoryBackend:
+    def __init__(self):
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def get_index(self, model):
+        index = self.indexes.get(model)
+        if index is None:
+            with self.lock:
+                index = self.indexes.get(model)
+                if index is None:
+                    index = self.indexes[model] = self.build(model)
+        return index
+
+    def build(self, model):
+        from .exports import iter_rows
+
+        fields = list(SEARCH_FIELDS[model])
+        index = InvertedIndex(SEARCH_FIELDS[model])
+        index.load(
+            (row[0], dict(zip(fields, row[1:])))
+            for row in iter_rows(model.objects.all(), ['pk', *fields])
+        )
+        return index
+
+    def search(self, model, query, limit=50):
+        return self.get_index(model).search(query, limit)
+
+    def update(self, instance):
+        index = self.indexes.get(type(instance))
+        if index is not None:
+            fields = SEARCH_FIELDS[type(instance)]
+            index.add(instance.pk, {field: getattr(instance, field) for field in fields})
+
+    def remove(self, instance):
+        index = self.indexes.get(type(instance))
+        if index is not None:
+            index.remove(instance.pk)
+
+    def reset(self, model=None):
+        """Drop the index for ``model`` (or all); it is rebuilt on the next query."""
+        with self.lock:
+            if model is None:
+                self.indexes.clear()
+            else:
+                self.indexes.pop(model, None)
+
+
+class MySQLFulltextBackend:
+    def search(self, model, query, limit=50):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        columns = ', '.join(
+            connection.ops.quote_name(model._meta.get_field(field).column)
+            for field in SEARCH_FIELDS[model]
+        )
+        match = f'MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)'
+        terms = ' '.join(f'+{token}*' for token in tokens)
+        return list(
+            model.objects.annotate(relevance=RawSQL(match, [terms], output_field=FloatField()))
+            .filter(relevance__gt=0)
+            .order_by('-relevance', 'pk')
+            .values_list('pk', flat=True)[:limit]
+        )
+
+    def update(self, instance):
+        pass
+
+    def remove(self, instance):
+        pass
+
+    def reset(self, model=None):
+        pass
+
+
+_backends = {}
+
+
+def get_backend():
+    name = settings.LIBRARY_SEARCH_BACKEND
+    if name == 'auto':
+        name = 'mysql' if connection.vendor == 'mysql' else 'memory'
+    if name not in _backends:
+        _backends[name] = MySQLFulltextBackend() if name == 'mysql' else InMemoryBackend()
+    return _backends[name]
+
+
+def search(model, query, queryset=None, limit=None):
+    """Objects of ``model`` matching ``query``, best match first.
+
+    ``queryset`` narrows the results further (e.g. a status filter).  The
+    backends rank every matching object, so when the filter drops some of
+    the best ``limit`` matches, more are fetched, four times as many each
+    round, until ``limit`` results pass it or the matches run out.
+    """
+    limit = limit or settings.LIBRARY_SEARCH_LIMIT
+    if queryset is None:
+        queryset = model.objects.all()
+    backend = get_backend()
+    results, checked, fetch = [], set(), limit
+    while True:
+        pks = backend.search(model, query, fetch)
+        unchecked = [pk for pk in pks if pk not in checked]
+        found = queryset.in_bulk(unchecked)
+        results.extend(found[pk] for pk in unchecked if pk in found)
+        if len(results) >= limit or len(pks) < fetch:
+            return results[:limit]
+        checked.update(unchecked)
+        fetch *= 4
@@ -0,0 +1,74 @@
+from django.contrib.auth.signals import user_logged_in, user_login_failed
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .fragments import bump_fragment_versions
+from .metrics import LOGINS
+from .models import Book, Student, IssuedBook
+from .search import get_backend
+from .stats import invalidate_library_stats
+
+
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Student)
+@receiver([post_save, post_delete], sender=IssuedBook)
+def library_changed(sender, **kwargs):
+    """Any write to the catalogue, students or loans outdates the dashboard."""
+    # After the commit: a dashboard read in between would cache the old counters
+    transaction.on_commit(invalidate_library_stats)
+
+
+@receiver(post_delete, sender=IssuedBook)
+def loan_deleted(sender, instance, **kwargs):
+    """A deleted loan that was still out leaves the counters; its copies are not restocked."""
+    if not instance.is_returned:
+        now = timezone.now()
+        Book.objects.filter(pk=instance.book_id).update(
+            on_loan_copies=F('on_loan_copies') - instance.quantity,
+            total_copies=F('total_copies') - instance.quantity,
+            updated_at=now,
+        )
+        Student.objects.filter(pk=instance.student_id).update(
+            active_loan_count=F('active_loan_count') - 1, updated_at=now
+        )
+        transaction.on_commit(lambda: bump_fragment_versions('books'))
+
+
+@receiver([post_save, post_delete], sender=Book)
+def book_fragments_changed(sender, **kwargs):
+    """Outdate the cached book tables, and the loan tables that show titles."""
+    # After the commit, as for loans below
+    transaction.on_commit(lambda: bump_fragment_versions('books', 'catalogue'))
+
+
+@receiver([post_save, post_delete], sender=IssuedBook)
+def loan_fragments_changed(sender, instance, **kwargs):
+    # After the commit: a page rendered in between would cache the old table under the new version
+    key = f'loans:{instance.student_id}'
+    transaction.on_commit(lambda: bump_fragment_versions(key))
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Student)
+def search_index_update(sender, instance, **kwargs):
+    """Keep the in-process search index in step with saved books and students."""
+    get_backend().update(instance)
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Student)
+def search_index_remove(sender, instance, **kwargs):
+    get_backend().remove(instance)
+
+
+@receiver(user_logged_in)
+def login_succeeded(sender, **kwargs):
+    LOGINS.inc(result='success')
+
+
+@receiver(user_login_failed)
+def login_failed(sender, **kwargs):
+    LOGINS.inc(result='failure')
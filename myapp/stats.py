@@ -0,0 +1,195 @@
+"""Counters shown on the dashboards and list headers.
+
+Each function answers with a single conditional-aggregation query, so a
+page needs one round-trip per model however many counters it shows.
+``cached_library_stats`` serves the librarian dashboard counters from the
+cache framework; ``myapp.signals`` invalidates them whenever a Book,
+Student or IssuedBook changes.  ``cached_overdue_report`` serves the
+librarian dashboard's overdue lists from a periodic snapshot instead.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, F, Q, Window
+from django.utils import timezone
+
+from .models import Book, Student, IssuedBook
+from .routers import reading_from
+
+STATS_GENERATION_KEY = 'library-stats:generation'
+STATS_HITS_KEY = 'library-stats:hits'
+STATS_MISSES_KEY = 'library-stats:misses'
+
+
+def book_stats():
+    """Total, available and out-of-stock titles."""
+    return Book.objects.aggregate(
+        total_books=Count('pk'),
+        available_books=Count('pk', filter=Q(quantity__gt=0)),
+        unavailable_books=Count('pk', filter=Q(quantity=0)),
+    )
+
+
+def student_stats():
+    """Registered students."""
+    return Student.objects.aggregate(total_students=Count('pk'))
+
+
+def loan_stats(student=None, today=None):
+    """Active, returned and overdue loans, optionally for a single student."""
+    loans = IssuedBook.objects.all()
+    if student is not None:
+        loans = loans.filter(student=student)
+    return loans.aggregate(
+        total_loans=Count('pk'),
+        active_issues=Count('pk', filter=Q(is_returned=False)),
+        returned_issues=Count('pk', filter=Q(is_returned=True)),
+        overdue_issues=Count(
+            'pk', filter=Q(is_returned=False, due_date__lt=today or timezone.localdate())
+        ),
+    )
+
+
+def library_stats(today=None):
+    """Every dashboard counter, one query per model."""
+    stats = {}
+    stats.update(book_stats())
+    stats.update(student_stats())
+    stats.update(loan_stats(today=today))
+    return stats
+
+
+# ============= OVERDUE LOANS =============
+def overdue_report(today=None, limit=None):
+    """Overdue loans and every student's overdue count, from one query.
+
+    The loans are read most overdue first along the ``(is_returned,
+    due_date)`` index; a window function adds each student's count to
+    their rows.  Returns a dict of:
+
+    ``date``, ``computed_at``, ``total``
+        The day reported on, when, and the number of overdue loans.
+    ``students``
+        ``{student pk: overdue loans}`` for every student with any.
+    ``loans``
+        The first ``limit`` loans (all by default) as dicts of ``pk``,
+        ``student_id``, ``student_name``, ``student_id_number``,
+        ``book_title``, ``quantity``, ``due_date`` and ``days_overdue``.
+    ``top_students``
+        Up to ``limit`` dicts of ``pk``, ``name``, ``id_number`` and
+        ``overdue``, most overdue loans first.
+    """
+    today = today or timezone.localdate()
+    rows = (
+        IssuedBook.objects.overdue(today)
+        .order_by('due_date', 'pk')
+        .values(
+            'pk', 'student_id', 'quantity', 'due_date',
+            student_name=F('student__name'),
+            student_id_number=F('student__id_number'),
+            book_title=F('book__title'),
+            student_overdue=Window(Count('pk'), partition_by=[F('student_id')]),
+        )
+    )
+    students, names, loans = {}, {}, []
+    total = 0
+    for row in rows.iterator():
+        total += 1
+        students[row['student_id']] = row.pop('student_overdue')
+        names[row['student_id']] = (row['student_name'], row['student_id_number'])
+        if limit is None or len(loans) < limit:
+            row['days_overdue'] = (today - row['due_date']).days
+            loans.append(row)
+    top = sorted(students, key=lambda pk: (-students[pk], names[pk]))
+    return {
+        'date': today,
+        'computed_at': timezone.now(),
+        'total': total,
+        'students': students,
+        'loans': loans,
+        'top_students': [
+            {'pk': pk, 'name': names[pk][0], 'id_number': names[pk][1], 'overdue': students[pk]}
+            for pk in (top if limit is None else top[:limit])
+        ],
+    }
+
+
+# ============= CACHED STATISTICS =============
+def _stats_cache():
+    return caches[settings.LIBRARY_STATS_CACHE]
+
+
+def _increment(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # First use, or the counter was evicted
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def cached_library_stats():
+    """``library_stats()`` served from the cache until the next invalidation.
+
+    The cache key carries a generation number that ``invalidate_library_stats``
+    bumps, plus today's date because the overdue count changes at midnight.
+    """
+    cache = _stats_cache()
+    today = timezone.localdate()
+    generation = cache.get_or_set(STATS_GENERATION_KEY, 0, timeout=None)
+    key = f'library-stats:{generation}:{today.isoformat()}'
+
+    stats = cache.get(key)
+    if stats is not None:
+        _increment(cache, STATS_HITS_KEY)
+        return stats
+
+    _increment(cache, STATS_MISSES_KEY)
+    # Counted on the primary: a lagging replica would keep stale counters
+    # cached until the next invalidation
+    with reading_from(None):
+        stats = library_stats(today=today)
+    cache.set(key, stats, timeout=settings.LIBRARY_STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def _overdue_key(today):
+    return f'library-overdue:{today.isoformat()}'
+
+
+def cached_overdue_report():
+    """The latest ``overdue_report()`` of today, at most ``LIBRARY_OVERDUE_REPORT_MAX_AGE`` old.
+
+    Unlike the counters it is not invalidated by every loan change: it
+    reads every overdue loan, so the ``overdue_report`` command refreshes
+    it on a schedule and requests only compute it when it has expired.
+    """
+    cache = _stats_cache()
+    today = timezone.localdate()
+    report = cache.get(_overdue_key(today))
+    if report is None:
+        with reading_from(None):
+            report = overdue_report(today, limit=settings.LIBRARY_OVERDUE_LIST_SIZE)
+        cache_overdue_report(report)
+    return report
+
+
+def cache_overdue_report(report):
+    """Store ``report`` for ``cached_overdue_report``, its lists cut to the dashboard size."""
+    size = settings.LIBRARY_OVERDUE_LIST_SIZE
+    report = {**report, 'loans': report['loans'][:size], 'top_students': report['top_students'][:size]}
+    _stats_cache().set(_overdue_key(report['date']), report, timeout=settings.LIBRARY_OVERDUE_REPORT_MAX_AGE)
+
+
+def invalidate_library_stats():
+    """Make the next ``cached_library_stats()`` call recompute the counters."""
+    _increment(_stats_cache(), STATS_GENERATION_KEY)
+
+
+def stats_cache_info():
+    """Hit and miss counts for the cached statistics, shared by all workers."""
+    cache = _stats_cache()
+    counts = cache.get_many([STATS_HITS_KEY, STATS_MISSES_KEY])
+    return {
+        'hits': counts.get(STATS_HITS_KEY, 0),
+        'misses': counts.get(STATS_MISSES_KEY, 0),
+    }
@@ -0,0 +1,47 @@
+"""Streamed rendering of the long book and loan listings.
+
+With ``?stream=1`` the book list and the loan history show every matching
+row instead of one page.  The page template is rendered once, with a
+marker where the rows go and without reading any of them; everything
+before the marker is sent at once, the rows follow in keyset batches of
+``LIBRARY_STREAM_CHUNK_ROWS``, each rendered with the rows template, and
+the rest of the page comes last.  The first byte therefore leaves as
+quickly for a million rows as for ten, and only one batch is in memory
+at a time.
+"""
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+ROWS_MARKER = mark_safe('<!-- streamed rows -->')
+
+
+def wants_stream(request):
+    return request.GET.get('stream') == '1'
+
+
+def stream_page(request, template_name, context, rows_name, rows_template, paginator):
+    """A ``StreamingHttpResponse`` of ``template_name`` with every row of ``paginator``.
+
+    The page template shows ``stream_rows`` in place of the rows when it
+    is set; ``rows_template`` renders one batch of them as ``rows_name``.
+    ``rows_name`` itself is only a flag for the page template, true when
+    there are rows.
+    """
+    has_rows = paginator.queryset.exists()
+    page = render_to_string(
+        template_name,
+        {**context, rows_name: has_rows, 'page': None, 'stream_rows': ROWS_MARKER},
+        request,
+    )
+    head, _, tail = page.partition(ROWS_MARKER)
+    rows_template = get_template(rows_template)
+
+    def chunks():
+        yield head
+        if has_rows:
+            for batch in paginator.iter_batches():
+                yield rows_template.render({rows_name: batch}, request)
+        yield tail
+
+    return StreamingHttpResponse(chunks(), content_type='text/html; charset=utf-8')
@@ -0,0 +1,298 @@
+"""A small task queue kept in the database.
+
+Work that need not delay a response is wrapped in a function decorated
+with ``@task`` and queued with ``.enqueue(*args, **kwargs)``, which only
+inserts a ``Task`` row.  Inside a transaction the row commits or rolls
+back with the rest of the request's writes, and a worker never sees work
+for data that was not saved.  Arguments must be JSON serialisable:
+pass primary keys, not model instances.
+
+``manage.py run_worker`` runs the queued tasks on up to
+``LIBRARY_TASK_CONCURRENCY`` threads.  A worker claims a task with a
+conditional UPDATE (``... WHERE status = 'pending'``), so several
+workers, on one host or many, can share the queue without a broker.
+A task that raises is retried after ``LIBRARY_TASK_RETRY_DELAY``
+seconds, doubled after each failed attempt, until it has run
+``max_attempts`` times; one left running for ``LIBRARY_TASK_TIMEOUT``
+seconds, because its worker died, is put back in the queue.
+
+``LIBRARY_TASK_SCHEDULE`` maps names to a task and a five-field cron
+expression (minute, hour, day of month, month, day of week), evaluated
+in ``TIME_ZONE``.  Each worker enqueues the runs that fall due while it
+is up; the run's ``unique_key`` keeps other workers from enqueueing it
+again.  Runs missed while no worker was up are skipped, as with cron.
+"""
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import update_wrapper
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .metrics import REGISTRY
+from .models import Task
+
+TASK_RUNS = REGISTRY.counter(
+    'library_task_runs_total',
+    'Task attempts finished, by task and outcome (done, retry, failed).',
+    ['task', 'outcome'],
+)
+TASK_DURATION = REGISTRY.histogram(
+    'library_task_duration_seconds',
+    'Time to run a task attempt, by task.',
+    ['task'],
+)
+
+TASKS = {}      # name -> TaskFunction
+
+
+class TaskFunction:
+    """A function registered with ``@task``; calling it still runs it in place."""
+
+    def __init__(self, function, name=None, max_attempts=None):
+        update_wrapper(self, function)
+        self.function = function
+        self.name = name or f'{function.__module__}.{function.__qualname__}'
+        self.max_attempts = max_attempts
+
+    def __call__(self, *args, **kwargs):
+        return self.function(*args, **kwargs)
+
+    def enqueue(self, *args, **kwargs):
+        """Queue a run of the task as soon as a worker is free; returns the Task."""
+        return enqueue(self.name, args, kwargs)
+
+
+def task(function=None, *, name=None, max_attempts=None):
+    """Register ``function`` as a task; usable as ``@task`` or ``@task(max_attempts=5)``."""
+    def register(function):
+        registered = TaskFunction(function, name, max_attempts)
+        TASKS[registered.name] = registered
+        return registered
+    return register(function) if function is not None else register
+
+
+def get_task(name):
+    if name not in TASKS:
+        # Registered when its module is imported
+        import_string(name)
+    return TASKS[name]
+
+
+def enqueue(name, args=(), kwargs=None, run_at=None, unique_key=None):
+    """Insert a pending Task for the registered task ``name``.
+
+    With a ``unique_key`` that was enqueued before, nothing is inserted and
+    None is returned.
+    """
+    function = get_task(name)
+    values = {
+        'name': name,
+        'args': list(args),
+        'kwargs': kwargs or {},
+        'run_at': run_at or timezone.now(),
+        'max_attempts': function.max_attempts or settings.LIBRARY_TASK_MAX_ATTEMPTS,
+        'unique_key': unique_key,
+    }
+    if unique_key is None:
+        return Task.objects.create(**values)
+    try:
+        with transaction.atomic():
+            return Task.objects.create(**values)
+    except IntegrityError:
+        return None
+
+
+# ============= SCHEDULES =============
+class CronSchedule:
+    """A five-field cron expression: minute hour day-of-month month day-of-week.
+
+    Fields take ``*``, numbers, ``a-b`` ranges, ``/step`` and comma lists;
+    day of week counts from 0 (Sunday) to 6, with 7 also Sunday.  As in
+    cron, when both day fields are restricted a day matching either runs.
+    """
+
+    FIELDS = [('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7)]
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != len(self.FIELDS):
+            raise ValueError(f"'{expression}' does not have five fields.")
+        for (name, low, high), field in zip(self.FIELDS, fields):
+            setattr(self, name, self._parse(field, low, high))
+        if 7 in self.weekday:
+            self.weekday = (self.weekday - {7}) | {0}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _parse(self, field, low, high):
+        values = set()
+        for part in field.split(','):
+            span, _, step = part.partition('/')
+            if span == '*':
+                start, end = low, high
+            elif '-' in span:
+                start, end = (int(value) for value in span.split('-', 1))
+            else:
+                start = end = int(span)
+                if step:
+                    end = high
+            step = int(step) if step else 1
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"'{part}' is out of range in '{self.expression}'.")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        day = moment.day in self.day
+        weekday = (moment.weekday() + 1) % 7 in self.weekday
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment):
+        """The first time after ``moment`` that the schedule fires."""
+        moment = timezone.localtime(moment).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Within five years every valid expression (even 29 February) fires
+        limit = moment + timedelta(days=5 * 366)
+        while moment < limit:
+            if moment.month not in self.month or not self._day_matches(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hour:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minute:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"'{self.expression}' never fires.")
+
+
+# ============= WORKER =============
+class Worker:
+    """Claims due tasks and runs them on up to ``concurrency`` threads."""
+
+    def __init__(self, concurrency=None, schedule=None):
+        self.concurrency = concurrency or settings.LIBRARY_TASK_CONCURRENCY
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        schedule = settings.LIBRARY_TASK_SCHEDULE if schedule is None else schedule
+        self.schedule = {
+            name: (entry['task'], CronSchedule(entry['cron'])) for name, entry in schedule.items()
+        }
+        now = timezone.now()
+        self.next_runs = {name: cron.next_after(now) for name, (_, cron) in self.schedule.items()}
+        self.running = set()
+        self.lock = threading.Lock()
+
+    def enqueue_scheduled(self, now=None):
+        """Queue the scheduled runs that have fallen due; returns how many this worker queued."""
+        now = now or timezone.now()
+        queued = 0
+        for name, (task_name, cron) in self.schedule.items():
+            run_at = self.next_runs[name]
+            if run_at > now:
+                continue
+            if enqueue(task_name, run_at=run_at, unique_key=f'schedule:{name}:{run_at.isoformat()}'):
+                queued += 1
+            self.next_runs[name] = cron.next_after(now)
+        return queued
+
+    def requeue_abandoned(self, now=None):
+        """Put back tasks whose worker stopped while running them."""
+        now = now or timezone.now()
+        abandoned = Task.objects.filter(
+            status=Task.RUNNING, locked_at__lt=now - timedelta(seconds=settings.LIBRARY_TASK_TIMEOUT)
+        )
+        abandoned.filter(attempts__lt=F('max_attempts')).update(
+            status=Task.PENDING, run_at=now, locked_by='', last_error="The worker running it stopped."
+        )
+        abandoned.update(status=Task.FAILED, finished_at=now, last_error="The worker running it stopped.")
+
+    def claim(self, limit):
+        """Up to ``limit`` due tasks, marked as running by this worker."""
+        now = timezone.now()
+        candidates = Task.objects.filter(status=Task.PENDING, run_at__lte=now).values_list('pk', flat=True)
+        claimed = []
+        for pk in list(candidates[:limit]):
+            # Another worker may have taken it since the SELECT
+            if Task.objects.filter(pk=pk, status=Task.PENDING).update(
+                status=Task.RUNNING, locked_by=self.name, locked_at=now, attempts=F('attempts') + 1
+            ):
+                claimed.append(Task.objects.get(pk=pk))
+        return claimed
+
+    def execute(self, claimed):
+        """Run one claimed task and record the outcome."""
+        started = time.perf_counter()
+        try:
+            get_task(claimed.name)(*claimed.args, **claimed.kwargs)
+        except Exception:
+            error = traceback.format_exc()
+            if claimed.attempts < claimed.max_attempts:
+                delay = settings.LIBRARY_TASK_RETRY_DELAY * 2 ** (claimed.attempts - 1)
+                outcome, values = 'retry', {
+                    'status': Task.PENDING, 'run_at': timezone.now() + timedelta(seconds=delay),
+                }
+            else:
+                outcome, values = 'failed', {'status': Task.FAILED, 'finished_at': timezone.now()}
+            values['last_error'] = error
+        else:
+            outcome, values = 'done', {'status': Task.DONE, 'finished_at': timezone.now(), 'last_error': ''}
+        Task.objects.filter(pk=claimed.pk, locked_by=self.name).update(locked_by='', **values)
+        TASK_DURATION.observe(time.perf_counter() - started, task=claimed.name)
+        TASK_RUNS.inc(task=claimed.name, outcome=outcome)
+        return outcome
+
+    def run_pending(self):
+        """Run every task due now, and any queued meanwhile, then return how many ran."""
+        self.requeue_abandoned()
+        self.enqueue_scheduled()
+        count = 0
+        while True:
+            claimed = self.claim(self.concurrency)
+            if not claimed:
+                return count
+            if self.concurrency == 1:
+                for item in claimed:
+                    self.execute(item)
+            else:
+                with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                    list(executor.map(self._execute_in_thread, claimed))
+            count += len(claimed)
+
+    def run(self, stop, poll_interval=None):
+        """Keep ``concurrency`` tasks running until the ``stop`` event is set."""
+        poll_interval = poll_interval or settings.LIBRARY_TASK_POLL_INTERVAL
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while not stop.is_set():
+                self.requeue_abandoned()
+                self.enqueue_scheduled()
+                with self.lock:
+                    free = self.concurrency - len(self.running)
+                claimed = self.claim(free) if free > 0 else []
+                for item in claimed:
+                    with self.lock:
+                        self.running.add(item.pk)
+                    executor.submit(self._execute_in_thread, item)
+                # Connections are reopened by the next poll
+                connections.close_all()
+                REGISTRY.flush()
+                if not claimed:
+                    stop.wait(poll_interval)
+        REGISTRY.flush(force=True)
+
+    def _execute_in_thread(self, claimed):
+        try:
+            return self.execute(claimed)
+        finally:
+            with self.lock:
+                self.running.discard(claimed.pk)
+            connections.close_all()
@@ -1,3 +1,1672 @@
-from django.test import TestCase
+import gzip
+import importlib
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from unittest import addModuleCleanup, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.storage import storages
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import CommandError
+from django.db import connection, connections, router
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from . import jobs, routers, urls as myapp_urls
+from .models import Book, Student, IssuedBook, Task
+from .async_views import concurrently, with_async_views
+from .dbpool import POOL_EXHAUSTED, ConnectionPool, PoolTimeout
+from .exports import iter_rows
+from .fragments import bump_fragment_versions, fragment_versions
+from .importers import import_records
+from .metrics import REGISTRY, REQUEST_QUERIES
+from .inventory import (
+    InventoryError, issue_copies, return_copies, bulk_issue_copies, bulk_return_copies,
+    counter_drift, reconcile_counters,
+)
+from .pagination import KeysetPaginator
+from .profiling import RequestProfile
+from .search import InvertedIndex, get_backend, search
+from .stats import (
+    library_stats, cached_library_stats, stats_cache_info, overdue_report, cached_overdue_report,
+)
+from .tasks import CronSchedule, Worker, enqueue, task
+
+
+class QueryBudgetMixin:
+    """Fail a test when a view issues more queries than its declared budget.
+
+    ``query_budgets`` maps a URL name to the maximum number of queries one
+    request may run.  Budgets include the session and user lookups done by
+    the auth middleware, and must not grow with the number of rows shown.
+    """
+
+    query_budgets = {}
+
+    def assertWithinQueryBudget(self, url_name, *args, **kwargs):
+        budget = self.query_budgets[url_name]
+        url = reverse(url_name, args=args, kwargs=kwargs)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        executed = len(ctx.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(query['sql'] for query in ctx.captured_queries)
+            self.fail(
+                f"{url_name} ran {executed} queries, budget is {budget}:\n{queries}"
+            )
+        return response
+
+
+class QueryPlanMixin:
+    """EXPLAIN the paginated list query of a view and fail on full table scans or sorts.
+
+    The list query is the one with a LIMIT reading from ``table``.  A full
+    scan is a ``SCAN`` step without an index on SQLite, or an access type
+    of ``ALL`` on MySQL; a sort is a temporary B-tree for the ORDER BY on
+    SQLite, or a filesort on MySQL.  Other databases skip the check.
+    """
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}')
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def full_scans(self, sql, indexes=False):
+        """Steps reading a whole table, or with ``indexes`` also a whole index."""
+        plan = self.explain(sql)
+        if connection.vendor == 'sqlite':
+            return [
+                step['detail'] for step in plan
+                if step['detail'].startswith('SCAN') and (indexes or 'USING' not in step['detail'])
+            ]
+        scans = ('ALL', 'index') if indexes else ('ALL',)
+        return [f"{step['table']}: {step['type']}" for step in plan if step['type'] in scans]
+
+    def sorts(self, sql):
+        plan = self.explain(sql)
+        if connection.vendor == 'sqlite':
+            return [step['detail'] for step in plan if 'TEMP B-TREE FOR ORDER BY' in step['detail']]
+        return [f"{step['table']}: {step['Extra']}" for step in plan if 'Using filesort' in (step['Extra'] or '')]
+
+    def assertListQueryIndexed(self, url_name, table, *args, data=None, seek=False):
+        """With ``seek``, the filter must also narrow the rows read through an index."""
+        if connection.vendor not in ('sqlite', 'mysql'):
+            self.skipTest(f'no query plan check for {connection.vendor}')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(url_name, args=args), data)
+        self.assertEqual(response.status_code, 200)
+        source = f'FROM {connection.ops.quote_name(table)}'
+        queries = [
+            query['sql'] for query in ctx.captured_queries
+            if source in query['sql'] and 'LIMIT' in query['sql']
+        ]
+        self.assertTrue(queries, f"{url_name} ran no list query on {table}")
+        for sql in queries:
+            self.assertEqual(self.full_scans(sql, indexes=seek), [], f"{url_name} scans a whole table:\n{sql}")
+            self.assertEqual(self.sorts(sql), [], f"{url_name} sorts the rows:\n{sql}")
+
+
+def setUpModule():
+    # The test client's middleware enables metrics files; keep them out of LIBRARY_METRICS_DIR
+    metrics_dir = tempfile.TemporaryDirectory()
+    addModuleCleanup(metrics_dir.cleanup)
+    settings_override = override_settings(LIBRARY_METRICS_DIR=metrics_dir.name)
+    settings_override.enable()
+    addModuleCleanup(settings_override.disable)
+    # Nor write one at exit, once the directory is gone
+    addModuleCleanup(setattr, REGISTRY, 'enabled', False)
+
+
+def make_library(books=10, students=3, loans_per_student=5):
+    """Create a small catalogue with active and returned loans."""
+    book_objs = [
+        Book.objects.create(
+            title=f'Book {i}', author=f'Author {i}', isbn=f'{i:013d}', quantity=i % 3
+        )
+        for i in range(books)
+    ]
+    student_objs = [
+        Student.objects.create(
+            name=f'student{i}', id_number=f'S{i:04d}', department='science'
+        )
+        for i in range(students)
+    ]
+    for student in student_objs:
+        for i in range(loans_per_student):
+            IssuedBook.objects.create(
+                student=student,
+                book=book_objs[i % books],
+                quantity=1,
+                is_returned=bool(i % 2),
+            )
+    if loans_per_student:
+        # The loans above bypass myapp.inventory, so bring the counters up to date
+        reconcile_counters([book.pk for book in book_objs], [student.pk for student in student_objs])
+        for obj in book_objs + student_objs:
+            obj.refresh_from_db()
+    return book_objs, student_objs
+
+
+class ViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    query_budgets = {
+        # Including the overdue report when its snapshot has expired
+        'myapp:librarian_dashboard': 7,
+        'myapp:student_dashboard': 5,
+        'myapp:book_list': 5,
+        'myapp:student_list': 5,
+        'myapp:student_detail': 4,
+        'myapp:issued_books_list': 4,
+        'myapp:issue_book': 2,
+        'myapp:return_book': 3,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.books, cls.students = make_library(books=10, students=3, loans_per_student=8)
+        cls.librarian = User.objects.create_user('librarian', password='pass12345', is_staff=True)
+        cls.student_user = User.objects.create_user('student0', password='pass12345')
+        Student.objects.filter(pk=cls.students[0].pk).update(user=cls.student_user)
+
+    def test_librarian_views_within_budget(self):
+        self.client.force_login(self.librarian)
+        self.assertWithinQueryBudget('myapp:librarian_dashboard')
+        self.assertWithinQueryBudget('myapp:book_list')
+        self.assertWithinQueryBudget('myapp:student_list')
+        self.assertWithinQueryBudget('myapp:issued_books_list')
+        self.assertWithinQueryBudget('myapp:student_detail', self.students[0].pk)
+        self.assertWithinQueryBudget('myapp:issue_book')
+        active = IssuedBook.objects.filter(is_returned=False).first()
+        self.assertWithinQueryBudget('myapp:return_book', active.pk)
+
+    def test_student_dashboard_within_budget(self):
+        self.client.force_login(self.student_user)
+        response = self.assertWithinQueryBudget('myapp:student_dashboard')
+        self.assertEqual(response.context['total_borrowed_count'], 8)
+        self.assertEqual(response.context['current_borrowed_count'], 4)
+
+    def test_budget_does_not_grow_with_rows(self):
+        student = self.students[0]
+        for book in self.books:
+            IssuedBook.objects.create(student=student, book=book, quantity=1)
+        self.client.force_login(self.librarian)
+        self.assertWithinQueryBudget('myapp:issued_books_list')
+        self.assertWithinQueryBudget('myapp:student_detail', student.pk)
+
+
+class StudentProfileTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books, cls.students = make_library(books=4, students=3, loans_per_student=2)
+
+    def test_backfill_links_unique_names_only(self):
+        migration = importlib.import_module('myapp.migrations.0007_student_user')
+        Student.objects.create(name='student1', id_number='S9999', department='science')
+        ada = User.objects.create_user('student0')
+        User.objects.create_user('student1')
+        migration.link_students_to_users(django_apps, None)
+        self.assertEqual(Student.objects.get(user__isnull=False), self.students[0])
+        self.assertEqual(ada.student_profile, self.students[0])
+
+    def test_profile_linked_on_register_or_first_visit(self):
+        self.client.post(reverse('myapp:register'), {
+            'username': 'student1', 'email': 'a@example.com', 'role': 'student',
+            'password1': 'Pass-12345', 'password2': 'Pass-12345',
+        })
+        self.assertEqual(Student.objects.get(user__username='student1'), self.students[1])
+
+        # Accounts registered before the librarian added the profile link on first use
+        self.client.force_login(User.objects.create_user('student2'))
+        response = self.client.get(reverse('myapp:student_dashboard'))
+        self.assertEqual(response.context['student'], self.students[2])
+        self.assertEqual(response.context['total_borrowed_count'], 2)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('myapp:student_dashboard'))
+
+    def test_no_profile(self):
+        self.client.force_login(User.objects.create_user('visitor'))
+        response = self.client.get(reverse('myapp:student_dashboard'))
+        self.assertIsNone(response.context['student'])
+        self.assertIn('No student profile found', str(list(response.context['messages'])[0]))
+
+
+class ListQueryPlanTests(QueryPlanMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books, cls.students = make_library(books=30, students=5, loans_per_student=6)
+        cls.librarian = User.objects.create_user('librarian', password='pass12345', is_staff=True)
+        cls.student_user = User.objects.create_user('student0', password='pass12345')
+
+    def test_librarian_lists_use_indexes(self):
+        self.client.force_login(self.librarian)
+        self.assertListQueryIndexed('myapp:book_list', 'myapp_book')
+        self.assertListQueryIndexed('myapp:student_list', 'myapp_student')
+        for status in ('all', 'active', 'returned'):
+            self.assertListQueryIndexed('myapp:issued_books_list', 'myapp_issuedbook', data={'status': status})
+        self.assertListQueryIndexed('myapp:book_list', 'myapp_book', data={'sort': 'on_loan'})
+        self.assertListQueryIndexed('myapp:student_list', 'myapp_student', data={'sort': 'active_loans'})
+        self.assertListQueryIndexed(
+            'myapp:student_list', 'myapp_student', data={'sort': 'active_loans', 'status': 'borrowing'}
+        )
+
+    def test_student_dashboard_uses_indexes(self):
+        self.client.force_login(self.student_user)
+        self.assertListQueryIndexed('myapp:student_dashboard', 'myapp_book')
+        for status in ('available', 'unavailable'):
+            self.assertListQueryIndexed('myapp:student_dashboard', 'myapp_book', data={'status': status}, seek=True)
+
+    @override_settings(LIBRARY_PAGE_SIZE=5)
+    def test_later_pages_use_indexes(self):
+        self.client.force_login(self.librarian)
+        data = self.client.get(reverse('myapp:issued_books_list'), {'format': 'json', 'status': 'active'}).json()
+        self.assertListQueryIndexed(
+            'myapp:issued_books_list', 'myapp_issuedbook', data={'status': 'active', 'cursor': data['next_cursor']}
+        )
+
+
+@override_settings(LIBRARY_PAGE_SIZE=3)
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_library(books=8, students=7, loans_per_student=1)
+        # Identical timestamps force the paginator onto its pk tie-breaker
+        Book.objects.filter(pk__lte=Book.objects.order_by('pk')[4].pk).update(
+            created_at=timezone.now()
+        )
+        cls.librarian = User.objects.create_user('librarian', password='pass12345', is_staff=True)
+
+    def setUp(self):
+        # setUpTestData never commits, so cached tables of other tests are still current
+        caches['default'].clear()
+
+    def walk(self, paginator, direction='next'):
+        page = paginator.get_page()
+        seen = [obj.pk for obj in page]
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            seen.extend(obj.pk for obj in page)
+        if direction == 'prev':
+            seen = [obj.pk for obj in page]
+            while page.has_previous():
+                page = paginator.get_page(page.prev_cursor)
+                seen[:0] = [obj.pk for obj in page]
+        return seen
+
+    def test_forward_and_backward_walks_cover_every_row_once(self):
+        for queryset, ordering in [
+            (Book.objects.all(), ('-created_at', '-pk')),
+            (Student.objects.all(), ('id_number',)),
+            (IssuedBook.objects.all(), ('-issue_date', '-pk')),
+        ]:
+            expected = list(queryset.order_by(*ordering, '-pk').values_list('pk', flat=True))
+            paginator = KeysetPaginator(queryset, ordering, per_page=3)
+            self.assertEqual(self.walk(paginator), expected)
+            self.assertEqual(self.walk(paginator, 'prev'), expected)
+            self.assertEqual([obj.pk for batch in paginator.iter_batches() for obj in batch], expected)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        paginator = KeysetPaginator(Book.objects.all(), ('-created_at',), per_page=3)
+        first = [book.pk for book in paginator.get_page()]
+        self.assertEqual([book.pk for book in paginator.get_page('not-a-cursor')], first)
+
+    def test_list_views_expose_cursors_in_html_and_json(self):
+        self.client.force_login(self.librarian)
+        for url_name in ['myapp:book_list', 'myapp:student_list', 'myapp:issued_books_list']:
+            response = self.client.get(reverse(url_name))
+            page = response.context['page']
+            self.assertEqual(len(page), 3)
+            self.assertContains(response, f'cursor={page.next_cursor}')
+
+            data = self.client.get(reverse(url_name), {'format': 'json'}).json()
+            self.assertEqual(len(data['results']), 3)
+            self.assertIsNone(data['prev_cursor'])
+            data = self.client.get(
+                reverse(url_name), {'format': 'json', 'cursor': data['next_cursor']}
+            ).json()
+            self.assertIsNotNone(data['prev_cursor'])
+
+
+class LibraryStatsTests(TestCase):
+    def test_counters_use_one_query_per_model(self):
+        make_library(books=6, students=2, loans_per_student=3)
+        with self.assertNumQueries(3):
+            stats = library_stats()
+        self.assertEqual(stats['total_books'], 6)
+        self.assertEqual(stats['available_books'], 4)
+        self.assertEqual(stats['unavailable_books'], 2)
+        self.assertEqual(stats['total_students'], 2)
+        self.assertEqual(stats['active_issues'], 4)
+        self.assertEqual(stats['returned_issues'], 2)
+
+
+class CachedLibraryStatsTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        make_library(books=4, students=2, loans_per_student=2)
+
+    def test_hits_until_a_model_changes(self):
+        first = cached_library_stats()
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_library_stats(), first)
+        self.assertEqual(stats_cache_info(), {'hits': 1, 'misses': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='New', author='A', isbn='9999999999999', quantity=2)
+        self.assertEqual(cached_library_stats()['total_books'], first['total_books'] + 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Student.objects.first().delete()
+        self.assertEqual(cached_library_stats()['total_students'], first['total_students'] - 1)
+        self.assertEqual(stats_cache_info(), {'hits': 1, 'misses': 3})
+
+    def test_overdue_loans_are_counted(self):
+        IssuedBook.objects.filter(pk=IssuedBook.objects.filter(is_returned=False).first().pk).update(
+            due_date=timezone.localdate() - timedelta(days=1)
+        )
+        self.assertEqual(cached_library_stats()['overdue_issues'], 1)
+
+    def test_stats_read_before_an_issue_commits_are_not_kept(self):
+        student = Student.objects.first()
+        book = Book.objects.create(title='New', author='A', isbn='9999999999999', quantity=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            issue_copies(student, book, 1)
+            # Another request reading the counters before the commit
+            cached_library_stats()
+        misses = stats_cache_info()['misses']
+        cached_library_stats()
+        self.assertEqual(stats_cache_info()['misses'], misses + 1)
+
+    def test_stats_read_before_a_save_commits_are_not_kept(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='New', author='A', isbn='9999999999999', quantity=2)
+            # Another request reading the counters before the commit
+            cached_library_stats()
+        misses = stats_cache_info()['misses']
+        cached_library_stats()
+        self.assertEqual(stats_cache_info()['misses'], misses + 1)
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as location:
+            file_cache = {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }
+            local_cache = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+            with self.settings(
+                CACHES={'default': local_cache, 'files': file_cache},
+                LIBRARY_STATS_CACHE='files',
+            ):
+                stats = cached_library_stats()
+                with self.assertNumQueries(0):
+                    self.assertEqual(cached_library_stats(), stats)
+                with self.captureOnCommitCallbacks(execute=True):
+                    Book.objects.first().delete()
+                self.assertEqual(cached_library_stats()['total_books'], stats['total_books'] - 1)
+                self.assertEqual(stats_cache_info(), {'hits': 1, 'misses': 2})
+
+
+class InventoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Dune', author='Herbert', isbn='1', quantity=3)
+        cls.student = Student.objects.create(name='ann', id_number='S1', department='science')
+        cls.librarian = User.objects.create_user('librarian', password='pass12345', is_staff=True)
+
+    def test_issue_and_return_adjust_stock(self):
+        issued = issue_copies(self.student, self.book, 2)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 1)
+
+        return_copies(issued, 1)
+        self.assertFalse(issued.is_returned)
+        return_copies(issued, 1)
+        self.assertTrue(issued.is_returned)
+        self.assertEqual(issued.return_date, timezone.localdate())
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 3)
+
+    def test_oversell_and_over_return_are_rejected(self):
+        with self.assertRaises(InventoryError):
+            issue_copies(self.student, self.book, 4)
+        issued = issue_copies(self.student, self.book, 1)
+        with self.assertRaises(InventoryError):
+            return_copies(issued, 2)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 2)
+
+    def test_return_view_rejects_more_than_outstanding(self):
+        issued = issue_copies(self.student, self.book, 2)
+        self.client.force_login(self.librarian)
+        response = self.client.post(reverse('myapp:return_book', args=[issued.pk]), {'quantity': 3})
+        self.assertContains(response, 'Cannot return more than 2 copies!')
+        issued.refresh_from_db()
+        self.assertEqual(issued.quantity, 2)
+        self.assertFalse(issued.is_returned)
+
+
+class LoanCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = [
+            Book.objects.create(title=f'Book {i}', author='A', isbn=str(i), quantity=5) for i in range(2)
+        ]
+        cls.students = [
+            Student.objects.create(name=f'reader{i}', id_number=f'S{i}', department='science') for i in range(2)
+        ]
+
+    def assertCounters(self, book, on_loan, total, student, active):
+        book.refresh_from_db()
+        student.refresh_from_db()
+        self.assertEqual((book.on_loan_copies, book.total_copies), (on_loan, total))
+        self.assertEqual(student.active_loan_count, active)
+
+    def test_counters_follow_every_stock_movement(self):
+        book, other = self.books
+        ann, bob = self.students
+        self.assertEqual(book.total_copies, 5)
+        loan = issue_copies(ann, book, 2)
+        self.assertCounters(book, 2, 5, ann, 1)
+        return_copies(loan, 1)
+        self.assertCounters(book, 1, 5, ann, 1)
+        return_copies(loan, 1)
+        self.assertCounters(book, 0, 5, ann, 0)
+
+        bulk_issue_copies([(ann, book, 1), (ann, other, 2), (bob, book, 3)])
+        self.assertCounters(book, 4, 5, ann, 2)
+        bulk_return_copies([(ann, other, 2), (bob, book, 1)])
+        self.assertCounters(other, 0, 5, bob, 1)
+        self.assertCounters(book, 3, 5, ann, 1)
+
+        IssuedBook.objects.filter(student=bob).delete()
+        self.assertCounters(book, 1, 3, bob, 0)
+        self.assertEqual([list(drift) for drift in counter_drift()], [[], []])
+
+    def test_saving_a_stale_instance_keeps_the_counters(self):
+        book = self.books[0]
+        stale = Book.objects.get(pk=book.pk)
+        issue_copies(self.students[0], book, 2)
+        stale.title = 'Renamed'
+        stale.quantity = 10
+        stale.save()
+        self.assertEqual((stale.on_loan_copies, stale.total_copies), (2, 12))
+
+        student = Student.objects.get(pk=self.students[0].pk)
+        issue_copies(self.students[0], self.books[1], 1)
+        student.phone_number = '555'
+        student.save()
+        self.assertCounters(book, 2, 12, student, 2)
+
+    def test_import_keeps_total_copies(self):
+        issue_copies(self.students[0], self.books[0], 2)
+        import_records('books', io.StringIO('title,author,isbn,quantity\nBook 0,A,0,7\nNew,B,9,4\n'))
+        self.assertEqual(
+            dict(Book.objects.filter(isbn__in=['0', '9']).values_list('isbn', 'total_copies')),
+            {'0': 9, '9': 4},
+        )
+
+    def test_reconcile_command(self):
+        issue_copies(self.students[0], self.books[0], 2)
+        Book.objects.update(on_loan_copies=7)
+        Student.objects.update(active_loan_count=3)
+        out = io.StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('2 books and 2 students had drifted', out.getvalue())
+        self.assertEqual(Book.objects.get(pk=self.books[0].pk).on_loan_copies, 7)
+
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.assertCounters(self.books[0], 2, 5, self.students[0], 1)
+        self.assertCounters(self.books[1], 0, 5, self.students[1], 0)
+        out = io.StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('consistent', out.getvalue())
+
+
+class BulkLoanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books, cls.students = make_library(books=12, students=12, loans_per_student=0)
+        Book.objects.update(quantity=5)
+        cls.librarian = User.objects.create_user('librarian', password='pass12345', is_staff=True)
+
+    def batch(self, size):
+        return [(self.students[i], self.books[i], 2) for i in range(size)]
+
+    def test_statement_count_does_not_grow_with_batch(self):
+        with CaptureQueriesContext(connection) as small:
+            bulk_issue_copies(self.batch(2))
+        with CaptureQueriesContext(connection) as large:
+            bulk_issue_copies(self.batch(10))
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(Book.objects.get(pk=self.books[0].pk).quantity, 1)
+        self.assertEqual(IssuedBook.objects.count(), 12)
+
+        with CaptureQueriesContext(connection) as returns:
+            copies = bulk_return_copies(self.batch(10))
+        self.assertEqual(copies, 20)
+        self.assertLessEqual(len(returns.captured_queries), len(large.captured_queries) + 1)
+        self.assertEqual(Book.objects.get(pk=self.books[9].pk).quantity, 5)
+        self.assertEqual(IssuedBook.objects.filter(is_returned=False).count(), 2)
+
+    def test_short_batch_changes_nothing(self):
+        items = self.batch(3) + [(self.students[4], self.books[0], 4)]
+        with self.assertRaisesMessage(InventoryError, "'Book 0' (requested 6, available 5)"):
+            bulk_issue_copies(items)
+        self.assertFalse(IssuedBook.objects.exists())
+        self.assertEqual(set(Book.objects.values_list('quantity', flat=True)), {5})
+
+    def test_return_spans_loans_oldest_first(self):
+        student, book = self.students[0], self.books[0]
+        first = issue_copies(student, book, 2)
+        second = issue_copies(student, book, 2)
+        bulk_return_copies([(student, book, 3)])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertTrue(first.is_returned)
+        self.assertEqual((second.quantity, second.is_returned), (1, False))
+        with self.assertRaises(InventoryError):
+            bulk_return_copies([(student, book, 2)])
+
+    def test_form_and_json_endpoints(self):
+        self.client.force_login(self.librarian)
+        self.assertContains(self.client.get(reverse('myapp:bulk_issue')), 'Bulk Issue Books')
+        lines = f"{self.students[0].id_number}, {self.books[0].isbn}, 2\n{self.students[1].id_number},{self.books[1].isbn}"
+        response = self.client.post(reverse('myapp:bulk_issue'), {'items': lines})
+        self.assertRedirects(response, reverse('myapp:issued_books_list'))
+        self.assertEqual(IssuedBook.objects.count(), 2)
+
+        response = self.client.post(
+            reverse('myapp:bulk_return'),
+            json.dumps({'items': [{'student': self.students[0].id_number, 'book': self.books[0].isbn, 'quantity': 2}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json(), {'copies': 2, 'loans': 1})
+
+        response = self.client.post(
+            reverse('myapp:bulk_issue'),
+            json.dumps({'items': [{'student': 'nobody', 'book': self.books[0].isbn}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], ["Row 1: no student with ID number 'nobody'."])
+
+
+class CatalogueImportTests(TestCase):
+    def test_csv_upserts_on_isbn_in_chunks(self):
+        Book.objects.create(title='Old title', author='A', isbn='0000000000001', quantity=1)
+        rows = ['title,author,isbn,quantity']
+        rows += [f'Book {i},Author {i},{i:013d},{i}' for i in range(1, 8)]
+        rows += ['Bad,Author,12345678901234567,1', 'No quantity,Author,0000000000099,']
+        result = import_records('books', io.StringIO('\n'.join(rows)), 'csv', chunk_size=3)
+
+        self.assertEqual((result.rows, result.imported, result.error_count), (9, 7, 2))
+        self.assertEqual([line for line, _ in result.errors], [9, 10])
+        self.assertEqual(Book.objects.count(), 7)
+        self.assertEqual(Book.objects.get(isbn='0000000000001').title, 'Book 1')
+
+    def test_jsonl_students_and_duplicate_keys(self):
+        lines = [
+            json.dumps({'name': 'Ann', 'id_number': 'S1', 'department': 'science', 'phone_number': '1'}),
+            'not json',
+            json.dumps({'name': 'Ann B', 'id_number': 'S1', 'department': 'commerce', 'phone_number': '2'}),
+            json.dumps({'name': 'Bob', 'id_number': 'S2', 'department': 'history', 'phone_number': '3'}),
+        ]
+        result = import_records('students', io.StringIO('\n'.join(lines)), 'jsonl')
+        self.assertEqual(result.error_count, 2)
+        self.assertEqual(list(Student.objects.values_list('id_number', 'name')), [('S1', 'Ann B')])
+
+    def test_command_and_upload_view(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write('name,id_number,department,phone_number\nAnn,S1,science,123\n')
+        self.addCleanup(os.remove, handle.name)
+        out = io.StringIO()
+        call_command('import_catalogue', 'students', handle.name, stdout=out)
+        self.assertIn('Imported 1 students from 1 rows', out.getvalue())
+
+        librarian = User.objects.create_user('librarian', password='pass12345', is_staff=True)
+        self.client.force_login(librarian)
+        upload = SimpleUploadedFile('books.jsonl', b'{"title": "T", "author": "A", "isbn": "1", "quantity": 2}\n')
+        response = self.client.post(
+            reverse('myapp:import_catalogue'), {'kind': 'books', 'file': upload}, follow=True
+        )
+        self.assertContains(response, 'Imported 1 books from 1 rows')
+        self.assertEqual(Book.objects.get(isbn='1').quantity, 2)
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_library(books=5, students=2, loans_per_student=5)
+        cls.librarian = User.objects.create_user('librarian', password='pass12345', is_staff=True)
+
+    def export(self, name, **params):
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('myapp:export_data', args=[name]), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_rows_are_fetched_in_key_batches(self):
+        with self.assertNumQueries(4):
+            rows = list(iter_rows(IssuedBook.objects.all(), ['pk', 'quantity'], batch_size=3))
+        self.assertEqual([row[0] for row in rows], sorted(IssuedBook.objects.values_list('pk', flat=True)))
+
+    def test_loans_csv_joins_student_and_book_and_honours_status(self):
+        lines = self.export('issued-books', status='active').splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'student_id_number', 'student_name'])
+        self.assertEqual(len(lines), 1 + IssuedBook.objects.filter(is_returned=False).count())
+        self.assertIn(',S0000,student0,0000000000000,Book 0,Author 0,1,', lines[1])
+
+    def test_books_jsonl_and_unknown_export(self):
+        records = [json.loads(line) for line in self.export('books', format='jsonl', status='unavailable').splitlines()]
+        self.assertEqual({record['quantity'] for record in records}, {0})
+        self.assertEqual(len(records), Book.objects.filter(quantity=0).count())
+        response = self.client.get(reverse('myapp:export_data', args=['passwords']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_students_export_honours_status(self):
+        Student.objects.create(name='idle reader', id_number='S9000', department='science')
+        lines = self.export('students', status='idle').splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn(',idle reader,S9000,', lines[1])
+        self.assertEqual(len(self.export('students', status='borrowing').splitlines()), 1 + 2)
+
+    def test_export_links_carry_the_list_filter(self):
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('myapp:student_list'), {'status': 'idle'})
+        self.assertContains(response, 'href="/export/students/?status=idle&format=csv"')
+        # The book list has no status filter
+        response = self.client.get(reverse('myapp:book_list'))
+        self.assertContains(response, 'href="/export/books/?format=csv"')
+
+
+class LookupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books, cls.students = make_library(books=30, students=25, loans_per_student=0)
+        cls.librarian = User.objects.create_user('librarian', password='pass12345', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.librarian)
+
+    def test_prefix_search_and_pagination(self):
+        data = self.client.get(reverse('myapp:lookup_books'), {'q': 'book 1'}).json()
+        self.assertEqual(len(data['results']), 11)
+        self.assertTrue(data['results'][0]['text'].startswith('Book 1 by Author 1'))
+        self.assertIsNone(data['next_cursor'])
+
+        data = self.client.get(reverse('myapp:lookup_students')).json()
+        self.assertEqual(len(data['results']), 20)
+        rest = self.client.get(reverse('myapp:lookup_students'), {'cursor': data['next_cursor']}).json()
+        self.assertEqual(rest['results'][-1]['text'], 'student24 (S0024)')
+
+    def test_issue_form_renders_only_the_chosen_options(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('myapp:issue_book'))
+        self.assertNotContains(response, 'Book 1 by')
+        self.assertContains(response, 'data-lookup-url="/lookup/books/"')
+
+        response = self.client.post(
+            reverse('myapp:issue_book'),
+            {'student': self.students[3].pk, 'book': self.books[2].pk, 'quantity': 5},
+        )
+        self.assertContains(response, 'Not enough books available')
+        self.assertContains(response, f'<option value="{self.students[3].pk}" selected>')
+        self.assertEqual(response.content.decode().count('<option'), 4)
+
+    def test_issue_form_reports_unknown_choices(self):
+        response = self.client.post(
+            reverse('myapp:issue_book'), {'student': 'abc', 'book': 999999, 'quantity': 1},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('student', response.context['form'].errors)
+        self.assertIn('book', response.context['form'].errors)
+        self.assertContains(response, '<option value="" selected>', count=2)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = [
+            Book.objects.create(title='Dune', author='Frank Herbert', isbn='9780441013593', quantity=2),
+            Book.objects.create(title='Dune Messiah', author='Frank Herbert', isbn='9780593098233', quantity=0),
+            Book.objects.create(title='Children of Dune', author='Frank Herbert', isbn='9780593098240', quantity=1),
+            Book.objects.create(title='Foundation', author='Isaac Asimov', isbn='9780553293357', quantity=1),
+        ]
+        Student.objects.create(name='Ada Lovelace', id_number='S0001', department='science')
+        cls.librarian = User.objects.create_user('librarian', password='pass12345', is_staff=True)
+
+    def setUp(self):
+        # The in-memory index is process-wide; start every test from the database
+        get_backend().reset()
+        self.client.force_login(self.librarian)
+
+    def test_ranking_and_prefixes(self):
+        index = InvertedIndex({'title': 3.0, 'author': 2.0})
+        index.add(1, {'title': 'Dune', 'author': 'Frank Herbert'})
+        index.add(2, {'title': 'Dune Messiah', 'author': 'Frank Herbert'})
+        index.add(3, {'title': 'Herbert the Duneling', 'author': 'Someone Else'})
+        self.assertEqual(index.search('dune'), [1, 2, 3])
+        # Both words in the (heavier) title beat a title + author match
+        self.assertEqual(index.search('dun herb'), [3, 1, 2])
+        self.assertEqual(index.search('messiah frank'), [2])
+        index.add(2, {'title': 'Chapterhouse', 'author': 'Frank Herbert'})
+        self.assertEqual(index.search('messiah'), [])
+        index.remove(1)
+        self.assertEqual(index.search('dune'), [3])
+
+    def test_search_follows_saves_and_deletes(self):
+        self.assertEqual([book.title for book in search(Book, 'foundation')], ['Foundation'])
+        self.books[3].title = 'Second Foundation'
+        self.books[3].save()
+        Book.objects.create(title='Foundation and Empire', author='Isaac Asimov', isbn='9780553293371', quantity=1)
+        self.assertEqual(len(search(Book, 'found')), 2)
+        self.books[3].delete()
+        self.assertEqual([book.title for book in search(Book, 'found')], ['Foundation and Empire'])
+        self.assertEqual(search(Student, 's0001')[0].name, 'Ada Lovelace')
+
+    def test_filtered_search_fills_the_page(self):
+        # Title and author both match, so these outrank every book in stock
+        for number in range(6):
+            Book.objects.create(title='Dune', author='Dune Fan', isbn=f'97800000000{number:02}', quantity=0)
+        in_stock = Book.objects.filter(quantity__gt=0)
+        titles = [book.title for book in search(Book, 'dune', queryset=in_stock, limit=2)]
+        self.assertEqual(titles, ['Dune', 'Children of Dune'])
+        self.assertEqual(len(search(Book, 'dune', queryset=in_stock, limit=5)), 2)
+
+    def test_list_views_search(self):
+        response = self.client.get(reverse('myapp:book_list'), {'q': 'dune', 'format': 'json'})
+        titles = [book['title'] for book in response.json()['results']]
+        self.assertEqual(titles, ['Dune', 'Dune Messiah', 'Children of Dune'])
+
+        response = self.client.get(reverse('myapp:student_list'), {'q': 'ada'})
+        self.assertContains(response, 'Ada Lovelace')
+
+        student = User.objects.create_user('reader', password='pass12345')
+        self.client.force_login(student)
+        response = self.client.get(
+            reverse('myapp:student_dashboard'), {'q': 'herbert', 'status': 'available', 'format': 'json'}
+        )
+        titles = [book['title'] for book in response.json()['results']]
+        self.assertEqual(titles, ['Dune', 'Children of Dune'])
+
+
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_library(books=5, students=2, loans_per_student=2)
+        cls.librarian = User.objects.create_user('librarian', password='pass12345', is_staff=True)
+
+    def setUp(self):
+        log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(log_dir.cleanup)
+        self.log = os.path.join(log_dir.name, 'profiling.jsonl')
+        self.client.force_login(self.librarian)
+
+    def test_sampled_request_is_timed_and_logged(self):
+        with self.settings(LIBRARY_PROFILING=True, LIBRARY_PROFILING_SAMPLE_RATE=1.0, LIBRARY_PROFILING_LOG=self.log):
+            response = self.client.get(reverse('myapp:issued_books_list'))
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries, 0 duplicates", tpl;dur=[\d.]+$',
+        )
+        with open(self.log) as log:
+            record = json.loads(log.readlines()[-1])
+        self.assertEqual(record['view'], 'myapp:issued_books_list')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 1)
+        self.assertGreater(record['template_ms'], 0)
+
+    def test_unsampled_and_disabled_requests_are_untouched(self):
+        with self.settings(LIBRARY_PROFILING=True, LIBRARY_PROFILING_SAMPLE_RATE=0.0, LIBRARY_PROFILING_LOG=self.log):
+            self.assertFalse(self.client.get(reverse('myapp:book_list')).has_header('Server-Timing'))
+        self.assertFalse(self.client.get(reverse('myapp:book_list')).has_header('Server-Timing'))
+
+    def test_duplicate_queries_are_reported(self):
+        profile = RequestProfile()
+        with profile.capture():
+            for _ in range(3):
+                Book.objects.filter(isbn='0000000000001').first()
+            Book.objects.filter(isbn='0000000000002').first()
+        self.assertEqual((profile.query_count, profile.duplicate_count), (4, 2))
+        self.assertEqual(profile.duplicates()[0]['count'], 3)
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books, cls.students = make_library(books=3, students=1, loans_per_student=1)
+        cls.librarian = User.objects.create_user('librarian', password='pass12345', is_staff=True)
+
+    def setUp(self):
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        self.metrics_dir = metrics_dir.name
+        settings_override = self.settings(LIBRARY_METRICS_DIR=self.metrics_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        REGISTRY.clear()
+
+    def scrape(self):
+        response = self.client.get(reverse('myapp:metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                series, value = line.rsplit(' ', 1)
+                samples[series] = float(value)
+        return samples
+
+    def test_scrape_reports_views_logins_and_inventory(self):
+        login_url = reverse('myapp:login')
+        self.client.post(login_url, {'username': 'librarian', 'password': 'wrong'})
+        self.client.post(login_url, {'username': 'librarian', 'password': 'pass12345'})
+        self.client.get(reverse('myapp:book_list'))
+        book = Book.objects.filter(quantity__gt=0).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            issue_copies(self.students[0], book, 1)
+        with self.assertRaises(InventoryError):
+            issue_copies(self.students[0], book, book.quantity + 1)
+
+        samples = self.scrape()
+        self.assertEqual(samples['library_logins_total{result="success"}'], 1)
+        self.assertEqual(samples['library_logins_total{result="failure"}'], 1)
+        self.assertEqual(
+            samples['library_http_request_duration_seconds_count{view="myapp:book_list",method="GET"}'], 1
+        )
+        self.assertEqual(
+            samples['library_http_request_duration_seconds_bucket{view="myapp:book_list",method="GET",le="+Inf"}'], 1
+        )
+        self.assertGreater(samples['library_db_queries_per_request_sum{view="myapp:book_list"}'], 0)
+        self.assertEqual(samples['library_http_responses_total{view="myapp:login",status="302"}'], 1)
+        self.assertEqual(samples['library_inventory_operations_total{operation="issue"}'], 1)
+        self.assertEqual(samples['library_inventory_copies_total{operation="issue"}'], 1)
+        self.assertEqual(samples['library_inventory_conflicts_total{operation="issue"}'], 1)
+        self.assertIn('library_stats_cache_hit_ratio', samples)
+
+    def test_scrape_merges_every_worker_file(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            issue_copies(self.students[0], Book.objects.filter(quantity__gt=0).first(), 1)
+        other_worker = {
+            'library_inventory_copies_total': {
+                'type': 'counter', 'help': 'Copies moved.', 'labels': ['operation'],
+                'samples': [[['issue'], 4], [['return'], 2]],
+            },
+        }
+        with open(os.path.join(self.metrics_dir, '999999.json'), 'w') as worker_file:
+            json.dump(other_worker, worker_file)
+
+        samples = self.scrape()
+        self.assertEqual(samples['library_inventory_copies_total{operation="issue"}'], 5)
+        self.assertEqual(samples['library_inventory_copies_total{operation="return"}'], 2)
+
+    @skipUnless(os.name == 'posix', "exited processes are told apart with signal 0")
+    def test_files_of_exited_processes_are_archived(self):
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        moved = {
+            'library_inventory_copies_total': {
+                'type': 'counter', 'help': 'Copies moved.', 'labels': ['operation'], 'samples': [[['issue'], 4]],
+            },
+        }
+        for pid in (exited.pid, os.getpid()):
+            with open(os.path.join(self.metrics_dir, f'{pid}.json'), 'w') as worker_file:
+                json.dump(moved, worker_file)
+        # This process starts writing under a PID that an exited one used
+        REGISTRY.enabled = False
+        REGISTRY.enable()
+
+        for _ in range(2):
+            samples = self.scrape()
+            self.assertEqual(samples['library_inventory_copies_total{operation="issue"}'], 8)
+        self.assertCountEqual(
+            [name for name in os.listdir(self.metrics_dir) if name.endswith('.json')],
+            ['archive.json', f'{os.getpid()}.json'],
+        )
+
+    def test_only_enabled_processes_write_a_file(self):
+        self.addCleanup(setattr, REGISTRY, 'enabled', REGISTRY.enabled)
+        REGISTRY.enabled = False
+        REGISTRY.flush(force=True)
+        self.assertEqual(os.listdir(self.metrics_dir), [])
+
+    def test_only_allowed_addresses_can_scrape(self):
+        response = self.client.get(reverse('myapp:metrics'), REMOTE_ADDR='10.0.0.8')
+        self.assertEqual(response.status_code, 403)
+        with self.settings(LIBRARY_METRICS_ALLOWED_IPS=['10.0.0.8']):
+            response = self.client.get(reverse('myapp:metrics'), REMOTE_ADDR='10.0.0.8')
+        self.assertEqual(response.status_code, 200)
+
+    def test_scrapes_through_a_trusted_proxy_use_the_forwarded_address(self):
+        url = reverse('myapp:metrics')
+        # The proxy is local, but the client it forwards for is not
+        response = self.client.get(url, REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='10.0.0.8')
+        self.assertEqual(response.status_code, 200)
+        with self.settings(LIBRARY_METRICS_TRUSTED_PROXIES=['127.0.0.1']):
+            response = self.client.get(url, REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='10.0.0.8')
+            self.assertEqual(response.status_code, 403)
+            response = self.client.get(url, REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='::1, 127.0.0.1')
+            self.assertEqual(response.status_code, 200)
+            # An address the client wrote itself, left of the one the proxy saw
+            response = self.client.get(url, REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='::1, 10.0.0.8')
+            self.assertEqual(response.status_code, 403)
+
+
+class BenchmarkCommandTests(TestCase):
+    def generate(self, **options):
+        options = {'books': 40, 'students': 8, 'loans': 300, 'batch_size': 64, **options}
+        call_command('generate_library_data', stdout=io.StringIO(), **options)
+
+    def test_generated_data_is_consistent_and_extendable(self):
+        self.generate()
+        self.generate(loans=0)
+        self.assertEqual(Book.objects.count(), 80)
+        self.assertEqual(Student.objects.count(), 16)
+        self.assertEqual(IssuedBook.objects.count(), 300)
+        books, students = counter_drift()
+        self.assertFalse(books.exists() or students.exists())
+        self.assertGreater(IssuedBook.objects.values('issue_date').distinct().count(), 10)
+        self.assertFalse(IssuedBook.objects.filter(is_returned=True, return_date__isnull=True).exists())
+
+    def test_benchmarks_flag_regressions_against_a_baseline(self):
+        self.generate()
+        output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(output_dir.cleanup)
+        baseline = os.path.join(output_dir.name, 'baseline.json')
+        run = {'requests': 1, 'warmup': 0, 'skip': ['export_data:issued-books'], 'stdout': io.StringIO()}
+        call_command('run_benchmarks', output=baseline, **run)
+        with open(baseline) as baseline_file:
+            results = json.load(baseline_file)
+        self.assertIn('book_list?sort=on_loan', results['scenarios'])
+        self.assertNotIn('logout', results['scenarios'])
+        self.assertEqual(results['scenarios']['student_dashboard']['status'], 200)
+
+        results['scenarios']['book_list']['queries'] -= 1
+        with open(baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file)
+        with self.assertRaisesMessage(CommandError, 'regressions'):
+            call_command('run_benchmarks', only=['book_list'], baseline=baseline, tolerance=100, **run)
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books, cls.students = make_library(books=6, students=2, loans_per_student=2)
+        cls.librarian = User.objects.create_user('librarian', is_staff=True)
+        cls.student_user = User.objects.create_user('student0')
+        Student.objects.filter(pk=cls.students[0].pk).update(user=cls.student_user)
+
+    def revalidate(self, url, response, **extra):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], **extra)
+
+    def test_unchanged_catalogue_is_not_modified(self):
+        self.client.force_login(self.librarian)
+        url = reverse('myapp:book_list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('private', response['Cache-Control'])
+        with self.assertNumQueries(3):    # session, user, validators
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        issue_copies(self.students[1], Book.objects.filter(quantity__gt=0).first(), 1)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_deleting_a_row_changes_the_etag(self):
+        self.client.force_login(self.librarian)
+        url = reverse('myapp:student_list')
+        response = self.client.get(url)
+        Student.objects.create(name='temp', id_number='S9999', department='science').delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        self.students[1].delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_etag_is_scoped_to_user_and_filters(self):
+        self.client.force_login(self.librarian)
+        url = reverse('myapp:book_list')
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url + '?sort=on_loan', response).status_code, 200)
+        other = User.objects.create_user('librarian2', is_staff=True)
+        self.client.force_login(other)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_student_dashboard_follows_own_loans(self):
+        self.client.force_login(self.student_user)
+        url = reverse('myapp:student_dashboard')
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        loan = IssuedBook.objects.filter(student=self.students[0], is_returned=False).first()
+        return_copies(loan, loan.quantity)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_pending_messages_disable_validators(self):
+        self.client.force_login(self.student_user)
+        url = reverse('myapp:student_dashboard')
+        response = self.client.get(url)
+        # Librarian-only page: redirects with an error message for the next page
+        self.client.get(reverse('myapp:book_list'))
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class FragmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books, cls.students = make_library(books=4, students=2, loans_per_student=2)
+        cls.librarian = User.objects.create_user('librarian', is_staff=True)
+        cls.student_user = User.objects.create_user('student0')
+        Student.objects.filter(pk=cls.students[0].pk).update(user=cls.student_user)
+
+    def setUp(self):
+        # setUpTestData never commits, so cached tables of other tests are still current
+        caches['default'].clear()
+
+    def test_book_table_is_reused_until_a_book_changes(self):
+        self.client.force_login(self.librarian)
+        url = reverse('myapp:book_list')
+        self.client.get(url)
+        book = self.books[1]
+        # A write that bypasses the signals is not seen...
+        Book.objects.filter(pk=book.pk).update(title='Renamed quietly')
+        self.assertNotContains(self.client.get(url), 'Renamed quietly')
+        # ...a save is, once it commits
+        book.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+            self.assertNotContains(self.client.get(url), 'Renamed')
+        self.assertContains(self.client.get(url), 'Renamed')
+
+    def test_stock_movements_outdate_the_book_table(self):
+        self.client.force_login(self.librarian)
+        url = reverse('myapp:book_list')
+        book = Book.objects.get(pk=self.books[2].pk)
+        self.assertContains(self.client.get(url), f'{book.quantity} in stock')
+        with self.captureOnCommitCallbacks(execute=True):
+            issue_copies(self.students[1], book, 1)
+        self.assertContains(self.client.get(url), f'{book.quantity - 1} in stock')
+
+    def test_returns_outdate_only_that_students_loan_tables(self):
+        self.client.force_login(self.student_user)
+        url = reverse('myapp:student_dashboard')
+        self.assertContains(self.client.get(url), '"status-badge status-active"')
+        other = fragment_versions(loans=f'loans:{self.students[1].pk}')
+        with self.captureOnCommitCallbacks(execute=True):
+            for loan in IssuedBook.objects.filter(student=self.students[0], is_returned=False):
+                return_copies(loan, loan.quantity)
+        self.assertNotContains(self.client.get(url), '"status-badge status-active"')
+        self.assertEqual(fragment_versions(loans=f'loans:{self.students[1].pk}'), other)
+
+    def test_loan_tables_are_outdated_when_the_loan_commits(self):
+        # A page rendered between an earlier bump and the commit would
+        # cache the old table under the new version
+        key = f'loans:{self.students[0].pk}'
+        before = fragment_versions(loans=key)
+        with self.captureOnCommitCallbacks(execute=True):
+            loan = issue_copies(self.students[0], self.books[2], 1)
+            loan.save()
+            self.assertEqual(fragment_versions(loans=key), before)
+        self.assertNotEqual(fragment_versions(loans=key), before)
+
+    def test_lost_versions_do_not_restart(self):
+        before = fragment_versions(books='books')['books']
+        caches['default'].delete('fragment-version:books')
+        bump_fragment_versions('books')
+        self.assertNotEqual(fragment_versions(books='books')['books'], before)
+
+
+class StaticAssetsTests(TestCase):
+    def test_pages_link_stylesheets_instead_of_embedding_them(self):
+        response = self.client.get(reverse('myapp:login'))
+        self.assertNotContains(response, '<style')
+        self.assertContains(response, '/static/myapp/css/base.')
+        self.assertContains(response, '/static/myapp/css/login.')
+
+    def test_collected_stylesheets_are_hashed_compressed_and_long_cached(self):
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+        with self.settings(STATIC_ROOT=static_root.name):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            hashed = storages['staticfiles'].stored_name('myapp/css/login.css')
+            self.assertNotEqual(hashed, 'myapp/css/login.css')
+            self.assertContains(self.client.get(reverse('myapp:login')), f'/static/{hashed}')
+            with open(os.path.join(static_root.name, hashed), 'rb') as stylesheet:
+                original = stylesheet.read()
+
+            response = self.client.get(f'/static/{hashed}', HTTP_ACCEPT_ENCODING='gzip, deflate')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Content-Type'], 'text/css')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), original)
+
+            response = self.client.get(f'/static/{hashed}', HTTP_ACCEPT_ENCODING='gzip;q=0')
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(b''.join(response.streaming_content), original)
+            # An unhashed name may change under the same URL
+            response = self.client.get('/static/myapp/css/login.css')
+            self.assertIn('no-cache', response['Cache-Control'])
+
+
+@override_settings(LIBRARY_PAGE_SIZE=2, LIBRARY_STREAM_CHUNK_ROWS=3)
+class StreamingAndCompressionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_library(books=7, students=4, loans_per_student=2)
+        cls.librarian = User.objects.create_user('librarian', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.librarian)
+
+    def test_stream_sends_every_loan_in_chunks(self):
+        response = self.client.get(reverse('myapp:issued_books_list'), {'stream': '1'})
+        self.assertTrue(response.streaming)
+        chunks = [chunk.decode() for chunk in response.streaming_content]
+        # The page before the rows, 8 loans in batches of 3, the rest of the page
+        self.assertEqual(len(chunks), 5)
+        page = ''.join(chunks)
+        self.assertEqual(page.count('class="btn-view"'), 8)
+        self.assertNotIn('cursor=', page)
+        self.assertTrue(page.rstrip().endswith('</html>'))
+
+    def test_stream_of_books_and_of_an_empty_list(self):
+        response = self.client.get(reverse('myapp:book_list'), {'stream': '1', 'sort': 'on_loan'})
+        self.assertEqual(b''.join(response.streaming_content).decode().count('<div class="book-card">'), 7)
+        IssuedBook.objects.all().delete()
+        response = self.client.get(reverse('myapp:issued_books_list'), {'stream': '1'})
+        self.assertIn('No issued books found.', b''.join(response.streaming_content).decode())
+
+    def test_html_is_compressed_for_clients_that_accept_it(self):
+        url = reverse('myapp:book_list')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('<div class="book-card">', gzip.decompress(response.content).decode())
+        self.assertFalse(self.client.get(url).has_header('Content-Encoding'))
+
+        response = self.client.get(url, {'stream': '1'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('</html>', gzip.decompress(b''.join(response.streaming_content)).decode())
+        # Too small to be worth it
+        response = self.client.get(reverse('myapp:lookup_books'), {'q': 'none'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ConnectionPoolTests(TestCase):
+    def make_pool(self, **options):
+        opened = []
+
+        def connect():
+            opened.append(sqlite3.connect(':memory:', check_same_thread=False))
+            return opened[-1]
+
+        pool = ConnectionPool(connect, alias='pool-test', **{'max_size': 2, 'timeout': 0.05, **options})
+        self.addCleanup(pool.close_all)
+        return pool, opened
+
+    def test_released_connections_are_reused(self):
+        pool, opened = self.make_pool()
+        first = pool.acquire()
+        pool.release(first)
+        self.assertIs(pool.acquire(), first)
+        self.assertEqual(len(opened), 1)
+
+    def test_exhausted_pool_waits_for_a_release_or_times_out(self):
+        pool, opened = self.make_pool()
+        held = [pool.acquire(), pool.acquire()]
+        exhausted = POOL_EXHAUSTED.get(alias='pool-test')
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(POOL_EXHAUSTED.get(alias='pool-test'), exhausted + 1)
+
+        pool.timeout = 5
+        release = threading.Timer(0.05, pool.release, [held[0]])
+        release.start()
+        self.addCleanup(release.cancel)
+        self.assertIs(pool.acquire(), held[0])
+        self.assertEqual(len(opened), 2)
+
+    def test_broken_and_expired_connections_are_replaced(self):
+        pool, opened = self.make_pool()
+        broken = pool.acquire()
+        pool.release(broken)
+        broken.close()
+        fresh = pool.acquire()
+        self.assertIsNot(fresh, broken)
+        pool.max_lifetime = 0
+        pool.release(fresh)
+        self.assertEqual(pool.size, 0)
+
+    def test_backend_returns_connections_to_the_pool(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('the pooled backend under test is the SQLite one')
+        from .backends.sqlite3.base import DatabaseWrapper
+
+        # A file database: SQLite's close() keeps in-memory connections open
+        database = tempfile.NamedTemporaryFile(suffix='.sqlite3')
+        self.addCleanup(database.close)
+        pooled = DatabaseWrapper(
+            {**connection.settings_dict, 'NAME': database.name, 'OPTIONS': {'pool': {'max_size': 1}}},
+            'pool-backend-test',
+        )
+        pooled.ensure_connection()
+        raw = pooled.connection
+        pooled.close()
+        self.assertIsNone(pooled.connection)
+        with pooled.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertIs(pooled.connection, raw)
+        pooled.close()
+        pooled.pool.close_all()
+
+
+class AsyncURLConf:
+    urlpatterns = [path('', include((with_async_views(myapp_urls.urlpatterns), 'myapp')))]
+
+
+@override_settings(ROOT_URLCONF=AsyncURLConf)
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books, cls.students = make_library(books=6, students=2, loans_per_student=2)
+        cls.librarian = User.objects.create_user('librarian', is_staff=True)
+        cls.student_user = User.objects.create_user('student0')
+        Student.objects.filter(pk=cls.students[0].pk).update(user=cls.student_user)
+
+    async def test_pages_render_the_same_context(self):
+        student = self.students[0]
+        pages = [
+            ('librarian_dashboard', [], self.librarian, 'recent_issues'),
+            ('book_list', [], self.librarian, 'books'),
+            ('student_list', [], self.librarian, 'students'),
+            ('student_detail', [student.pk], self.librarian, 'issued_books'),
+            ('student_dashboard', [], self.student_user, 'borrowing_history'),
+        ]
+        for name, args, user, rows in pages:
+            with self.subTest(name):
+                await self.async_client.aforce_login(user)
+                response = await self.async_client.get(reverse(f'myapp:{name}', args=args))
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.context[rows])
+        self.assertEqual(response.context['student'], student)
+        self.assertEqual(response.context['total_borrowed_count'], 2)
+
+    async def test_staff_pages_redirect_students_and_missing_students_are_404(self):
+        await self.async_client.aforce_login(self.student_user)
+        response = await self.async_client.get(reverse('myapp:book_list'))
+        self.assertRedirects(response, reverse('myapp:home'), fetch_redirect_response=False)
+        await self.async_client.aforce_login(self.librarian)
+        response = await self.async_client.get(reverse('myapp:student_detail', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_conditional_gets_and_streaming(self):
+        await self.async_client.aforce_login(self.librarian)
+        url = reverse('myapp:book_list')
+        response = await self.async_client.get(url)
+        response = await self.async_client.get(url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        response = await self.async_client.get(url, {'stream': '1'})
+        self.assertTrue(response.streaming)
+
+    async def test_middleware_does_not_adapt_the_handler_to_sync(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            with self.settings(DEBUG=True, LIBRARY_METRICS=True, LIBRARY_PROFILING=True,
+                               LIBRARY_PROFILING_LOG=os.path.join(log_dir, 'profiling.jsonl')):
+                with self.assertNoLogs('django.request', 'DEBUG'):
+                    ASGIHandler()
+
+    async def test_middleware_counts_the_queries_of_the_view_threads(self):
+        def queries_recorded():
+            # Bucket counts, then the sum and count of the observations
+            sample = REQUEST_QUERIES.values.get(('myapp:book_list',))
+            return sample[-2] if sample else 0
+
+        before = queries_recorded()
+        await self.async_client.aforce_login(self.librarian)
+        with tempfile.TemporaryDirectory() as log_dir:
+            with self.settings(LIBRARY_PROFILING=True, LIBRARY_PROFILING_SAMPLE_RATE=1.0,
+                               LIBRARY_PROFILING_LOG=os.path.join(log_dir, 'profiling.jsonl')):
+                response = await self.async_client.get(reverse('myapp:book_list'))
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries')
+        self.assertGreater(queries_recorded(), before)
+
+    @override_settings(LIBRARY_READ_REPLICAS=['replica'])
+    async def test_writes_pin_the_session_to_the_primary(self):
+        await self.async_client.aforce_login(self.librarian)
+        await self.async_client.post(reverse('myapp:issue_book'), {})
+        session = await self.async_client.asession()
+        self.assertGreater(await session.aget(routers.PINNED_UNTIL_KEY), time.time())
+
+
+class AsyncConcurrencyTests(TransactionTestCase):
+    def test_functions_run_on_threads_of_their_own(self):
+        Book.objects.create(title='Dune', author='Herbert', isbn='9780441013593', quantity=1)
+        # Each waits for the other, so they must overlap
+        barrier = threading.Barrier(2, timeout=5)
+
+        def count_books():
+            barrier.wait()
+            return threading.get_ident(), Book.objects.count()
+
+        first, second = async_to_sync(concurrently)(count_books, count_books)
+        self.assertNotEqual(first[0], second[0])
+        self.assertEqual((first[1], second[1]), (1, 1))
+
+
+@skipUnless(connection.vendor == 'sqlite', "The replica is a SQLite copy of the test database")
+@override_settings(LIBRARY_READ_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    def setUp(self):
+        make_library(books=3, students=1, loans_per_student=0)
+        self.librarian = User.objects.create_user('librarian', is_staff=True)
+        # A replica frozen at this point: later writes only reach the primary
+        replica = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'replica.sqlite3')
+        connection.ensure_connection()
+        copy = sqlite3.connect(replica)
+        connection.connection.backup(copy)
+        copy.close()
+        primary = connections['default']
+        connections['replica'] = type(primary)({**primary.settings_dict, 'NAME': replica}, 'replica')
+        self.addCleanup(connections.__delitem__, 'replica')
+        self.addCleanup(connections['replica'].close)
+        self.addCleanup(routers._lags.clear)
+        self.client.force_login(self.librarian)
+
+    def book_titles(self, client=None):
+        response = (client or self.client).get(reverse('myapp:book_list'))
+        return {book.title for book in response.context['books']}
+
+    def test_list_reads_come_from_the_replica(self):
+        Book.objects.create(title='Fresh', author='New', isbn='9999999999999', quantity=1)
+        self.assertNotIn('Fresh', self.book_titles())
+        book = Book.objects.using('replica').get(title='Book 0')
+        self.assertEqual(router.db_for_write(Book, instance=book), 'default')
+        # Pages that are not routed keep reading from the primary
+        self.assertTrue(Book.objects.filter(title='Fresh').exists())
+
+    def test_a_post_pins_the_session_to_the_primary(self):
+        response = self.client.post(reverse('myapp:create_book'), {
+            'title': 'Fresh', 'author': 'New', 'isbn': '9999999999999', 'quantity': 1,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('Fresh', self.book_titles())
+
+        other = self.client_class()
+        other.force_login(User.objects.create_user('librarian2', is_staff=True))
+        self.assertNotIn('Fresh', self.book_titles(other))
+        session = self.client.session
+        session[routers.PINNED_UNTIL_KEY] = time.time() - 1
+        session.save()
+        self.assertNotIn('Fresh', self.book_titles())
+
+    def test_a_lagging_replica_is_skipped(self):
+        Book.objects.create(title='Fresh', author='New', isbn='9999999999999', quantity=1)
+        routers._lags['replica'] = (time.monotonic(), 60.0)
+        self.assertIn('Fresh', self.book_titles())
+        with override_settings(LIBRARY_REPLICA_MAX_LAG=120):
+            self.assertNotIn('Fresh', self.book_titles())
+
+
+class OverdueLoanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books, cls.students = make_library(books=4, students=3, loans_per_student=4)
+        cls.librarian = User.objects.create_user('librarian', is_staff=True)
+        cls.student_user = User.objects.create_user('student0')
+        Student.objects.filter(pk=cls.students[0].pk).update(user=cls.student_user)
+        today = timezone.localdate()
+        # student0: two loans overdue by 3 and 1 days, student1: one by 5 days
+        active = {student.pk: list(student.issued_books.filter(is_returned=False)) for student in cls.students}
+        for loan, days in [(active[cls.students[0].pk][0], 3), (active[cls.students[0].pk][1], 1),
+                           (active[cls.students[1].pk][0], 5)]:
+            IssuedBook.objects.filter(pk=loan.pk).update(due_date=today - timedelta(days=days))
+        # Returned late, no longer overdue
+        IssuedBook.objects.filter(student=cls.students[2], is_returned=True).update(
+            due_date=today - timedelta(days=9)
+        )
+
+    def setUp(self):
+        caches['default'].clear()
+
+    @override_settings(LIBRARY_LOAN_PERIOD_DAYS_BY_DEPARTMENT={'humanities': 21})
+    def test_due_date_follows_the_loan_policy(self):
+        today = timezone.localdate()
+        loan = issue_copies(self.students[2], self.books[2], 1)
+        self.assertEqual(loan.due_date, today + timedelta(days=14))
+        self.assertFalse(loan.is_overdue)
+        student = Student.objects.create(name='reader', id_number='S9000', department='humanities')
+        book = Book.objects.create(title='Spare', author='A', isbn='9999999999999', quantity=1)
+        [loan] = bulk_issue_copies([(student, book, 1)])
+        self.assertEqual(loan.due_date, today + timedelta(days=21))
+
+    @override_settings(LIBRARY_LOAN_PERIOD_DAYS_BY_DEPARTMENT={'humanities': 21})
+    def test_backfill_dates_loans_by_the_policy(self):
+        migration = importlib.import_module('myapp.migrations.0010_issuedbook_due_date')
+        self.students[1].department = 'humanities'
+        self.students[1].save()
+        IssuedBook.objects.update(due_date=date(2000, 1, 1))
+        with self.assertNumQueries(1):
+            migration.backfill_due_dates(django_apps, None)
+        for loan in IssuedBook.objects.select_related('student'):
+            days = 21 if loan.student == self.students[1] else 14
+            self.assertEqual(loan.due_date, loan.issue_date + timedelta(days=days))
+
+    def test_report_comes_from_one_query(self):
+        with self.assertNumQueries(1):
+            report = overdue_report(limit=2)
+        self.assertEqual(report['total'], 3)
+        self.assertEqual(report['students'], {self.students[0].pk: 2, self.students[1].pk: 1})
+        self.assertEqual([loan['days_overdue'] for loan in report['loans']], [5, 3])
+        self.assertEqual(report['top_students'][0]['name'], 'student0')
+        self.assertEqual(library_stats()['overdue_issues'], 3)
+
+    def test_dashboards(self):
+        out = io.StringIO()
+        call_command('overdue_report', stdout=out)
+        self.assertIn('3 overdue loans held by 2 students', out.getvalue())
+        with self.assertNumQueries(0):
+            cached_overdue_report()
+
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('myapp:librarian_dashboard'))
+        self.assertEqual(response.context['overdue_issues'], 3)
+        self.assertEqual(len(response.context['overdue_loans']), 3)
+        self.assertContains(response, 'Most Overdue Loans')
+
+        self.client.force_login(self.student_user)
+        response = self.client.get(reverse('myapp:student_dashboard'))
+        self.assertEqual(response.context['overdue_count'], 2)
+        self.assertContains(response, 'status-overdue', count=4)
+
+        # The student sees a return at once, the snapshot on its next refresh
+        with self.captureOnCommitCallbacks(execute=True):
+            return_copies(self.students[0].issued_books.overdue()[0], 1)
+        response = self.client.get(reverse('myapp:student_dashboard'))
+        self.assertEqual(response.context['overdue_count'], 1)
+        self.assertEqual(cached_overdue_report()['students'][self.students[0].pk], 2)
+        call_command('overdue_report', '--summary', stdout=out)
+        self.assertEqual(cached_overdue_report()['students'][self.students[0].pk], 1)
+
+
+class TaskQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books, cls.students = make_library(books=2, students=2, loans_per_student=2)
+        cls.librarian = User.objects.create_user('librarian', is_staff=True)
+        cls.student_user = User.objects.create_user('student0', email='student0@example.com')
+        Student.objects.filter(pk=cls.students[0].pk).update(user=cls.student_user)
+        cls.book = Book.objects.create(title='Queued', author='A', isbn='9999999999999', quantity=3)
+
+    def run_worker(self):
+        out = io.StringIO()
+        call_command('run_worker', '--once', '--concurrency', '1', stdout=out)
+        return out.getvalue()
+
+    def test_loan_receipts_are_sent_by_the_worker(self):
+        self.client.force_login(self.librarian)
+        self.client.post(reverse('myapp:issue_book'), {
+            'student': self.students[0].pk, 'book': self.book.pk, 'quantity': 2,
+        })
+        loan = IssuedBook.objects.get(book=self.book)
+        queued = Task.objects.get()
+        self.assertEqual((queued.name, queued.args, queued.status), ('myapp.jobs.loan_issued', [loan.pk], Task.PENDING))
+        self.assertEqual(mail.outbox, [])
+
+        self.assertIn('Ran 1 tasks', self.run_worker())
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.DONE, 1))
+        self.assertEqual(mail.outbox[0].to, ['student0@example.com'])
+        self.assertIn(f'{loan.due_date:%Y-%m-%d}', mail.outbox[0].body)
+
+        self.client.post(reverse('myapp:return_book', args=[loan.pk]), {'quantity': 1})
+        self.run_worker()
+        self.assertEqual(mail.outbox[1].subject, 'Returned: Queued')
+        self.assertIn('1 copy/copies are still due', mail.outbox[1].body)
+
+    def test_failing_task_is_retried_with_backoff(self):
+        queued = enqueue('myapp.tests.always_fails', [3])
+        self.assertEqual(queued.max_attempts, 2)
+        worker = Worker(concurrency=1, schedule={})
+        self.assertEqual(worker.run_pending(), 1)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.PENDING, 1))
+        self.assertIn('RuntimeError: attempt 3', queued.last_error)
+        self.assertGreater(queued.run_at, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(worker.run_pending(), 0)
+
+        Task.objects.update(run_at=timezone.now())
+        worker.run_pending()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.FAILED, 2))
+        self.assertIsNotNone(queued.finished_at)
+
+    def test_abandoned_task_is_requeued(self):
+        queued = enqueue('myapp.jobs.prune_tasks')
+        Task.objects.update(status=Task.RUNNING, attempts=1, locked_by='gone:1',
+                            locked_at=timezone.now() - timedelta(hours=1))
+        Worker(concurrency=1, schedule={}).run_pending()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.DONE, 2))
+
+    def test_cron_schedule(self):
+        friday = timezone.make_aware(datetime(2026, 10, 16, 17, 50))
+        self.assertEqual(
+            CronSchedule('*/15 9-17 * * 1-5').next_after(friday),
+            timezone.make_aware(datetime(2026, 10, 19, 9, 0)),
+        )
+        self.assertEqual(
+            CronSchedule('0 0 29 2 *').next_after(friday), timezone.make_aware(datetime(2028, 2, 29))
+        )
+        # Either day field matches when both are restricted: the 20th, or Fridays
+        self.assertEqual(
+            CronSchedule('0 12 20 * 5').next_after(friday), timezone.make_aware(datetime(2026, 10, 20, 12))
+        )
+        self.assertEqual(
+            CronSchedule('0 12 20 * 7').next_after(friday), timezone.make_aware(datetime(2026, 10, 18, 12))
+        )
+        for expression in ['60 * * * *', '* * * *', '5-1 * * * *', '*/0 * * * *', 'x * * * *']:
+            with self.assertRaises(ValueError):
+                CronSchedule(expression)
+
+    def test_scheduled_run_is_enqueued_once(self):
+        schedule = {'report': {'task': 'myapp.jobs.refresh_overdue_report', 'cron': '* * * * *'}}
+        workers = [Worker(concurrency=1, schedule=schedule), Worker(concurrency=1, schedule=schedule)]
+        later = timezone.now() + timedelta(minutes=2)
+        self.assertEqual([worker.enqueue_scheduled(later) for worker in workers], [1, 0])
+        self.assertEqual(Task.objects.filter(name='myapp.jobs.refresh_overdue_report').count(), 1)
+        self.assertEqual(workers[0].enqueue_scheduled(later), 0)
+
+    def test_overdue_reminders(self):
+        today = timezone.localdate()
+        IssuedBook.objects.filter(is_returned=False).update(due_date=today - timedelta(days=2))
+        self.assertEqual(jobs.send_overdue_reminders(), 1)
+        [reminder] = mail.outbox
+        self.assertEqual(reminder.to, ['student0@example.com'])
+        self.assertEqual(reminder.subject, '1 overdue book loan(s)')
+        self.assertIn('(2 days ago)', reminder.body)
+
+
+@task(max_attempts=2)
+def always_fails(attempt):
+    raise RuntimeError(f'attempt {attempt}')
+
+
+class InventoryConcurrencyTests(TransactionTestCase):
+    """Hammer one popular title from many threads at once."""
+
+    threads = 8
+    attempts_per_thread = 10
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs a test database shared between connections')
+
+    def run_concurrently(self, work):
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(self.attempts_per_thread):
+                    work()
+            except Exception as exc:  # surfaced in the main thread below
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_issues_never_oversell(self):
+        stock = 50
+        book = Book.objects.create(title='Popular', author='A', isbn='2', quantity=stock)
+        student = Student.objects.create(name='bob', id_number='S2', department='science')
+        outcomes = []
+
+        def issue_one():
+            try:
+                issue_copies(student, book, 1)
+                outcomes.append(True)
+            except InventoryError:
+                outcomes.append(False)
+
+        self.run_concurrently(issue_one)
+        book.refresh_from_db()
+        issued = outcomes.count(True)
+        self.assertEqual(issued, stock)
+        self.assertEqual(book.quantity, 0)
+        self.assertEqual(IssuedBook.objects.filter(book=book).count(), stock)
+
+    def test_concurrent_returns_are_exact(self):
+        book = Book.objects.create(title='Popular', author='A', isbn='3', quantity=0)
+        student = Student.objects.create(name='cy', id_number='S3', department='science')
+        total = self.threads * self.attempts_per_thread
+        loan = IssuedBook.objects.create(student=student, book=book, quantity=total)
+
+        self.run_concurrently(lambda: return_copies(IssuedBook.objects.get(pk=loan.pk), 1))
+        book.refresh_from_db()
+        loan.refresh_from_db()
+        self.assertEqual(book.quantity, total)
+        self.assertEqual(loan.quantity, 0)
+        self.assertTrue(loan.is_returned)
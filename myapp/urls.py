@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.urls import path
 from . import views
+from .async_views import with_async_views
 
 app_name = 'myapp'
 
@@ -28,5 +30,21 @@ urlpatterns = [
     # Issue/Return URLs
     path('issued-books/', views.issued_books_list, name='issued_books_list'),
     path('issued-books/issue/', views.issue_book, name='issue_book'),
+    path('issued-books/bulk-issue/', views.bulk_issue, name='bulk_issue'),
+    path('issued-books/bulk-return/', views.bulk_return, name='bulk_return'),
     path('issued-books/<int:pk>/return/', views.return_book, name='return_book'),
+    
+    # Import URLs
+    path('import/', views.import_catalogue, name='import_catalogue'),
+    path('export/<slug:name>/', views.export_data, name='export_data'),
+    
+    # Typeahead lookup URLs
+    path('lookup/students/', views.lookup_students, name='lookup_students'),
+    path('lookup/books/', views.lookup_books, name='lookup_books'),
+    
+    # Monitoring URLs
+    path('metrics', views.metrics, name='metrics'),
 ]
+
+if settings.LIBRARY_ASYNC_VIEWS:
+    urlpatterns = with_async_views(urlpatterns)
@@ -1,12 +1,116 @@
+import io
+import json
+
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
 from django.db.models import Q, Count
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
+from django.urls import reverse
 from django.utils import timezone
 from .models import Book, Student, IssuedBook
-from .forms import BookForm, StudentForm, IssuedBookForm, ReturnBookForm, RegistrationForm
+from .forms import (
+    BookForm, StudentForm, IssuedBookForm, ReturnBookForm, RegistrationForm,
+    BulkLoanForm, CatalogueImportForm, resolve_loan_items,
+)
+from .conditional import conditional_page
+from .exports import EXPORTS, FORMATS as EXPORT_FORMATS, export_response
+from .fragments import fragment_context
+from .importers import guess_format, import_records
+from .jobs import loan_issued, loan_returned
+from .metrics import REGISTRATIONS, client_address, exposition
+from .inventory import (
+    InventoryError, issue_copies, return_copies, bulk_issue_copies, bulk_return_copies,
+)
+from .pagination import KeysetPage, KeysetPaginator, paginate
+from .routers import replica_reads
+from .search import search
+from .stats import book_stats, student_stats, loan_stats, cached_library_stats, cached_overdue_report
+from .streaming import stream_page, wants_stream
+
+
+# Keyset orderings used by the paginated listings (match each model's Meta.ordering)
+BOOK_ORDERING = ('-created_at', '-pk')
+STUDENT_ORDERING = ('id_number',)
+# Extra ?sort= choices of the book and student lists, on the counter indexes
+BOOK_SORTS = {'newest': BOOK_ORDERING, 'on_loan': ('-on_loan_copies', '-pk')}
+STUDENT_SORTS = {'id_number': STUDENT_ORDERING, 'active_loans': ('-active_loan_count', '-pk')}
+ISSUED_BOOK_ORDERING = ('-issue_date', '-pk')
+LOOKUP_PAGE_SIZE = 20
+
+
+def _wants_json(request):
+    return request.GET.get('format') == 'json'
+
+
+def _search_or_paginate(request, model, queryset, ordering):
+    """Ranked search results for ``?q=``, otherwise a keyset page of ``queryset``."""
+    query = request.GET.get('q', '').strip()
+    if query:
+        return KeysetPage(search(model, query, queryset=queryset))
+    return paginate(request, queryset, ordering, settings.LIBRARY_PAGE_SIZE)
+
+
+def _page_json(page, serialize):
+    return JsonResponse({
+        'results': [serialize(obj) for obj in page],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    })
+
+
+def _book_json(book):
+    return {
+        'id': book.pk,
+        'title': book.title,
+        'author': book.author,
+        'isbn': book.isbn,
+        'quantity': book.quantity,
+        'total_copies': book.total_copies,
+        'on_loan_copies': book.on_loan_copies,
+    }
+
+
+def _student_json(student):
+    return {
+        'id': student.pk,
+        'name': student.name,
+        'id_number': student.id_number,
+        'department': student.department,
+        'phone_number': student.phone_number,
+        'active_loan_count': student.active_loan_count,
+    }
+
+
+def _issued_book_json(issue):
+    return {
+        'id': issue.pk,
+        'student': {'id': issue.student_id, 'name': issue.student.name},
+        'book': {'id': issue.book_id, 'title': issue.book.title},
+        'quantity': issue.quantity,
+        'issue_date': issue.issue_date,
+        'due_date': issue.due_date,
+        'return_date': issue.return_date,
+        'is_returned': issue.is_returned,
+    }
+
+
+def _staff_only(*querysets):
+    """Validator sources for pages that only staff get to see."""
+    return lambda request: list(querysets) if request.user.is_staff else None
+
+
+def _student_dashboard_sources(request):
+    # The catalogue, plus this student's profile and loans
+    return [
+        Book.objects.all(),
+        Student.objects.filter(user=request.user),
+        IssuedBook.objects.filter(student__user=request.user),
+    ]
 
 
 # ============= AUTHENTICATION VIEWS =============
@@ -30,6 +134,9 @@ def register(request):
                 user.is_staff = True
                 user.is_superuser = False
             user.save()
+            if role == 'student':
+                Student.objects.link_user(user)
+            REGISTRATIONS.inc(role=role)
             
             messages.success(request, "Account created successfully! Please log in.")
             return redirect('myapp:login')
@@ -80,81 +187,117 @@ def home(request):
 
 
 @login_required(login_url='myapp:login')
+@replica_reads
 def librarian_dashboard(request):
     """Librarian/Admin dashboard with statistics"""
     if not request.user.is_staff:
         messages.error(request, "You do not have permission to access this page!")
         return redirect('myapp:home')
     
-    # Statistics
-    total_books = Book.objects.count()
-    total_students = Student.objects.count()
-    available_books = Book.objects.filter(quantity__gt=0).count()
-    active_issues = IssuedBook.objects.filter(is_returned=False).count()
+    # Statistics (cached, invalidated on every Book/Student/IssuedBook write)
+    stats = cached_library_stats()
+    # Most overdue loans and students, refreshed by the overdue_report command
+    overdue = cached_overdue_report()
     
     # Recent activities
     recent_issues = IssuedBook.objects.select_related('student', 'book').order_by('-issue_date')[:5]
     
     context = {
-        'total_books': total_books,
-        'total_students': total_students,
-        'available_books': available_books,
-        'active_issues': active_issues,
+        'total_books': stats['total_books'],
+        'total_students': stats['total_students'],
+        'available_books': stats['available_books'],
+        'active_issues': stats['active_issues'],
+        'overdue_issues': stats['overdue_issues'],
+        'overdue_loans': overdue['loans'],
+        'overdue_students': overdue['top_students'],
+        'overdue_as_of': overdue['computed_at'],
         'recent_issues': recent_issues,
     }
     return render(request, 'myapp/librarian_dashboard.html', context)
 
 
 @login_required(login_url='myapp:login')
+@replica_reads
+@conditional_page(_student_dashboard_sources, daily=True)
 def student_dashboard(request):
     """Student dashboard showing borrowed books and library books"""
-    try:
-        student = Student.objects.get(name=request.user.username)
-    except Student.DoesNotExist:
+    # Profile and loans in one join on the indexed user link
+    borrowing_history = list(
+        IssuedBook.objects.filter(student__user=request.user).select_related('student', 'book')
+    )
+    if borrowing_history:
+        student = borrowing_history[0].student
+    elif request.student:
+        # No loans yet, or the profile was only just linked to this account
+        student = request.student
+        borrowing_history = list(student.issued_books.select_related('book'))
+    else:
         messages.info(request, "No student profile found for your account. Please contact the librarian.")
         student = None
-    
-    # Get student's borrowed books
-    active_borrowed = []
-    borrowed_history = []
-    
-    if student:
-        active_borrowed = student.issued_books.filter(is_returned=False)
-        borrowed_history = student.issued_books.all()
+    current_borrowed = [issue for issue in borrowing_history if not issue.is_returned]
     
     # Get all books with filter
-    books = Book.objects.all()
     filter_status = request.GET.get('status', 'all')
+    books = Book.objects.with_status(filter_status)
     
-    if filter_status == 'available':
-        books = books.filter(quantity__gt=0)
-    elif filter_status == 'unavailable':
-        books = books.filter(quantity=0)
+    books_page = _search_or_paginate(request, Book, books, BOOK_ORDERING)
+    if _wants_json(request):
+        return _page_json(books_page, _book_json)
     
     context = {
         'student': student,
-        'active_borrowed': active_borrowed,
-        'borrowed_history': borrowed_history,
-        'all_books': books,
+        'current_borrowed': current_borrowed,
+        'borrowing_history': borrowing_history,
+        'all_books': books_page,
+        'page': books_page,
         'filter_status': filter_status,
-        'total_borrowed': active_borrowed.count() if student else 0,
+        'query': request.GET.get('q', '').strip(),
+        'current_borrowed_count': student.active_loan_count if student else 0,
+        'total_borrowed_count': len(borrowing_history),
+        # From the loans above rather than the overdue snapshot, so a return shows at once
+        'overdue_count': sum(issue.is_overdue for issue in current_borrowed),
+        # Part of the loan tables' cache keys: their overdue flags change at midnight
+        'today': timezone.localdate(),
     }
+    context.update(fragment_context(
+        books='books', catalogue='catalogue', loans=f'loans:{student.pk if student else None}'
+    ))
     return render(request, 'myapp/student_dashboard.html', context)
 
 
 # ============= BOOK VIEWS =============
 @login_required(login_url='myapp:login')
+@replica_reads
+@conditional_page(_staff_only(Book.objects.all()))
 def book_list(request):
     if not request.user.is_staff:
         messages.error(request, "You do not have permission to access this page!")
         return redirect('myapp:home')
     
-    books = Book.objects.all()
+    sort = request.GET.get('sort')
+    if sort not in BOOK_SORTS:
+        sort = 'newest'
+    query = request.GET.get('q', '').strip()
+    stream = wants_stream(request) and not query and not _wants_json(request)
+    books = None
+    if not stream:
+        books = _search_or_paginate(request, Book, Book.objects.all(), BOOK_SORTS[sort])
+    if _wants_json(request):
+        return _page_json(books, _book_json)
+    
+    stats = book_stats()
     context = {
         'books': books,
-        'total_books': books.count(),
-        'available_books': sum(1 for book in books if book.quantity > 0),
+        'page': books,
+        'total_books': stats['total_books'],
+        'available_books': stats['available_books'],
+        'query': query,
+        'sort': sort,
     }
+    context.update(fragment_context(books='books'))
+    if stream:
+        paginator = KeysetPaginator(Book.objects.all(), BOOK_SORTS[sort], settings.LIBRARY_STREAM_CHUNK_ROWS)
+        return stream_page(request, 'myapp/book_list.html', context, 'books', 'myapp/book_cards.html', paginator)
     return render(request, 'myapp/book_list.html', context)
 
 
@@ -229,34 +372,49 @@ def delete_book(request, pk):
 
 # ============= STUDENT VIEWS =============
 @login_required(login_url='myapp:login')
+@replica_reads
+@conditional_page(_staff_only(Student.objects.all()))
 def student_list(request):
     if not request.user.is_staff:
         messages.error(request, "You do not have permission to access this page!")
         return redirect('myapp:home')
     
-    students = Student.objects.all()
+    sort = request.GET.get('sort')
+    if sort not in STUDENT_SORTS:
+        sort = 'id_number'
+    filter_status = request.GET.get('status', 'all')
+    students = Student.objects.with_status(filter_status)
+    students = _search_or_paginate(request, Student, students, STUDENT_SORTS[sort])
+    if _wants_json(request):
+        return _page_json(students, _student_json)
+    
     context = {
         'students': students,
-        'total_students': students.count(),
+        'page': students,
+        'total_students': student_stats()['total_students'],
+        'query': request.GET.get('q', '').strip(),
+        'sort': sort,
+        'filter_status': filter_status,
     }
     return render(request, 'myapp/student_list.html', context)
 
 
 @login_required(login_url='myapp:login')
+@replica_reads
 def student_detail(request, pk):
     if not request.user.is_staff:
         messages.error(request, "You do not have permission to access this page!")
         return redirect('myapp:home')
     
     student = get_object_or_404(Student, pk=pk)
-    issued_books = student.issued_books.all()
-    active_issues = issued_books.filter(is_returned=False)
+    issued_books = list(student.issued_books.select_related('book'))
+    active_issues = [issue for issue in issued_books if not issue.is_returned]
     
     context = {
         'student': student,
         'issued_books': issued_books,
         'active_issues': active_issues,
-        'total_borrowed': active_issues.count(),
+        'total_borrowed': student.active_loan_count,
     }
     return render(request, 'myapp/student_detail.html', context)
 
@@ -332,28 +490,36 @@ def delete_student(request, pk):
 
 # ============= ISSUE/RETURN VIEWS =============
 @login_required(login_url='myapp:login')
+@replica_reads
 def issued_books_list(request):
     if not request.user.is_staff:
         messages.error(request, "You do not have permission to access this page!")
         return redirect('myapp:home')
     
-    issued_books = IssuedBook.objects.all()
-    active_issues = issued_books.filter(is_returned=False)
-    returned_books = issued_books.filter(is_returned=True)
-    
     # Filter by status if provided
     status_filter = request.GET.get('status', 'all')
-    if status_filter == 'active':
-        issued_books = active_issues
-    elif status_filter == 'returned':
-        issued_books = returned_books
-    
+    loans = IssuedBook.objects.with_status(status_filter).select_related('student', 'book')
+    stream = wants_stream(request) and not _wants_json(request)
+    issued_books = None
+    if not stream:
+        issued_books = paginate(request, loans, ISSUED_BOOK_ORDERING, settings.LIBRARY_PAGE_SIZE)
+    if _wants_json(request):
+        return _page_json(issued_books, _issued_book_json)
+    
+    stats = loan_stats()
     context = {
         'issued_books': issued_books,
-        'total_issued': IssuedBook.objects.filter(is_returned=False).count(),
-        'total_returned': IssuedBook.objects.filter(is_returned=True).count(),
+        'page': issued_books,
+        'total_issued': stats['active_issues'],
+        'total_returned': stats['returned_issues'],
         'status_filter': status_filter,
     }
+    if stream:
+        paginator = KeysetPaginator(loans, ISSUED_BOOK_ORDERING, settings.LIBRARY_STREAM_CHUNK_ROWS)
+        return stream_page(
+            request, 'myapp/issued_books_list.html', context,
+            'issued_books', 'myapp/issued_book_rows.html', paginator,
+        )
     return render(request, 'myapp/issued_books_list.html', context)
 
 
@@ -366,17 +532,23 @@ def issue_book(request):
     if request.method == 'POST':
         form = IssuedBookForm(request.POST)
         if form.is_valid():
-            issued_book = form.save()
-            # Reduce book quantity
-            book = issued_book.book
-            book.quantity -= issued_book.quantity
-            book.save()
-            
-            messages.success(
-                request,
-                f"Book '{book.title}' issued to '{issued_book.student.name}' ({issued_book.quantity} copies)"
-            )
-            return redirect('myapp:issued_books_list')
+            # Stock is re-checked atomically; the form's check may be stale by now
+            try:
+                issued_book = issue_copies(
+                    form.cleaned_data['student'],
+                    form.cleaned_data['book'],
+                    form.cleaned_data['quantity'],
+                )
+            except InventoryError as exc:
+                form.add_error(None, str(exc))
+            else:
+                # The receipt is emailed by the worker
+                loan_issued.enqueue(issued_book.pk)
+                messages.success(
+                    request,
+                    f"Book '{issued_book.book.title}' issued to '{issued_book.student.name}' ({issued_book.quantity} copies)"
+                )
+                return redirect('myapp:issued_books_list')
     else:
         form = IssuedBookForm()
     
@@ -394,40 +566,31 @@ def return_book(request, pk):
         messages.error(request, "You do not have permission to access this page!")
         return redirect('myapp:home')
     
-    issued_book = get_object_or_404(IssuedBook, pk=pk)
+    issued_book = get_object_or_404(IssuedBook.objects.select_related('student', 'book'), pk=pk)
     
     if issued_book.is_returned:
         messages.warning(request, "This book has already been returned!")
         return redirect('myapp:issued_books_list')
     
     if request.method == 'POST':
+        outstanding = issued_book.quantity
         form = ReturnBookForm(request.POST, instance=issued_book)
         if form.is_valid():
             quantity_returned = form.cleaned_data['quantity']
+            # The model form copies the submitted quantity onto the instance
+            issued_book.quantity = outstanding
             
-            if quantity_returned > issued_book.quantity:
+            try:
+                return_copies(issued_book, quantity_returned)
+            except InventoryError:
+                issued_book.refresh_from_db(fields=['quantity'])
                 messages.error(request, f"Cannot return more than {issued_book.quantity} copies!")
                 return render(request, 'myapp/return_book_form.html', {'form': form, 'issued_book': issued_book})
             
-            # Update issued book
-            issued_book.quantity -= quantity_returned
-            issued_book.return_date = None  # Will be set when fully returned
-            
-            # If all copies returned, mark as returned
-            if issued_book.quantity == 0:
-                issued_book.is_returned = True
-                issued_book.return_date = timezone.now().date()
-            
-            issued_book.save()
-            
-            # Increase book quantity
-            book = issued_book.book
-            book.quantity += quantity_returned
-            book.save()
-            
+            loan_returned.enqueue(issued_book.pk, quantity_returned)
             messages.success(
                 request,
-                f"'{quantity_returned}' copy/copies of '{book.title}' returned successfully!"
+                f"'{quantity_returned}' copy/copies of '{issued_book.book.title}' returned successfully!"
             )
             return redirect('myapp:issued_books_list')
     else:
@@ -438,238 +601,187 @@ def return_book(request, pk):
         'issued_book': issued_book,
     }
     return render(request, 'myapp/return_book_form.html', context)
-    books = Book.objects.all()
-    context = {
-        'books': books,
-        'total_books': books.count(),
-        'available_books': sum(1 for book in books if book.quantity > 0),
-    }
-    return render(request, 'myapp/book_list.html', context)
-
-
-def create_book(request):
-    if request.method == 'POST':
-        form = BookForm(request.POST)
-        if form.is_valid():
-            form.save()
-            messages.success(request, f"Book '{form.cleaned_data['title']}' created successfully!")
-            return redirect('myapp:book_list')
-    else:
-        form = BookForm()
-    
-    context = {
-        'form': form,
-        'title': 'Add New Book',
-        'button_text': 'Create Book'
-    }
-    return render(request, 'myapp/book_form.html', context)
 
 
-def edit_book(request, pk):
-    book = get_object_or_404(Book, pk=pk)
+def _bulk_loans(request, apply, title, button_text, done_message, note):
+    """Shared body of the bulk issue/return views (form or JSON)."""
+    if request.content_type == 'application/json':
+        if request.method != 'POST':
+            return JsonResponse({'errors': ['POST a JSON body.']}, status=405)
+        try:
+            rows = json.loads(request.body)['items']
+            items = resolve_loan_items(rows)
+            count = apply(items)
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'errors': ['Expected {"items": [{"student", "book", "quantity"}, ...]}.']}, status=400)
+        except ValidationError as exc:
+            return JsonResponse({'errors': exc.messages}, status=400)
+        except InventoryError as exc:
+            return JsonResponse({'errors': [str(exc)]}, status=409)
+        return JsonResponse({'copies': count, 'loans': len(items)})
     
     if request.method == 'POST':
-        form = BookForm(request.POST, instance=book)
+        form = BulkLoanForm(request.POST)
         if form.is_valid():
-            form.save()
-            messages.success(request, f"Book '{form.cleaned_data['title']}' updated successfully!")
-            return redirect('myapp:book_list')
+            items = form.cleaned_data['items']
+            try:
+                count = apply(items)
+            except InventoryError as exc:
+                form.add_error(None, str(exc))
+            else:
+                messages.success(request, done_message.format(copies=count, loans=len(items)))
+                return redirect('myapp:issued_books_list')
     else:
-        form = BookForm(instance=book)
+        form = BulkLoanForm()
     
     context = {
         'form': form,
-        'book': book,
-        'title': f'Edit: {book.title}',
-        'button_text': 'Update Book'
+        'title': title,
+        'subtitle': 'Process many loans in one step',
+        'note': note,
+        'button_text': button_text,
     }
-    return render(request, 'myapp/book_form.html', context)
+    return render(request, 'myapp/issue_book_form.html', context)
 
 
-def delete_book(request, pk):
-    book = get_object_or_404(Book, pk=pk)
+@login_required(login_url='myapp:login')
+def bulk_issue(request):
+    if not request.user.is_staff:
+        messages.error(request, "You do not have permission to access this page!")
+        return redirect('myapp:home')
     
-    if request.method == 'POST':
-        book_title = book.title
-        book.delete()
-        messages.success(request, f"Book '{book_title}' deleted successfully!")
-        return redirect('myapp:book_list')
+    def apply(items):
+        bulk_issue_copies(items)
+        return sum(quantity for _, _, quantity in items)
     
-    context = {
-        'book': book,
-    }
-    return render(request, 'myapp/book_confirm_delete.html', context)
+    return _bulk_loans(
+        request, apply, 'Bulk Issue Books', 'Issue All',
+        "Issued {copies} copies across {loans} loans.",
+        "Stock is checked for the whole batch; if any book is short, nothing is issued.",
+    )
 
 
-# ============= STUDENT VIEWS =============
-def student_list(request):
-    students = Student.objects.all()
-    context = {
-        'students': students,
-        'total_students': students.count(),
-    }
-    return render(request, 'myapp/student_list.html', context)
-
-
-def student_detail(request, pk):
-    student = get_object_or_404(Student, pk=pk)
-    issued_books = student.issued_books.all()
-    active_issues = issued_books.filter(is_returned=False)
-    
-    context = {
-        'student': student,
-        'issued_books': issued_books,
-        'active_issues': active_issues,
-        'total_borrowed': active_issues.count(),
-    }
-    return render(request, 'myapp/student_detail.html', context)
-
-
-def create_student(request):
-    if request.method == 'POST':
-        form = StudentForm(request.POST)
-        if form.is_valid():
-            student = form.save()
-            messages.success(request, f"Student '{student.name}' created successfully!")
-            return redirect('myapp:student_list')
-    else:
-        form = StudentForm()
+@login_required(login_url='myapp:login')
+def bulk_return(request):
+    if not request.user.is_staff:
+        messages.error(request, "You do not have permission to access this page!")
+        return redirect('myapp:home')
     
-    context = {
-        'form': form,
-        'title': 'Add New Student',
-        'button_text': 'Create Student'
-    }
-    return render(request, 'myapp/student_form.html', context)
+    return _bulk_loans(
+        request, bulk_return_copies, 'Bulk Return Books', 'Return All',
+        "Returned {copies} copies across {loans} entries.",
+        "Copies are taken from each student's oldest active loans of that book first.",
+    )
 
 
-def edit_student(request, pk):
-    student = get_object_or_404(Student, pk=pk)
+# ============= IMPORT VIEWS =============
+@login_required(login_url='myapp:login')
+def import_catalogue(request):
+    if not request.user.is_staff:
+        messages.error(request, "You do not have permission to access this page!")
+        return redirect('myapp:home')
     
     if request.method == 'POST':
-        form = StudentForm(request.POST, instance=student)
+        form = CatalogueImportForm(request.POST, request.FILES)
         if form.is_valid():
-            form.save()
-            messages.success(request, f"Student '{student.name}' updated successfully!")
-            return redirect('myapp:student_detail', pk=student.pk)
+            kind = form.cleaned_data['kind']
+            upload = form.cleaned_data['file']
+            # Read the upload as a text stream; large files stay on disk
+            stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+            try:
+                result = import_records(kind, stream, guess_format(upload.name))
+            except UnicodeDecodeError:
+                messages.error(request, "The file is not UTF-8 text.")
+                return redirect('myapp:import_catalogue')
+            
+            messages.success(
+                request,
+                f"Imported {result.imported} {kind} from {result.rows} rows ({result.error_count} rejected)."
+            )
+            for line, message in result.errors[:20]:
+                messages.warning(request, f"Line {line}: {message}")
+            return redirect('myapp:import_catalogue')
     else:
-        form = StudentForm(instance=student)
+        form = CatalogueImportForm()
     
     context = {
         'form': form,
-        'student': student,
-        'title': f'Edit: {student.name}',
-        'button_text': 'Update Student'
+        'title': 'Import Catalogue',
+        'subtitle': 'Load books or students from a CSV or JSON-lines file',
+        'note': 'Rows whose ISBN or ID number already exists update that record.',
+        'button_text': 'Import',
+        'back_url': reverse('myapp:librarian_dashboard'),
+        'back_text': 'Back to Dashboard',
     }
-    return render(request, 'myapp/student_form.html', context)
+    return render(request, 'myapp/issue_book_form.html', context)
 
 
-def delete_student(request, pk):
-    student = get_object_or_404(Student, pk=pk)
+# ============= EXPORT VIEWS =============
+@login_required(login_url='myapp:login')
+def export_data(request, name):
+    """Stream loans, books or students as CSV or JSON lines."""
+    if not request.user.is_staff:
+        messages.error(request, "You do not have permission to access this page!")
+        return redirect('myapp:home')
     
-    if request.method == 'POST':
-        student_name = student.name
-        student.delete()
-        messages.success(request, f"Student '{student_name}' deleted successfully!")
-        return redirect('myapp:student_list')
+    if name not in EXPORTS:
+        raise Http404("Unknown export")
     
-    context = {
-        'student': student,
-    }
-    return render(request, 'myapp/student_confirm_delete.html', context)
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        fmt = 'csv'
+    return export_response(name, fmt, status=request.GET.get('status', 'all'))
 
 
-# ============= ISSUE/RETURN VIEWS =============
-def issued_books_list(request):
-    issued_books = IssuedBook.objects.all()
-    active_issues = issued_books.filter(is_returned=False)
-    returned_books = issued_books.filter(is_returned=True)
+# ============= LOOKUP VIEWS =============
+def _lookup(request, queryset, prefix_fields, ordering, label):
+    """Paginated prefix search used by the issue form's typeahead widgets."""
+    if not request.user.is_staff:
+        return JsonResponse({'errors': ['Permission denied.']}, status=403)
     
-    # Filter by status if provided
-    status_filter = request.GET.get('status', 'all')
-    if status_filter == 'active':
-        issued_books = active_issues
-    elif status_filter == 'returned':
-        issued_books = returned_books
+    term = request.GET.get('q', '').strip()
+    if term:
+        # istartswith keeps the LIKE 'term%' shape that can use the column indexes
+        condition = Q()
+        for field in prefix_fields:
+            condition |= Q(**{f'{field}__istartswith': term})
+        queryset = queryset.filter(condition)
     
-    context = {
-        'issued_books': issued_books,
-        'total_issued': IssuedBook.objects.filter(is_returned=False).count(),
-        'total_returned': IssuedBook.objects.filter(is_returned=True).count(),
-        'status_filter': status_filter,
-    }
-    return render(request, 'myapp/issued_books_list.html', context)
+    page = paginate(request, queryset, ordering, LOOKUP_PAGE_SIZE)
+    return JsonResponse({
+        'results': [{'id': obj.pk, 'text': label(obj)} for obj in page],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    })
 
 
-def issue_book(request):
-    if request.method == 'POST':
-        form = IssuedBookForm(request.POST)
-        if form.is_valid():
-            issued_book = form.save()
-            # Reduce book quantity
-            book = issued_book.book
-            book.quantity -= issued_book.quantity
-            book.save()
-            
-            messages.success(
-                request,
-                f"Book '{book.title}' issued to '{issued_book.student.name}' ({issued_book.quantity} copies)"
-            )
-            return redirect('myapp:issued_books_list')
-    else:
-        form = IssuedBookForm()
-    
-    context = {
-        'form': form,
-        'title': 'Issue Book',
-        'button_text': 'Issue Book'
-    }
-    return render(request, 'myapp/issue_book_form.html', context)
+@login_required(login_url='myapp:login')
+def lookup_students(request):
+    return _lookup(
+        request,
+        Student.objects.only('pk', 'name', 'id_number'),
+        ['id_number', 'name'],
+        ('id_number',),
+        str,
+    )
 
 
-def return_book(request, pk):
-    issued_book = get_object_or_404(IssuedBook, pk=pk)
-    
-    if issued_book.is_returned:
-        messages.warning(request, "This book has already been returned!")
-        return redirect('myapp:issued_books_list')
-    
-    if request.method == 'POST':
-        form = ReturnBookForm(request.POST, instance=issued_book)
-        if form.is_valid():
-            quantity_returned = form.cleaned_data['quantity']
-            
-            if quantity_returned > issued_book.quantity:
-                messages.error(request, f"Cannot return more than {issued_book.quantity} copies!")
-                return render(request, 'myapp/return_book_form.html', {'form': form, 'issued_book': issued_book})
-            
-            # Update issued book
-            issued_book.quantity -= quantity_returned
-            issued_book.return_date = None  # Will be set when fully returned
-            
-            # If all copies returned, mark as returned
-            if issued_book.quantity == 0:
-                issued_book.is_returned = True
-                from django.utils import timezone
-                issued_book.return_date = timezone.now().date()
-            
-            issued_book.save()
-            
-            # Increase book quantity
-            book = issued_book.book
-            book.quantity += quantity_returned
-            book.save()
-            
-            messages.success(
-                request,
-                f"'{quantity_returned}' copy/copies of '{book.title}' returned successfully!"
-            )
-            return redirect('myapp:issued_books_list')
-    else:
-        form = ReturnBookForm(instance=issued_book)
-    
-    context = {
-        'form': form,
-        'issued_book': issued_book,
-    }
-    return render(request, 'myapp/return_book_form.html', context)
+@login_required(login_url='myapp:login')
+def lookup_books(request):
+    return _lookup(
+        request,
+        Book.objects.only('pk', 'title', 'author', 'isbn', 'quantity'),
+        ['isbn', 'title', 'author'],
+        ('title', 'pk'),
+        lambda book: f"{book.title} by {book.author} ({book.isbn}) - {book.quantity} available",
+    )
+
+
+# ============= METRICS VIEWS =============
+def metrics(request):
+    """Prometheus scrape endpoint, answered only for LIBRARY_METRICS_ALLOWED_IPS."""
+    if not settings.LIBRARY_METRICS:
+        raise Http404("Metrics are disabled.")
+    if client_address(request) not in settings.LIBRARY_METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden("Metrics are only served to allowed addresses.")
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
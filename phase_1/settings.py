@@ -41,11 +41,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'myapp.metrics.MetricsMiddleware',
+    'myapp.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'myapp.assets.StaticAssetsMiddleware',
+    'myapp.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'myapp.routers.ReadYourWritesMiddleware',
+    'myapp.middleware.StudentProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -73,17 +79,52 @@ WSGI_APPLICATION = 'phase_1.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Connections come from a per-process pool (see myapp.dbpool); Django hands
+# each one back at the end of the request (CONN_MAX_AGE = 0) and the next
+# request reuses it without connecting again.  Remove OPTIONS['pool'] to
+# connect per request as the stock backend does.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'myapp.backends.mysql',
         'NAME': 'library_phase_1',
         'USER': 'root',
         'PASSWORD': '',
         'HOST': 'localhost',
         'PORT': '3306',
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {
+            'pool': {
+                'max_size': 10,
+                'timeout': 10,
+                'max_lifetime': 3600,
+                'max_idle': 600,
+                'check': True,
+            },
+        },
     }
 }
 
+# Read replicas are routed to by myapp.routers (see LIBRARY_READ_REPLICAS)
+DATABASE_ROUTERS = ['myapp.routers.PrimaryReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'library-default',
+    },
+    # Visible to every worker process on the host; point LIBRARY_STATS_CACHE
+    # and LIBRARY_FRAGMENT_CACHE here when running several workers without
+    # memcached or redis.
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -120,8 +161,150 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATICFILES_DIRS = [BASE_DIR / 'static']
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'myapp.assets.CompressedManifestStaticFilesStorage',
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Library application settings
+
+# Rows per page for the cursor-paginated book, student and loan listings
+LIBRARY_PAGE_SIZE = 25
+
+
+# Loan policy (see myapp.loan_policy): a loan is due this many days after
+# it is issued, or after the period given for the student's department,
+# e.g. {'humanities': 21}.  The due date is fixed when the loan is issued.
+LIBRARY_LOAN_PERIOD_DAYS = 14
+LIBRARY_LOAN_PERIOD_DAYS_BY_DEPARTMENT = {}
+
+# Most overdue loans and students listed on the librarian dashboard, from
+# a snapshot kept in LIBRARY_STATS_CACHE for up to MAX_AGE seconds.  Run the
+# overdue_report command (it prints the full lists) more often than that,
+# e.g. from cron, so no request has to compute the snapshot.
+LIBRARY_OVERDUE_LIST_SIZE = 10
+LIBRARY_OVERDUE_REPORT_MAX_AGE = 15 * 60
+
+# Cache alias and timeout (seconds) for the librarian dashboard counters.
+# Entries are also invalidated by model signals, so the timeout only
+# bounds staleness from writes that bypass the ORM.
+LIBRARY_STATS_CACHE = 'default'
+LIBRARY_STATS_CACHE_TIMEOUT = 300
+
+# Search backend for books and students: 'mysql' (FULLTEXT indexes),
+# 'memory' (in-process inverted index) or 'auto' to pick by database.
+# LIBRARY_SEARCH_LIMIT caps the number of ranked results returned.
+LIBRARY_SEARCH_BACKEND = 'auto'
+LIBRARY_SEARCH_LIMIT = 50
+
+# Sampled request profiling (wall, SQL and template time per view), sent
+# as Server-Timing headers and to a rotating JSON-lines log.  Off by
+# default; when on, SAMPLE_RATE is the fraction of requests profiled.
+LIBRARY_PROFILING = False
+LIBRARY_PROFILING_SAMPLE_RATE = 0.01
+LIBRARY_PROFILING_LOG = BASE_DIR / 'logs' / 'profiling.jsonl'
+LIBRARY_PROFILING_LOG_MAX_BYTES = 10 * 1024 * 1024
+LIBRARY_PROFILING_LOG_BACKUPS = 5
+
+# Prometheus metrics served at /metrics to the addresses listed below.
+# Every worker writes its counters to its own file in METRICS_DIR at most
+# every FLUSH_INTERVAL seconds; a scrape merges all of them and folds the
+# files of exited processes into archive.json there.  Behind a
+# reverse proxy, list the proxy's address in TRUSTED_PROXIES so the
+# client's address is taken from X-Forwarded-For; otherwise the proxy's
+# own address is checked and every request through it is allowed or
+# refused alike.
+LIBRARY_METRICS = True
+LIBRARY_METRICS_DIR = BASE_DIR / 'metrics'
+LIBRARY_METRICS_FLUSH_INTERVAL = 5
+LIBRARY_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+LIBRARY_METRICS_TRUSTED_PROXIES = []
+
+# Cache alias and timeout (seconds) for the cached book and loan table
+# fragments and their version numbers (see myapp.fragments).  A change to
+# the underlying rows outdates a fragment at once; the timeout only
+# decides how long outdated entries occupy the cache.
+LIBRARY_FRAGMENT_CACHE = 'default'
+LIBRARY_FRAGMENT_CACHE_TIMEOUT = 3600
+
+# Static files collected into STATIC_ROOT are served by the application
+# (see myapp.assets) while STATIC_SERVE is on; turn it off when a front-end
+# server serves STATIC_ROOT.  Content-hashed names are cached by browsers
+# for MAX_AGE seconds.  collectstatic writes gzip (and, with the brotli
+# package, brotli) copies of text files of at least COMPRESS_MIN_SIZE bytes.
+LIBRARY_STATIC_SERVE = True
+LIBRARY_STATIC_MAX_AGE = 365 * 24 * 60 * 60
+LIBRARY_STATIC_COMPRESS_MIN_SIZE = 256
+
+# Gzip compression of responses of these content types (see
+# myapp.middleware.CompressionMiddleware); buffered responses smaller than
+# MIN_SIZE bytes are sent as they are.
+LIBRARY_COMPRESSION = True
+LIBRARY_COMPRESSION_MIN_SIZE = 1024
+LIBRARY_COMPRESSION_TYPES = ['text/html', 'application/json', 'application/x-ndjson', 'text/csv']
+
+# Rows rendered and sent per chunk when ?stream=1 shows a whole book list
+# or loan history (see myapp.streaming)
+LIBRARY_STREAM_CHUNK_ROWS = 500
+
+# Serve the read-heavy pages with their native async views (see
+# myapp.async_views).  Turn on when running under ASGI (phase_1.asgi); under
+# WSGI each async view would need an event loop of its own.  With
+# CONCURRENT_QUERIES a page's independent queries run at the same time, each
+# on a pooled connection of its own.
+LIBRARY_ASYNC_VIEWS = False
+LIBRARY_ASYNC_CONCURRENT_QUERIES = True
+
+# Aliases in DATABASES that replicate 'default', e.g.
+#     'replica1': {**DATABASES['default'], 'HOST': 'replica1.internal', 'TEST': {'MIRROR': 'default'}}
+# The list and dashboard pages read from one of them (see myapp.routers);
+# writes always go to 'default'.  A replica more than MAX_LAG seconds behind,
+# as measured every LAG_CHECK_INTERVAL seconds, is skipped.  A session reads
+# from the primary for STICKY_SECONDS after each of its POSTs; keep it at
+# least MAX_LAG + LAG_CHECK_INTERVAL so users always see their own writes.
+LIBRARY_READ_REPLICAS = []
+LIBRARY_REPLICA_MAX_LAG = 5
+LIBRARY_REPLICA_LAG_CHECK_INTERVAL = 5
+LIBRARY_REPLICA_STICKY_SECONDS = 15
+
+# Background tasks (see myapp.tasks), run by `manage.py run_worker`.  A
+# worker runs up to CONCURRENCY tasks at a time and looks for new ones every
+# POLL_INTERVAL seconds.  A failing task is retried after RETRY_DELAY
+# seconds, doubled on each attempt, up to MAX_ATTEMPTS runs in all; one
+# still running after TIMEOUT seconds is taken to have lost its worker.
+# Finished tasks are deleted after KEEP_DAYS.
+LIBRARY_TASK_CONCURRENCY = 4
+LIBRARY_TASK_POLL_INTERVAL = 1.0
+LIBRARY_TASK_MAX_ATTEMPTS = 3
+LIBRARY_TASK_RETRY_DELAY = 30
+LIBRARY_TASK_TIMEOUT = 15 * 60
+LIBRARY_TASK_KEEP_DAYS = 7
+
+# Jobs the workers enqueue on a cron schedule: minute, hour, day of month,
+# month and day of week, in TIME_ZONE.  The overdue report is refreshed
+# more often than LIBRARY_OVERDUE_REPORT_MAX_AGE so pages never compute it.
+LIBRARY_TASK_SCHEDULE = {
+    'overdue-reminders': {'task': 'myapp.jobs.send_overdue_reminders', 'cron': '0 8 * * *'},
+    'overdue-report': {'task': 'myapp.jobs.refresh_overdue_report', 'cron': '*/10 * * * *'},
+    'nightly-rollup': {'task': 'myapp.jobs.nightly_rollup', 'cron': '1 0 * * *'},
+    'reconcile-counters': {'task': 'myapp.jobs.reconcile_loan_counters', 'cron': '30 2 * * *'},
+    'prune-tasks': {'task': 'myapp.jobs.prune_tasks', 'cron': '0 3 * * 0'},
+}
+
+# Loan receipts and overdue reminders are printed by the console backend;
+# configure SMTP (EMAIL_HOST etc.) to send them.
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = 'library@localhost'